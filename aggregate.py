@@ -0,0 +1,169 @@
+'''
+Columnar aggregation of a snapshot's listings into one row per tracked item.
+
+Listings are first collected into the four typed columns of SnapshotColumns,
+doing no more per listing than reading its fields and dropping untracked
+items unless the whole snapshot is being archived. The columns are then
+reduced in one batched pass: every listing gets an integer item key, the
+tracked ones are sorted by key and unit price and each item's run of rows is
+folded into its price statistics.
+
+Besides the cheapest price, items get quantity weighted percentiles and the
+volume weighted price of the cheapest share of units listed, which a single
+listing posted far below the rest of the market cannot drag down.
+'''
+COPPER_PER_GOLD = 10000
+# Share of the listed units averaged into the volume weighted price
+CHEAPEST_SHARE = 0.2
+
+
+def item_key(item_id, context=0):
+    # Items crafted in another context are listed as different items.
+    # A missing context is collected as 0.
+    return item_id << 16 | context
+
+
+def parse_item(id):
+    # '12345' or '12345-3' (item id and context) to an item key
+    item_id, _, context = str(id).partition('-')
+    return item_key(int(item_id), int(context) if context else 0)
+
+
+def collect(auctions, columns, keys=None):
+    # Only listings with an integer unit price (or buyout) and a positive
+    # integer quantity count. With `keys` (see item_key) listings of other
+    # items are dropped too, so only tracked items take up memory.
+    item_ids = columns.item_ids.append
+    contexts = columns.contexts.append
+    prices = columns.prices.append
+    quantities = columns.quantities.append
+    for auction in auctions:
+        price = auction.get('unit_price')
+        if price is None:
+            price = auction.get('buyout')
+        quantity = auction['quantity']
+        if type(price) is int and type(quantity) is int and quantity > 0:
+            item = auction['item']
+            item_id = item['id']
+            context = item.get('context', 0)
+            if keys is not None and item_id << 16 | context not in keys:
+                continue
+            item_ids(item_id)
+            contexts(context)
+            prices(price)
+            quantities(quantity)
+    return columns
+
+
+def percentile(listings, total, share):
+    # Unit price at which `share` of all listed units are cheaper or equal,
+    # listings: ascending (price, quantity)
+    wanted = total * share
+    seen = 0
+    for (price, quantity) in listings:
+        seen += quantity
+        if seen >= wanted:
+            return price
+    return listings[-1][0]
+
+
+def cheapest_average(listings, total, share):
+    # Volume weighted price of the cheapest `share` of units, at least one
+    wanted = max(int(total * share), 1)
+    cost = 0
+    taken = 0
+    for (price, quantity) in listings:
+        take = min(quantity, wanted - taken)
+        cost += take * price
+        taken += take
+        if taken >= wanted:
+            break
+    return cost // taken
+
+
+def price_stats(listings, share=CHEAPEST_SHARE):
+    # listings: ascending (unit price, quantity) in copper, all in gold
+    total = sum(q for (p, q) in listings)
+    levels = {}
+    for (price, quantity) in listings:
+        gold = price // COPPER_PER_GOLD
+        levels[gold] = levels.get(gold, 0) + quantity
+    return {
+        'price': listings[0][0] // COPPER_PER_GOLD,
+        'quantity': total,
+        'levels': levels,
+        'p10': percentile(listings, total, 0.10) // COPPER_PER_GOLD,
+        'p25': percentile(listings, total, 0.25) // COPPER_PER_GOLD,
+        'vwap': cheapest_average(listings, total, share) // COPPER_PER_GOLD
+    }
+
+
+def aggregate_columns(columns, items, share=CHEAPEST_SHARE):
+    # {id: stats} for every id in `items` ('12345' or '12345-3') listed in
+    # the snapshot, see price_stats. numpy is optional, without it the same
+    # reduction runs in plain Python.
+    ids = {parse_item(id): id for id in items}
+    try:
+        import numpy
+    except ImportError:
+        grouped = group_listings(columns, ids)
+    else:
+        grouped = group_listings_numpy(numpy, columns, ids, share)
+    aggregated = {}
+    for (key, stats) in grouped:
+        stats['id'] = ids[key]
+        aggregated[ids[key]] = stats
+    return aggregated
+
+
+def group_listings(columns, ids, share=CHEAPEST_SHARE):
+    groups = {}
+    for (item_id, context, price, quantity) in zip(columns.item_ids, columns.contexts, columns.prices,
+                                                   columns.quantities):
+        key = item_id << 16 | context
+        if key in ids:
+            groups.setdefault(key, []).append((price, quantity))
+    for (key, listings) in groups.items():
+        listings.sort()
+        yield (key, price_stats(listings, share))
+
+
+def group_listings_numpy(numpy, columns, ids, share=CHEAPEST_SHARE):
+    # The same statistics as price_stats, for every item at once over the
+    # columns sorted by item key and unit price.
+    def column(values):
+        return numpy.frombuffer(values, dtype=values.typecode).astype(numpy.int64)
+    keys = column(columns.item_ids) << 16 | column(columns.contexts)
+    tracked = numpy.isin(keys, numpy.fromiter(ids, numpy.int64, len(ids)))
+    (keys, prices, quantities) = (keys[tracked], column(columns.prices)[tracked],
+                                  column(columns.quantities)[tracked])
+    if len(keys) == 0:
+        return
+    order = numpy.lexsort((prices, keys))
+    (keys, prices, quantities) = (keys[order], prices[order], quantities[order])
+    starts = numpy.flatnonzero(numpy.r_[True, keys[1:] != keys[:-1]])
+    counts = numpy.diff(numpy.r_[starts, len(keys)])
+    totals = numpy.add.reduceat(quantities, starts)
+    # Units listed before each row, overall and within its own item
+    seen = numpy.cumsum(quantities)
+    before = seen - quantities
+    within = before - numpy.repeat(before[starts], counts)
+
+    def percentile(share):
+        return prices[numpy.searchsorted(seen, before[starts] + totals * share)]
+    wanted = numpy.maximum((totals * share).astype(numpy.int64), 1)
+    take = numpy.clip(numpy.repeat(wanted, counts) - within, 0, quantities)
+    vwap = numpy.add.reduceat(prices * take, starts) // numpy.minimum(wanted, totals)
+    # Quantity listed at every gold price level of every item
+    gold = prices // COPPER_PER_GOLD
+    levels = numpy.flatnonzero(numpy.r_[True, (keys[1:] != keys[:-1]) | (gold[1:] != gold[:-1])])
+    level_prices = gold[levels].tolist()
+    level_quantities = numpy.add.reduceat(quantities, levels).tolist()
+    bounds = numpy.searchsorted(levels, numpy.r_[starts, len(keys)]).tolist()
+    item_levels = [dict(zip(level_prices[a:b], level_quantities[a:b])) for (a, b) in zip(bounds, bounds[1:])]
+    for (key, price, total, p10, p25, average, item_level) in zip(
+            keys[starts].tolist(), gold[starts].tolist(), totals.tolist(),
+            (percentile(0.10) // COPPER_PER_GOLD).tolist(), (percentile(0.25) // COPPER_PER_GOLD).tolist(),
+            (vwap // COPPER_PER_GOLD).tolist(), item_levels):
+        yield (key, {'price': price, 'quantity': total, 'levels': item_level, 'p10': p10, 'p25': p25,
+                     'vwap': average})
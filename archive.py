@@ -0,0 +1,200 @@
+'''
+Columnar on-disk archive of raw auction house snapshots.
+
+Every snapshot is one file per connected realm and snapshot time holding
+four fixed width little-endian columns: item id, item context, unit price
+(copper) and quantity, sorted by item. Uncompressed files are read through
+mmap without copying, older ones can be compacted with zlib per column.
+'''
+import calendar
+import mmap
+import os
+import struct
+import sys
+import time
+import zlib
+from array import array
+
+MAGIC = b'EASNAP01'
+COMPRESSED = 1
+# name, array typecode
+COLUMNS = [
+    ('item_ids', 'i'),
+    ('contexts', 'h'),
+    ('prices', 'q'),
+    ('quantities', 'i')
+]
+HEADER = struct.Struct('<8sIIq')  # magic, flags, rows, unix timestamp
+COLUMN = struct.Struct('<QQ')  # offset, stored length
+ALIGNMENT = 8
+
+
+class SnapshotColumns:
+    '''
+    Append-only raw listings of one snapshot, kept in typed arrays while it
+    is being streamed in.
+    '''
+
+    def __init__(self):
+        self.item_ids = array('i')
+        self.contexts = array('h')
+        self.prices = array('q')
+        self.quantities = array('i')
+
+    def append(self, item_id, context, price, quantity):
+        self.item_ids.append(item_id)
+        self.contexts.append(context)
+        self.prices.append(price)
+        self.quantities.append(quantity)
+
+    def __len__(self):
+        return len(self.item_ids)
+
+    def sorted(self):
+        order = sorted(range(len(self)), key=lambda i: (self.item_ids[i], self.contexts[i], self.prices[i]))
+        columns = SnapshotColumns()
+        for (name, typecode) in COLUMNS:
+            values = getattr(self, name)
+            setattr(columns, name, array(typecode, [values[i] for i in order]))
+        return columns
+
+
+class Snapshot:
+    def __init__(self, path, realm, timestamp):
+        self.path = path
+        self.realm = realm
+        self.timestamp = timestamp
+        self.__file = None
+        self.__map = None
+
+    def __enter__(self):
+        self.__file = open(self.path, 'rb')
+        try:
+            self.__map = mmap.mmap(self.__file.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, self.flags, self.rows, self.timestamp = HEADER.unpack_from(self.__map, 0)
+            if magic != MAGIC:
+                raise ValueError(f'{self.path} is not an auction snapshot')
+        except BaseException:
+            if self.__map is not None:
+                self.__map.close()
+                self.__map = None
+            self.__file.close()
+            raise
+        view = memoryview(self.__map)
+        self.__views = [view]
+        for (index, (name, typecode)) in enumerate(COLUMNS):
+            offset, length = COLUMN.unpack_from(self.__map, HEADER.size + index * COLUMN.size)
+            if self.flags & COMPRESSED or sys.byteorder == 'big':
+                values = array(typecode)
+                data = view[offset:offset + length]
+                values.frombytes(zlib.decompress(data) if self.flags & COMPRESSED else data)
+                if sys.byteorder == 'big':
+                    values.byteswap()
+                data.release()
+            else:
+                # Zero copy, the column is a typed view straight into the mapping
+                values = view[offset:offset + length].cast(typecode)
+                self.__views.append(values)
+            setattr(self, name, values)
+        return self
+
+    def __exit__(self, type, value, traceback):
+        for (name, _) in COLUMNS:
+            setattr(self, name, None)
+        for view in reversed(self.__views):
+            view.release()
+        self.__map.close()
+        self.__file.close()
+
+    def items(self, item_id):
+        # Row range of one item, the columns are sorted by item id
+        low, high = 0, self.rows
+        while low < high:
+            mid = (low + high) // 2
+            if self.item_ids[mid] < item_id:
+                low = mid + 1
+            else:
+                high = mid
+        start = low
+        high = self.rows
+        while low < high:
+            mid = (low + high) // 2
+            if self.item_ids[mid] <= item_id:
+                low = mid + 1
+            else:
+                high = mid
+        return range(start, low)
+
+
+class SnapshotArchive:
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, realm, timestamp):
+        # Named to the second, several snapshots can land in the same hour
+        return os.path.join(self.root, str(realm), time.strftime('%Y%m%d%H%M%S', time.gmtime(timestamp)) + '.snap')
+
+    def write(self, realm, timestamp, columns, compress=False):
+        columns = columns.sorted()
+        path = self.path(realm, timestamp)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        blobs = []
+        for (name, _) in COLUMNS:
+            values = getattr(columns, name)
+            if sys.byteorder == 'big':
+                values = array(values.typecode, values)
+                values.byteswap()
+            data = values.tobytes()
+            blobs.append(zlib.compress(data) if compress else data)
+        offset = HEADER.size + COLUMN.size * len(COLUMNS)
+        directory = []
+        for blob in blobs:
+            offset += -offset % ALIGNMENT
+            directory.append((offset, len(blob)))
+            offset += len(blob)
+        # Written next to the final file and renamed so readers never see a partial snapshot
+        partial = path + '.partial'
+        with open(partial, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, COMPRESSED if compress else 0, len(columns), int(timestamp)))
+            for entry in directory:
+                f.write(COLUMN.pack(*entry))
+            for ((offset, _), blob) in zip(directory, blobs):
+                f.write(b'\0' * (offset - f.tell()))
+                f.write(blob)
+        os.replace(partial, path)
+        return path
+
+    def snapshots(self, realm, start=None, end=None):
+        # Snapshots of a realm with start <= timestamp < end, oldest first
+        directory = os.path.join(self.root, str(realm))
+        if not os.path.isdir(directory):
+            return
+        for name in sorted(os.listdir(directory)):
+            if not name.endswith('.snap'):
+                continue
+            # Older archives are named to the hour
+            named = calendar.timegm(time.strptime(name[:-5], '%Y%m%d%H' if len(name) == 15 else '%Y%m%d%H%M%S'))
+            if start is not None and named + 3600 <= start:
+                continue
+            if end is not None and named >= end:
+                continue
+            snapshot = Snapshot(os.path.join(directory, name), realm, named)
+            with snapshot:
+                timestamp = snapshot.timestamp
+            if (start is None or timestamp >= start) and (end is None or timestamp < end):
+                yield snapshot
+
+    def compact(self, realm, before):
+        # Compress snapshots older than `before` that are still stored raw
+        compacted = 0
+        for snapshot in list(self.snapshots(realm, end=before)):
+            with snapshot:
+                if snapshot.flags & COMPRESSED:
+                    continue
+                columns = SnapshotColumns()
+                for (name, typecode) in COLUMNS:
+                    setattr(columns, name, array(typecode, getattr(snapshot, name)))
+                timestamp = snapshot.timestamp
+            self.write(realm, timestamp, columns, compress=True)
+            compacted += 1
+        return compacted
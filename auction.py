@@ -1,6 +1,12 @@
 class Auction:
-    def __init__(self, id, quantity, price, datetime):
+    def __init__(self, id, quantity, price, datetime, ladder=None, p10=None, p25=None, vwap=None):
         self.id = id
         self.quantity = quantity
         self.price = price
         self.datetime = datetime
+        self.ladder = ladder
+        # Robust prices, see aggregate.price_stats. None for vendor reagents
+        # and snapshots recorded before they were kept.
+        self.p10 = p10
+        self.p25 = p25
+        self.vwap = vwap
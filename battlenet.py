@@ -2,10 +2,16 @@ from authlib.integrations.requests_client import OAuth2Session
 from requests.adapters import HTTPAdapter
 from requests.packages.urllib3.util.retry import Retry
 
+from jsonstream import iter_array
+from metrics import metrics
+from ratelimit import rate_limiter
+
 
 class BNetClient:
-    def __init__(self, client_id, client_secret, url_base='https://us.api.blizzard.com', scope='wow.profile'):
+    def __init__(self, client_id, client_secret, url_base='https://us.api.blizzard.com', scope='wow.profile', pool_size=10,
+                 limiter=rate_limiter, token=None):
         self.url_base = url_base
+        self.limiter = limiter
         self.client = OAuth2Session(client_id, client_secret, scope=scope)
         retry_strategy = Retry(
             total=3,
@@ -13,37 +19,88 @@ class BNetClient:
             status_forcelist=[429, 500, 502, 503, 504],
             method_whitelist=["HEAD", "GET", "OPTIONS"]
         )
-        adapter = HTTPAdapter(max_retries=retry_strategy)
+        # The session is shared by sync workers, so size the connection pool to match
+        adapter = HTTPAdapter(max_retries=retry_strategy, pool_connections=pool_size, pool_maxsize=pool_size)
         self.client.mount('https://', adapter)
-        self.client.fetch_token('https://us.battle.net/oauth/token',
-                                grant_type='client_credentials')
+        # Reuse a cached access token when one is given instead of paying for
+        # a round trip to the OAuth endpoint.
+        if token is not None:
+            self.client.token = token
+        else:
+            with metrics.span('battlenet.token_fetch'):
+                self.client.fetch_token('https://us.battle.net/oauth/token',
+                                        grant_type='client_credentials')
+
+    @property
+    def token(self):
+        return self.client.token
+
+    def __get(self, url, **kwargs):
+        with metrics.span('battlenet.rate_limit_wait'):
+            self.limiter.acquire()
+        with metrics.span('battlenet.request'):
+            response = self.client.get(url, **kwargs)
+        metrics.incr('http_requests')
+        # Retries happen inside urllib3, its history records every failed attempt
+        retries = getattr(response.raw, 'retries', None)
+        if retries is not None and len(retries.history) > 0:
+            metrics.incr('http_retries', len(retries.history))
+            metrics.incr('http_429', sum(1 for h in retries.history if h.status == 429))
+        if response.status_code == 429:
+            metrics.incr('http_429')
+        return response
 
     def get_auction(self, connected_realm):
-        response = self.client.get(
+        response = self.__get(
             f'{self.url_base}/data/wow/connected-realm/{connected_realm}/auctions?namespace=dynamic-us&locale=en_US')
         response.raise_for_status()
         return response.json()
 
+    def get_auction_stream(self, connected_realm, if_modified_since=None, chunk_size=64 * 1024):
+        # Returns the snapshot's Last-Modified header along with a generator
+        # streaming one auction at a time, or None for the auctions when the
+        # snapshot has not changed since `if_modified_since`.
+        headers = {'If-Modified-Since': if_modified_since} if if_modified_since is not None else {}
+        response = self.__get(
+            f'{self.url_base}/data/wow/connected-realm/{connected_realm}/auctions?namespace=dynamic-us&locale=en_US',
+            headers=headers, stream=True)
+        if response.status_code == 304:
+            response.close()
+            return (if_modified_since, None)
+        response.raise_for_status()
+        return (response.headers.get('Last-Modified'), self.__iter_auctions(response, chunk_size))
+
+    def __iter_auctions(self, response, chunk_size):
+        with response:
+            # Decode time includes the download time spent waiting for each chunk
+            chunks = metrics.timed_iter('battlenet.auctions_download', self.__count_bytes(response, chunk_size))
+            yield from metrics.timed_iter('battlenet.auctions_decode', iter_array(chunks, 'auctions'))
+
+    def __count_bytes(self, response, chunk_size):
+        for chunk in response.iter_content(chunk_size=chunk_size):
+            metrics.incr('http_bytes_downloaded', len(chunk))
+            yield chunk
+
     def get_item(self, item_id):
-        response = self.client.get(
+        response = self.__get(
             f'{self.url_base}/data/wow/item/{item_id}?namespace=static-us&locale=en_US')
         response.raise_for_status()
         return response.json()
 
     def get_professions(self):
-        response = self.client.get(
+        response = self.__get(
             f'{self.url_base}/data/wow/profession/index?namespace=static-us&locale=en_US')
         response.raise_for_status()
         return response.json()
 
     def get_profession(self, profession_id):
-        response = self.client.get(
+        response = self.__get(
             f'{self.url_base}/data/wow/profession/{profession_id}?namespace=static-us&locale=en_US')
         response.raise_for_status()
         return response.json()
 
     def get_realms(self):
-        response = self.client.get(
+        response = self.__get(
             f'{self.url_base}/data/wow/realm/index?namespace=dynamic-us&locale=en_US')
         response.raise_for_status()
         return response.json()
@@ -54,21 +111,32 @@ class BNetClient:
         realms = [(r['name'], r['connected_realm']['href']) for r in realms if r['is_tournament'] == False]
         return [(name, cr[cr.find('connected-realm/') + len('connected-realm/'): cr.find('?')]) for (name, cr) in realms]
 
+    def get_connected_realm_index(self):
+        response = self.__get(
+            f'{self.url_base}/data/wow/connected-realm/index?namespace=dynamic-us&locale=en_US')
+        response.raise_for_status()
+        return response.json()
+
+    def get_connected_realm(self, connected_realm):
+        response = self.__get(
+            f'{self.url_base}/data/wow/connected-realm/{connected_realm}?namespace=dynamic-us&locale=en_US')
+        response.raise_for_status()
+        return response.json()
+
     def get_realm(self, realm_slug):
-        response = self.client.get(
+        response = self.__get(
             f'{self.url_base}/data/wow/realm/{realm_slug}?namespace=dynamic-us&locale=en_US')
         response.raise_for_status()
         return response.json()
 
     def get_recipes(self, profession_id, skill_tier):
-        response = self.client.get(
+        response = self.__get(
             f'{self.url_base}/data/wow/profession/{profession_id}/skill-tier/{skill_tier}?namespace=static-us&locale=en_US')
         response.raise_for_status()
         return response.json()
 
     def get_recipe(self, recipe_id):
-        response = self.client.get(
+        response = self.__get(
             f'{self.url_base}/data/wow/recipe/{recipe_id}?namespace=static-us&locale=en_US')
-        print(response.status_code)
-        # response.raise_for_status()
+        response.raise_for_status()
         return response.json()
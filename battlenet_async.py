@@ -0,0 +1,140 @@
+import asyncio
+
+import httpx
+from authlib.integrations.httpx_client import AsyncOAuth2Client
+
+from jsonstream import aiter_array
+from ratelimit import rate_limiter
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class AsyncBNetClient:
+    '''
+    asyncio version of BNetClient with the same endpoint methods as
+    coroutines. Requests share one keep-alive connection pool, at most
+    `concurrency` of them are in flight at once and every one of them still
+    goes through the shared battle.net rate limiter.
+
+    Use it as an async context manager, which fetches a token if none was
+    given and closes the pool on exit. The eternal commands stay on the
+    threaded BNetClient, this is for callers running their own event loop.
+    '''
+
+    def __init__(self, client_id, client_secret, url_base='https://us.api.blizzard.com', scope='wow.profile',
+                 token_url='https://us.battle.net/oauth/token', concurrency=16, timeout=30.0, retries=3,
+                 limiter=rate_limiter, token=None, transport=None):
+        self.url_base = url_base
+        self.token_url = token_url
+        self.limiter = limiter
+        self.retries = retries
+        self.concurrency = concurrency
+        # Created in __aenter__, on Python < 3.10 it binds to the event loop
+        # current when it is made
+        self.semaphore = None
+        # `transport` lets tests point the client at a local fake server
+        self.client = AsyncOAuth2Client(client_id, client_secret, scope=scope, timeout=httpx.Timeout(timeout),
+                                        limits=httpx.Limits(max_connections=concurrency,
+                                                            max_keepalive_connections=concurrency),
+                                        transport=transport)
+        if token is not None:
+            self.client.token = token
+
+    async def __aenter__(self):
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        if self.client.token is None:
+            await self.client.fetch_token(self.token_url, grant_type='client_credentials')
+        return self
+
+    async def __aexit__(self, type, value, traceback):
+        await self.client.aclose()
+
+    @property
+    def token(self):
+        return self.client.token
+
+    async def __get(self, url, headers=None, stream=False):
+        # Same policy as the requests Retry used by BNetClient: up to
+        # `retries` retries on throttling and server errors with backoff.
+        # With `stream` the body is left unread, the caller closes the response.
+        async with self.semaphore:
+            for attempt in range(self.retries + 1):
+                await self.limiter.acquire_async()
+                if stream:
+                    request = self.client.build_request('GET', url, headers=headers)
+                    response = await self.client.send(request, auth=self.client.token_auth, stream=True)
+                else:
+                    response = await self.client.get(url, headers=headers)
+                if response.status_code not in RETRY_STATUSES or attempt == self.retries:
+                    return response
+                await response.aclose()
+                await asyncio.sleep(2 ** attempt)
+
+    async def __get_json(self, url):
+        response = await self.__get(url)
+        response.raise_for_status()
+        return response.json()
+
+    async def get_auction(self, connected_realm):
+        return await self.__get_json(
+            f'{self.url_base}/data/wow/connected-realm/{connected_realm}/auctions?namespace=dynamic-us&locale=en_US')
+
+    async def get_auction_stream(self, connected_realm, if_modified_since=None):
+        # Like BNetClient.get_auction_stream, but the auctions are an async
+        # generator decoding the body as it is received, so neither the raw
+        # bytes nor the parsed document are ever held whole.
+        headers = {'If-Modified-Since': if_modified_since} if if_modified_since is not None else None
+        response = await self.__get(
+            f'{self.url_base}/data/wow/connected-realm/{connected_realm}/auctions?namespace=dynamic-us&locale=en_US',
+            headers=headers, stream=True)
+        if response.status_code == 304 or response.is_error:
+            await response.aclose()
+            if response.status_code == 304:
+                return (if_modified_since, None)
+            response.raise_for_status()
+
+        async def auctions():
+            try:
+                async for auction in aiter_array(response.aiter_bytes(), 'auctions'):
+                    yield auction
+            finally:
+                await response.aclose()
+        return (response.headers.get('Last-Modified'), auctions())
+
+    async def get_item(self, item_id):
+        return await self.__get_json(f'{self.url_base}/data/wow/item/{item_id}?namespace=static-us&locale=en_US')
+
+    async def get_professions(self):
+        return await self.__get_json(f'{self.url_base}/data/wow/profession/index?namespace=static-us&locale=en_US')
+
+    async def get_profession(self, profession_id):
+        return await self.__get_json(
+            f'{self.url_base}/data/wow/profession/{profession_id}?namespace=static-us&locale=en_US')
+
+    async def get_realms(self):
+        return await self.__get_json(f'{self.url_base}/data/wow/realm/index?namespace=dynamic-us&locale=en_US')
+
+    async def get_connected_realms(self):
+        # Every realm lookup is issued at once instead of one after another
+        realms = await self.get_realms()
+        realms = await asyncio.gather(*[self.get_realm(r['slug']) for r in realms['realms']])
+        realms = [(r['name'], r['connected_realm']['href']) for r in realms if not r['is_tournament']]
+        return [(name, cr[cr.find('connected-realm/') + len('connected-realm/'): cr.find('?')]) for (name, cr) in realms]
+
+    async def get_connected_realm_index(self):
+        return await self.__get_json(
+            f'{self.url_base}/data/wow/connected-realm/index?namespace=dynamic-us&locale=en_US')
+
+    async def get_connected_realm(self, connected_realm):
+        return await self.__get_json(
+            f'{self.url_base}/data/wow/connected-realm/{connected_realm}?namespace=dynamic-us&locale=en_US')
+
+    async def get_realm(self, realm_slug):
+        return await self.__get_json(f'{self.url_base}/data/wow/realm/{realm_slug}?namespace=dynamic-us&locale=en_US')
+
+    async def get_recipes(self, profession_id, skill_tier):
+        return await self.__get_json(
+            f'{self.url_base}/data/wow/profession/{profession_id}/skill-tier/{skill_tier}?namespace=static-us&locale=en_US')
+
+    async def get_recipe(self, recipe_id):
+        return await self.__get_json(f'{self.url_base}/data/wow/recipe/{recipe_id}?namespace=static-us&locale=en_US')
@@ -0,0 +1,199 @@
+'''
+Benchmark suite, run from the repository root:
+
+    $ python -m benchmarks --auctions 1000000 --depth 6
+    $ python -m benchmarks --compare HEAD~1
+
+Results are written to benchmarks/results/<commit>.json so runs on
+different commits can be compared.
+'''
+import argparse
+import gc
+import json
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+from benchmarks.synthetic import auction_payload, generate_auctions, generate_recipes
+from costing import RecipeGraph
+from eternal import aggregate_auctions, build_listings, cost_recipe
+from jsonstream import iter_array
+from store import Store
+
+results_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+
+class Fixtures:
+    def __init__(self, args):
+        self.recipes = generate_recipes(args.depth, args.fan_out, args.width, args.base_items, args.seed)
+        item_ids = {r.item_id for r in self.recipes} | {g.id for r in self.recipes for g in r.reagents}
+        self.auctions = generate_auctions(item_ids, args.auctions, seed=args.seed)
+        self.chunks = auction_payload(self.auctions)
+        self.search_items = item_ids
+        self.fetch_time = datetime.utcnow()
+        self.listings = build_listings(aggregate_auctions(self.auctions, self.search_items), self.fetch_time)
+        # Top layer recipes are the ones nothing else consumes
+        used = {g.id for r in self.recipes for g in r.reagents}
+        self.top = [r.name for r in self.recipes if r.item_id not in used]
+        self.tmp = tempfile.mkdtemp()
+        self.db = self.store()
+        self.db.add_auctions(self.listings, self.fetch_time)
+
+    def store(self):
+        fd, path = tempfile.mkstemp(suffix='.db', dir=self.tmp)
+        os.close(fd)
+        db = Store(path)
+        db.add_recipes(self.recipes)
+        return db
+
+    def close(self):
+        self.db.conn.close()
+        shutil.rmtree(self.tmp)
+
+
+# Each benchmark takes the fixtures, does its untimed setup and returns the
+# callable being measured.
+
+def bench_decode(f):
+    return lambda: sum(1 for _ in iter_array(f.chunks, 'auctions'))
+
+
+def bench_aggregate(f):
+    # What download_listings does with the response body
+    return lambda: aggregate_auctions(iter_array(f.chunks, 'auctions'), f.search_items)
+
+
+def bench_ingest(f):
+    db = f.store()
+    return lambda: db.add_auctions(f.listings, f.fetch_time)
+
+
+def bench_cost_recipe(f):
+    def run():
+        graph = RecipeGraph.load(f.db)
+        for name in f.top:
+            cost_recipe(f.db, name, graph=graph)
+    return run
+
+
+def bench_selection(f):
+    graph = RecipeGraph.load(f.db)
+    items = [graph.cost(name) for name in f.top]
+    return lambda: [item.selection() for item in items if item is not None]
+
+
+def bench_profitability(f):
+    graph = RecipeGraph.load(f.db)
+    return graph.profitability
+
+
+benchmarks = {
+    'decode': bench_decode,
+    'aggregate': bench_aggregate,
+    'ingest': bench_ingest,
+    'cost_recipe': bench_cost_recipe,
+    'selection': bench_selection,
+    'profitability': bench_profitability
+}
+
+
+def measure(bench, fixtures, repeat):
+    # Best of `repeat` wall times, then one more run under tracemalloc for
+    # the peak allocation since tracing slows everything down.
+    times = []
+    for _ in range(repeat):
+        run = bench(fixtures)
+        gc.collect()
+        started = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - started)
+    run = bench(fixtures)
+    gc.collect()
+    tracemalloc.start()
+    run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'seconds': min(times), 'peak_bytes': peak}
+
+
+def git_commit(ref='HEAD'):
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', ref], capture_output=True, text=True, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    commit = commit.stdout.strip()
+    if ref == 'HEAD':
+        status = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'],
+                                capture_output=True, text=True)
+        if status.stdout.strip() != '':
+            commit += '-dirty'
+    return commit
+
+
+def compare(results, ref):
+    commit = git_commit(ref) or ref
+    path = os.path.join(results_dir, f'{commit}.json')
+    if not os.path.exists(path):
+        print(f'no results saved for {commit}')
+        return
+    with open(path) as f:
+        baseline = json.load(f)
+    if baseline['parameters'] != results['parameters']:
+        print(f'warning: {commit} was run with different parameters')
+    print(f'\ncompared to {commit}:')
+    for (name, result) in results['results'].items():
+        before = baseline['results'].get(name)
+        if before is None:
+            continue
+        print(f'{name:<16}{result["seconds"] / before["seconds"]:>8.2f}x time'
+              f'{result["peak_bytes"] / max(before["peak_bytes"], 1):>8.2f}x memory')
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks')
+    parser.add_argument('--auctions', default=100000, type=int, help='number of auctions in the snapshot')
+    parser.add_argument('--depth', default=4, type=int, help='layers of crafted items in the recipe graph')
+    parser.add_argument('--fan-out', default=3, type=int, help='reagents per recipe')
+    parser.add_argument('--width', default=200, type=int, help='recipes per layer')
+    parser.add_argument('--base-items', default=400, type=int, help='number of base reagents')
+    parser.add_argument('--seed', default=1, type=int)
+    parser.add_argument('--repeat', default=3, type=int, help='timed runs per benchmark, the best is kept')
+    parser.add_argument('--only', nargs='+', choices=list(benchmarks), help='benchmarks to run')
+    parser.add_argument('--compare', type=str, help='git ref whose saved results to compare against')
+    parser.add_argument('--no-save', action='store_true', help='do not write the results file')
+    args = parser.parse_args()
+
+    fixtures = Fixtures(args)
+    results = {
+        'commit': git_commit(),
+        'datetime': datetime.utcnow().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'parameters': {k: getattr(args, k) for k in ['auctions', 'depth', 'fan_out', 'width', 'base_items', 'seed']},
+        'results': {}
+    }
+    try:
+        print(f'{"benchmark":<16}{"seconds":>10}{"peak MiB":>10}')
+        for name in args.only or benchmarks:
+            result = measure(benchmarks[name], fixtures, args.repeat)
+            results['results'][name] = result
+            print(f'{name:<16}{result["seconds"]:>10.3f}{result["peak_bytes"] / 2 ** 20:>10.1f}')
+    finally:
+        fixtures.close()
+    if not args.no_save and results['commit'] is not None:
+        os.makedirs(results_dir, exist_ok=True)
+        path = os.path.join(results_dir, f'{results["commit"]}.json')
+        with open(path, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f'\nsaved {path}')
+    if args.compare is not None:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
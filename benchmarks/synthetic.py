@@ -0,0 +1,79 @@
+'''
+Synthetic auction house payloads and recipe DAGs shaped like the real
+battle.net data, seeded so every run benchmarks the same input.
+'''
+import json
+import random
+
+from constants import vendor_reagents
+from reagent import Reagent
+from recipe import Recipe
+
+FIRST_ITEM_ID = 100000
+CONTEXTS = [13, 63, 64]
+
+
+def generate_recipes(depth=4, fan_out=3, width=200, base_items=400, seed=1):
+    # `depth` layers of `width` recipes above a layer of base reagents. Every
+    # recipe uses `fan_out` reagents drawn from any layer below it, with some
+    # vendor reagents mixed in, so intermediates are shared between recipes.
+    rng = random.Random(seed)
+    layers = [[(str(FIRST_ITEM_ID + i), f'base {i}') for i in range(base_items)]]
+    vendor = [(id, f'vendor {id}') for id in vendor_reagents]
+    recipes = []
+    next_item = FIRST_ITEM_ID + base_items
+    for level in range(1, depth + 1):
+        layer = []
+        below = [item for items in layers for item in items]
+        for _ in range(width):
+            item = (str(next_item), f'crafted {next_item}')
+            recipe = Recipe(len(recipes) + 1, 171, 2750, item[1], item[0], rng.choice([1, 1, 1, 2, 5]), item[1])
+            reagents = rng.sample(below, min(fan_out, len(below)))
+            if rng.random() < 0.2:
+                reagents.append(rng.choice(vendor))
+            recipe.reagents = [Reagent(id, name, 0, rng.randint(1, 10), 0) for (id, name) in reagents]
+            recipes.append(recipe)
+            layer.append(item)
+            next_item += 1
+        layers.append(layer)
+    return recipes
+
+
+def generate_auctions(item_ids, count=100000, untracked=0.5, context_rate=0.05, seed=1):
+    # Raw auction dicts as found in the battle.net auctions payload. About
+    # `untracked` of them are for items no recipe uses, commodities carry a
+    # unit_price while gear with a context id carries a buyout.
+    rng = random.Random(seed)
+    item_ids = [int(id) for id in item_ids] + [int(id) for id in vendor_reagents]
+    noise = FIRST_ITEM_ID * 2
+    base_prices = {}
+    auctions = []
+    for auction_id in range(count):
+        if rng.random() < untracked:
+            id = noise + rng.randrange(20000)
+        else:
+            id = rng.choice(item_ids)
+        base = base_prices.setdefault(id, rng.randint(1, 5000) * 10000)
+        price = int(base * rng.uniform(1, 3)) // 100 * 100
+        item = {'id': id}
+        auction = {'id': auction_id, 'item': item, 'quantity': rng.randint(1, 200), 'time_left': 'LONG'}
+        if rng.random() < context_rate:
+            item['context'] = rng.choice(CONTEXTS)
+            item['bonus_lists'] = [rng.randrange(6000, 7000)]
+            auction['quantity'] = 1
+            auction['buyout'] = price
+        else:
+            auction['unit_price'] = price
+        auctions.append(auction)
+    return auctions
+
+
+def auction_payload(auctions, chunk_size=64 * 1024):
+    # The auctions document split into chunks the way a streamed response arrives
+    body = json.dumps({
+        '_links': {'self': {'href': 'https://us.api.blizzard.com/data/wow/connected-realm/154/auctions'}},
+        'connected_realm': {'href': 'https://us.api.blizzard.com/data/wow/connected-realm/154'},
+        'auctions': auctions,
+        'id': 154
+    }).encode('utf-8')
+    return [body[i:i + chunk_size] for i in range(0, len(body), chunk_size)]
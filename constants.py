@@ -6,6 +6,13 @@ professions = [
     (333, 2753)   # Enchanting
 ]
 
+profession_names = {
+    165: 'Leatherworking',
+    171: 'Alchemy',
+    185: 'Cooking',
+    333: 'Enchanting'
+}
+
 
 # Map of vendor reagents that can be bought
 # generally cheaper by vendors.
@@ -0,0 +1,284 @@
+import math
+from array import array
+
+from item import Item, unit_cost
+from recipe import Recipe
+
+
+class RecipeGraph:
+    '''
+    The whole recipe DAG together with the prices of one auction house
+    snapshot, loaded with a handful of bulk queries. Items are built once per
+    node in topological order and shared between every recipe using them,
+    so costing never goes back to the store.
+    '''
+
+    def __init__(self, recipes, quantities, prices):
+        self.prices = prices
+        self.recipes = {}
+        self.recipes_by_item = {}
+        self.recipes_by_name = {}
+        for row in recipes:
+            recipe = Recipe(*row)
+            self.recipes[recipe.id] = recipe
+            # The lowest recipe id wins when several recipes craft the same item
+            self.recipes_by_item.setdefault(str(recipe.item_id), recipe)
+            self.recipes_by_name.setdefault(recipe.name, recipe)
+        for (recipe_id, item_id, name, craftable, quantity) in quantities:
+            if recipe_id in self.recipes:
+                self.recipes[recipe_id].reagents.append((item_id, name, craftable, quantity))
+        self.items = {}
+
+    @classmethod
+    def load(cls, db, realm=None):
+        return cls(db.get_all_recipes(), db.get_all_quantities(), db.get_snapshot_prices(realm))
+
+    def find_recipe(self, id):
+        # Match on the crafted item id first and fall back to the recipe name
+        recipe = self.recipes_by_item.get(str(id))
+        return recipe if recipe is not None else self.recipes_by_name.get(id)
+
+    def topological_order(self):
+        # Recipes ordered so every craftable reagent's recipe comes before
+        # the recipes consuming it
+        order = []
+        done = set()
+        visiting = set()
+        for root in self.recipes.values():
+            stack = [(root, False)]
+            while len(stack) > 0:
+                recipe, expanded = stack.pop()
+                if recipe.id in done:
+                    continue
+                if expanded:
+                    visiting.discard(recipe.id)
+                    done.add(recipe.id)
+                    order.append(recipe)
+                    continue
+                if recipe.id in visiting:
+                    # Cycle, the reagent gets bought instead of crafted
+                    continue
+                visiting.add(recipe.id)
+                stack.append((recipe, True))
+                for dependency in self.__dependencies(recipe):
+                    if dependency.id not in done and dependency.id not in visiting:
+                        stack.append((dependency, False))
+        return order
+
+    def cost(self, id):
+        recipe = self.find_recipe(id)
+        if recipe is None:
+            return None
+        return self.__build(recipe)
+
+    def __build(self, root):
+        # Iterative post-order walk, so every reagent's Item exists before the
+        # recipe using it and deep recipe chains can't exhaust the stack.
+        stack = [(root, False)]
+        visiting = set()
+        while len(stack) > 0:
+            recipe, expanded = stack.pop()
+            item_id = str(recipe.item_id)
+            if item_id in self.items:
+                continue
+            if not expanded:
+                visiting.add(item_id)
+                stack.append((recipe, True))
+                for dependency in self.__dependencies(recipe):
+                    if str(dependency.item_id) not in self.items and str(dependency.item_id) not in visiting:
+                        stack.append((dependency, False))
+                continue
+            visiting.discard(item_id)
+            item = Item(recipe.item_id, recipe.item_name, price=self.prices.get(item_id),
+                        recipe=self.__components(recipe), crafted_quantity=max(recipe.crafted_quantity, 1))
+            item.cost()
+            self.items[item_id] = item
+        return self.items[str(root.item_id)]
+
+    def __dependencies(self, recipe):
+        for (item_id, _, craftable, _) in recipe.reagents:
+            if craftable == 1 and item_id in self.prices:
+                dependency = self.recipes_by_item.get(str(item_id))
+                if dependency is not None:
+                    yield dependency
+
+    def __components(self, recipe):
+        # Only reagents listed in the snapshot take part in costing
+        components = []
+        for (item_id, name, craftable, quantity) in recipe.reagents:
+            if item_id not in self.prices:
+                continue
+            if craftable == 1 and item_id in self.items:
+                components.append((self.items[item_id], quantity))
+            else:
+                # Base reagents, and craftable ones closing a cycle, are bought
+                components.append((Item(item_id, name, price=self.prices[item_id]), quantity))
+        return components
+
+    def profitability(self):
+        # Material cost, sell price and margin of every recipe in one pass.
+        # Recipes are rows of a sparse reagent-quantity matrix (CSR arrays)
+        # multiplied against a unit cost vector. Every row gets a level one
+        # above the recipes crafting its reagents, so each level is one
+        # product against the unit costs the levels below it have lowered.
+        # Costs are per craft and prices per crafted quantity, a crafted
+        # reagent's unit cost is its craft's share, as in item.unit_cost.
+        order = self.topological_order()
+        levels = {}
+        columns = {}
+        unit_costs = []
+        indptr = array('l', [0])
+        indices = array('l')
+        quantities = array('l')
+        row_levels = array('l')
+        missing = []
+        for recipe in order:
+            unpriced = 0
+            level = 0
+            for (item_id, _, craftable, quantity) in recipe.reagents:
+                if item_id not in self.prices:
+                    unpriced += 1
+                    continue
+                if item_id not in columns:
+                    columns[item_id] = len(unit_costs)
+                    unit_costs.append(self.prices[item_id])
+                indices.append(columns[item_id])
+                quantities.append(quantity)
+                # Dependencies not levelled yet close a cycle and are bought
+                dependency = self.recipes_by_item.get(str(item_id)) if craftable == 1 else None
+                if dependency is not None and dependency.id in levels:
+                    level = max(level, levels[dependency.id] + 1)
+            levels[recipe.id] = level
+            row_levels.append(level)
+            indptr.append(len(indices))
+            missing.append(unpriced)
+        # Unit cost column each row's craft can lower, -1 for none. Same
+        # choice as Item.cost(), craft only when it beats buying.
+        targets = array('l')
+        yields = array('l')
+        for (row, recipe) in enumerate(order):
+            item_id = str(recipe.item_id)
+            crafted = (item_id in columns and indptr[row + 1] > indptr[row]
+                       and self.recipes_by_item.get(item_id) is recipe)
+            targets.append(columns[item_id] if crafted else -1)
+            yields.append(max(recipe.crafted_quantity, 1))
+        matrix = (indptr, indices, quantities, row_levels, targets, yields)
+        try:
+            import numpy
+        except ImportError:
+            costs = material_costs(unit_costs, *matrix)
+        else:
+            costs = material_costs_numpy(numpy, unit_costs, *matrix)
+        report = []
+        for (recipe, material_cost, unpriced) in zip(order, costs, missing):
+            material_cost = round(material_cost)
+            price = self.prices.get(str(recipe.item_id))
+            sell_price = price * recipe.crafted_quantity if price is not None else None
+            margin = sell_price - material_cost if sell_price is not None else None
+            report.append((recipe, material_cost, sell_price, margin, unpriced == 0))
+        return report
+
+    def uses(self, depths):
+        # Profitability rows (see profitability()) of the recipes in
+        # `depths`, {recipe_id: depth} as from Store.get_item_uses, each
+        # with its depth appended
+        return [row + (depths[row[0].id],) for row in self.profitability() if row[0].id in depths]
+
+
+def material_costs(unit_costs, indptr, indices, quantities, levels, targets, yields):
+    # Cost of every row of the CSR matrix, level by level. After each level,
+    # crafting lowers the unit cost of the `targets` columns to the row's
+    # cost over its yield.
+    unit_costs = list(unit_costs)
+    costs = [0] * len(levels)
+    rows = [[] for _ in range(max(levels, default=-1) + 1)]
+    for (row, level) in enumerate(levels):
+        rows[level].append(row)
+    for level in rows:
+        for row in level:
+            costs[row] = sum(quantities[k] * unit_costs[indices[k]] for k in range(indptr[row], indptr[row + 1]))
+        for row in level:
+            if targets[row] >= 0:
+                unit_costs[targets[row]] = unit_cost(costs[row], yields[row], unit_costs[targets[row]])
+    return costs
+
+
+def material_costs_numpy(numpy, unit_costs, indptr, indices, quantities, levels, targets, yields):
+    # Same as material_costs, with every level as one sparse product and
+    # item.unit_cost applied to the whole level at once
+    def column(values):
+        return numpy.frombuffer(values, dtype=values.typecode).astype(numpy.int64)
+    (indptr, indices, levels, targets, yields) = (column(indptr), column(indices), column(levels),
+                                                  column(targets), column(yields))
+    quantities = column(quantities).astype(numpy.float64)
+    unit_costs = numpy.array(unit_costs, dtype=numpy.float64)
+    rows = numpy.repeat(numpy.arange(len(levels)), numpy.diff(indptr))
+    entry_levels = levels[rows]
+    costs = numpy.zeros(len(levels))
+    for level in range(levels.max(initial=-1) + 1):
+        entries = numpy.flatnonzero(entry_levels == level)
+        level_costs = numpy.bincount(rows[entries], weights=quantities[entries] * unit_costs[indices[entries]],
+                                     minlength=len(levels))
+        crafted = numpy.flatnonzero((levels == level) & (targets >= 0))
+        costs[levels == level] = level_costs[levels == level]
+        unit_costs[targets[crafted]] = numpy.minimum(unit_costs[targets[crafted]], costs[crafted] / yields[crafted])
+    return costs.tolist()
+
+
+def merge_selection(selection, quantity=1):
+    # One [item, amount] line per item id, in first seen order. Shares of
+    # multi-unit crafts add up first, then whole units are bought.
+    lines = {}
+    for (item, amount) in selection:
+        key = str(item.id)
+        if key in lines:
+            lines[key][1] += amount * quantity
+        else:
+            lines[key] = [item, amount * quantity]
+    return [[item, math.ceil(amount)] for (item, amount) in lines.values()]
+
+
+def line_cost(ladder, price, amount):
+    # (total, filled) buying `amount` by walking the ladder. Without a ladder
+    # (e.g. vendor reagents) everything is bought at the unit price, an item
+    # without a price is not listed at all so nothing of it is filled.
+    if ladder is None:
+        return (price * amount, amount) if price is not None else (0, 0)
+    (total, filled) = ladder.cost(amount)
+    if filled < amount and len(ladder) > 0:
+        # Not enough listed, the rest is priced at the last level
+        total += (amount - filled) * ladder.prices[-1]
+    return (total, filled)
+
+
+def shopping_list(selection, ladders, quantity=1):
+    # Merge a selection into one line per item and cost each line by walking
+    # that item's price ladder, so large buys pay for the deeper listings.
+    return [(item, amount) + line_cost(ladders.get(str(item.id)), item.price, amount)
+            for (item, amount) in merge_selection(selection, quantity)]
+
+
+def cheapest_sources(selection, listings, quantity=1):
+    # Compare a shopping list across realms, with listings as returned by
+    # Store.get_realm_listings. Returns the offers for every line, cheapest
+    # (fully filled first) first, as (item, amount, [(realm, cost, filled)]),
+    # and each realm's (realm, total, missing) sorted by completeness and total
+    # cost, where `missing` counts the items that realm has no listings for.
+    sources = []
+    totals = {realm: [0, 0] for realm in listings}
+    for (item, amount) in merge_selection(selection, quantity):
+        offers = []
+        for (realm, items) in listings.items():
+            listing = items.get(str(item.id))
+            if listing is None:
+                totals[realm][1] += 1
+                continue
+            (price, _, ladder) = listing
+            (cost, filled) = line_cost(ladder, price, amount)
+            totals[realm][0] += cost
+            offers.append((realm, cost, filled))
+        offers.sort(key=lambda o: (o[2] < amount, o[1]))
+        sources.append((item, amount, offers))
+    totals = sorted(((realm, cost, missing) for (realm, (cost, missing)) in totals.items()),
+                    key=lambda t: (t[2], t[1]))
+    return (sources, totals)
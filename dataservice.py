@@ -0,0 +1,149 @@
+import queue
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from costing import RecipeGraph, shopping_list
+from series import lttb
+from store import Store
+
+
+class DataService:
+    '''
+    Store access for the GUI off the UI thread. One worker thread owns a
+    single long-lived connection and runs jobs as a series of steps. A job
+    submitted on a channel supersedes the one before it: steps of the old job
+    that have not started yet are skipped and results it already produced
+    are dropped. Finished steps queue up until the UI thread calls poll().
+
+    Results are cached per item and snapshot, so clicking back to an item
+    costs nothing until a newer snapshot is recorded.
+    '''
+
+    def __init__(self, database, cache_size=256, on_error=print):
+        self.results = queue.Queue()
+        self.on_error = on_error
+        self.cache_size = cache_size
+        self.__lock = threading.Lock()
+        self.__generations = {}
+        self.__cache = OrderedDict()
+        self.__graphs = {}
+        self.__executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='data')
+        self.__executor.submit(self.__open, database).result()
+
+    def __open(self, database):
+        self.db = Store(database)
+
+    def close(self):
+        with self.__lock:
+            self.__generations = {channel: -1 for channel in self.__generations}
+        self.__executor.submit(self.db.conn.close).result()
+        self.__executor.shutdown()
+
+    def submit(self, channel, steps):
+        # steps: [(step, callback)], every step runs on the worker and its
+        # return value is handed to callback on the UI thread by poll()
+        with self.__lock:
+            generation = self.__generations.get(channel, 0) + 1
+            self.__generations[channel] = generation
+        return self.__executor.submit(self.__run, channel, generation, steps)
+
+    def call(self, step):
+        # Run a step on the worker and wait for it, for startup only
+        return self.__executor.submit(step).result()
+
+    def cancel(self, channel):
+        with self.__lock:
+            self.__generations[channel] = self.__generations.get(channel, 0) + 1
+
+    def __current(self, channel, generation):
+        with self.__lock:
+            return self.__generations.get(channel) == generation
+
+    def __run(self, channel, generation, steps):
+        for (step, callback) in steps:
+            if not self.__current(channel, generation):
+                return
+            try:
+                value = step()
+            except Exception as e:
+                value = e
+            self.results.put((channel, generation, callback, value))
+
+    def poll(self, limit=64):
+        # Called every frame from the UI thread. Results of superseded jobs
+        # are dropped, a failed step goes to on_error instead of its callback.
+        for _ in range(limit):
+            try:
+                (channel, generation, callback, value) = self.results.get_nowait()
+            except queue.Empty:
+                return
+            if not self.__current(channel, generation):
+                continue
+            if isinstance(value, Exception):
+                self.on_error(value)
+            else:
+                callback(value)
+
+    # The methods below run on the worker thread, as steps of a job.
+
+    def cached(self, kind, realm, name, compute):
+        key = (kind, realm, name, self.db.get_last_download(realm))
+        if key in self.__cache:
+            self.__cache.move_to_end(key)
+            return self.__cache[key]
+        value = compute()
+        self.__cache[key] = value
+        if len(self.__cache) > self.cache_size:
+            self.__cache.popitem(last=False)
+        return value
+
+    def graph(self, realm):
+        snapshot = self.db.get_last_download(realm)
+        cached = self.__graphs.get(realm)
+        if cached is None or cached[0] != snapshot:
+            cached = (snapshot, RecipeGraph.load(self.db, realm))
+            self.__graphs[realm] = cached
+        return cached[1]
+
+    def price(self, name, realm):
+        return self.cached('price', realm, name, lambda: self.db.get_price_by_name(name, realm))
+
+    def recipe(self, name, realm):
+        # (recipe Item, shopping list) or None when nothing crafts it
+        def compute():
+            recipe = self.graph(realm).cost(name)
+            if recipe is None:
+                return None
+            selection = recipe.selection()
+            ladders = self.db.get_ladders([i.id for (i, q) in selection], realm)
+            return (recipe, shopping_list(selection, ladders))
+        return self.cached('recipe', realm, name, compute)
+
+    def uses(self, name, realm):
+        # Profitability rows of every recipe the item feeds into, see
+        # RecipeGraph.uses, best margin first
+        def compute():
+            depths = self.db.get_item_uses(name)
+            if depths is None or len(depths) == 0:
+                return []
+            return sorted(self.graph(realm).uses(depths), key=lambda r: (r[3] is None, -(r[3] or 0)))
+        return self.cached('uses', realm, name, compute)
+
+    def history(self, name, realm, start=None, end=None, max_points=1000):
+        # (timestamp, close) points for the plot. Rows are read at the finest
+        # resolution fitting a few times max_points and then thinned with
+        # LTTB, so the line keeps its shape at any zoom.
+        def compute():
+            series = self.db.get_price_series(name, realm, start, end, max_points * 4)
+            if series is None:
+                return None
+            return lttb([(row[0], row[4]) for row in series], max_points)
+        return self.cached(('history', start, end, max_points), realm, name, compute)
+
+    def history_since(self, name, realm, after):
+        # Points recorded after the newest one on the plot, after a sync
+        series = self.db.get_price_series(name, realm, after + 1)
+        if series is None:
+            return []
+        return [(row[0], row[4]) for row in series]
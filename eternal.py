@@ -1,62 +1,187 @@
 #!/usr/bin/python3
 import argparse
-import itertools
-from datetime import datetime, timedelta
+import calendar
+import csv
+import sys
+import time
+from contextlib import nullcontext
+from datetime import datetime, timezone
 
+from aggregate import aggregate_columns, collect, parse_item
+from archive import SnapshotArchive, SnapshotColumns
 from auction import Auction
-from battlenet import BNetClient
-from constants import professions, unique_recipe_format, vendor_reagents
-from item import Item
+from constants import profession_names, professions, unique_recipe_format, vendor_reagents
+from costing import RecipeGraph, cheapest_sources, shopping_list
+from ladder import PriceLadder
+from metrics import metrics
 from reagent import Reagent
 from recipe import Recipe
 from store import Store
 
 
-def download_listings(db, client_id, client_secret, realm=154):
-    # Check to see when the latest download of the auction house before downloading again
-    # The auction house only updates about every hour via the battle.net API
-    last_download = db.get_last_download()
-    if last_download is not None and datetime.fromisoformat(last_download) + timedelta(hours=1) > datetime.utcnow():
-        return
-    client = BNetClient(client_id, client_secret)
-    response = client.get_auction(realm)
-    auctions = response['auctions']
-    items = {}
+def get_client(db, client_id, client_secret, **kwargs):
+    # Access tokens are cached in the store and shared by every client
+    # and process until shortly before they expire.
+    # battle.net pulls in authlib, requests and urllib3, so it is only
+    # imported once a command actually goes online.
+    from battlenet import BNetClient
+    token = db.get_token(client_id)
+    client = BNetClient(client_id, client_secret, token=token, **kwargs)
+    if token is None:
+        db.add_or_replace_token(client_id, client.token)
+    return client
+
+
+def aggregate_auctions(auctions, search_items, columns=None):
+    # Collect the listings into columns and reduce them to prices per
+    # tracked item in one batched pass. Only tracked listings are kept,
+    # unless `columns` is given for the archive, which holds every listing.
+    search_items = set(search_items) | vendor_reagents.keys()
+    if columns is None:
+        columns = collect(auctions, SnapshotColumns(), {parse_item(id) for id in search_items})
+    else:
+        columns = collect(auctions, columns)
+    items = aggregate_columns(columns, search_items)
+    for id in items.keys() & vendor_reagents.keys():
+        items[id] = {
+            'id': id,
+            'price': vendor_reagents[id],
+            'quantity': -1
+        }
+    return items
+
+
+def snapshot_time(last_modified):
+    # Record snapshots at the time battle.net generated them rather than when they were downloaded
+    from email.utils import parsedate_to_datetime
+    if last_modified is None:
+        return datetime.utcnow()
+    return parsedate_to_datetime(last_modified).astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def fetch_listings(client, realm, search_items, last_modified=None, archive=None):
+    # Safe to run from worker threads, it never touches the store.
+    # Returns None when the realm has no newer snapshot than `last_modified`.
+    modified, auctions = client.get_auction_stream(realm, last_modified)
+    if auctions is None or (modified is not None and modified == last_modified):
+        return None
+    columns = SnapshotColumns() if archive is not None else None
+    # The auctions are streamed, so this also covers their download and decoding
+    with metrics.span('eternal.aggregate'):
+        items = aggregate_auctions(auctions, search_items, columns)
+    metrics.incr('auctions_tracked', len(items))
+    fetch_time = snapshot_time(modified)
+    if archive is not None:
+        with metrics.span('eternal.archive'):
+            archive.write(realm, calendar.timegm(fetch_time.timetuple()), columns)
+    return build_listings(items, fetch_time), fetch_time, modified
+
+
+def build_listings(items, fetch_time):
+    return [Auction(item['id'], item['quantity'], item['price'], fetch_time,
+                    PriceLadder.from_levels(item['levels']) if 'levels' in item else None,
+                    item.get('p10'), item.get('p25'), item.get('vwap'))
+            for item in items.values()]
+
+
+def record_listings(db, realm, listings, fetch_time, last_modified=None):
+    if len(listings) <= 0:
+        print(f'no items found in reagents to record for realm {realm}')
+        return None
+    return db.add_auctions(listings, fetch_time, realm, last_modified)
+
+
+def download_listings(db, client_id, client_secret, realm=154, client=None, archive=None):
+    # The auction house only updates about every hour via the battle.net API,
+    # a conditional request makes checking for a new snapshot nearly free.
+    if client is None:
+        client = get_client(db, client_id, client_secret)
     search_items = set(db.get_all_reagent_ids())
-    for auction in auctions:
-        id = str(auction['item']['id'])
-        if 'context' in auction['item']:
-            id_context = auction['item']['context']
-            id = f'{id}-{id_context}'
-        if id in vendor_reagents:
-            items[id] = {
-                'id': id,
-                'price': vendor_reagents[id],
-                'quantity': -1
-            }
-        elif id in search_items:
-            price = auction['unit_price'] if 'unit_price' in auction else auction['buyout']
-            quantity = auction['quantity']
-            if type(price) is int and type(quantity) is int:
-                price = round(price // 10000)  # round down to gold
-                if id not in items:
-                    items[id] = {
-                        'id': id,
-                        'price': price,
-                        'quantity': quantity
-                    }
-                else:
-                    items[id]['quantity'] += quantity
-                    existing_price = items[id]['price']
-                    if price < existing_price:
-                        items[id]['price'] = price
-    if len(items.items()) <= 0:
-        print('no items found in reagents to record')
-        return
-    fetch_time = datetime.utcnow()
-    listings = [Auction(item['id'], item['quantity'], item['price'],
-                        fetch_time) for (k, item) in items.items()]
-    db.add_auctions(listings, fetch_time)
+    snapshot = fetch_listings(client, realm, search_items, db.get_last_modified(realm), archive)
+    if snapshot is not None:
+        record_listings(db, realm, *snapshot)
+
+
+def resolve_realm(db, name):
+    # Realm name, slug, realm id or connected-realm id to its connected-realm id
+    id = db.find_realm(name)
+    if id is None:
+        if str(name).isdigit():
+            # Connected realms newer than the directory still work by id
+            return int(name)
+        raise ValueError(f'unknown realm: {name}')
+    return id
+
+
+def resolve_realms(db, names):
+    # Several realms share one auction house, so collapse names down to
+    # their unique connected-realm ids while keeping the requested order.
+    if 'all' in names:
+        return db.get_connected_realm_ids()
+    connected_realms = []
+    for name in names:
+        id = resolve_realm(db, name)
+        if id not in connected_realms:
+            connected_realms.append(id)
+    return connected_realms
+
+
+def connected_realm_id(href):
+    return int(href[href.find('connected-realm/') + len('connected-realm/'): href.find('?')])
+
+
+def refresh_realm_directory(db, client, max_age_days=7, workers=8, lock=None):
+    # One request for the connected-realm index, then only connected realms
+    # that are new or whose members were last fetched over `max_age_days`
+    # ago are looked up, concurrently. Returns how many were fetched.
+    from concurrent.futures import ThreadPoolExecutor
+    lock = lock if lock is not None else nullcontext()
+    index = client.get_connected_realm_index()
+    ids = [connected_realm_id(cr['href']) for cr in index['connected_realms']]
+    with lock:
+        known = set(db.get_connected_realm_ids())
+        stale = set(db.get_stale_connected_realms(int(time.time()) - max_age_days * 86400))
+    fetch = [id for id in ids if id not in known or id in stale]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        responses = executor.map(client.get_connected_realm, fetch)
+        # Tournament realms have no auction house, like the bundled realm list
+        connected_realms = {id: [(r['id'], r['name'], r['slug']) for r in response['realms']
+                                 if not r.get('is_tournament', False)]
+                            for (id, response) in zip(fetch, responses)}
+    # An empty index is more likely an API hiccup than every realm closing
+    removed = known - set(ids) if len(ids) > 0 else set()
+    with lock:
+        db.update_realms(connected_realms, removed)
+    return len(connected_realms)
+
+
+def sync_realms(db, client, connected_realms, workers=8, archive=None, lock=None):
+    # Downloads run on the worker pool while this thread owns the sqlite
+    # connection and records each realm as soon as it arrives. `lock` is held
+    # around store access only, so a server keeps answering during downloads.
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+    lock = lock if lock is not None else nullcontext()
+    with lock:
+        search_items = set(db.get_all_reagent_ids())
+        last_modified = {realm: db.get_last_modified(realm) for realm in connected_realms}
+    synced = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(fetch_listings, client, realm, search_items, last_modified[realm], archive): realm
+                   for realm in connected_realms}
+        for future in as_completed(futures):
+            realm = futures[future]
+            try:
+                snapshot = future.result()
+            except Exception as e:
+                print(f'failed to sync realm {realm}: {e}')
+                continue
+            if snapshot is not None:
+                with lock:
+                    load = record_listings(db, realm, *snapshot)
+                if load is not None:
+                    print(f'realm {realm}: {load}')
+                synced.append(realm)
+    return synced
 
 
 def unique_recipe(recipe_id, recipe_name, item_id):
@@ -72,7 +197,17 @@ def unique_recipe(recipe_id, recipe_name, item_id):
 
 
 def get_recipe(client, profession_id, skill_tier, recipe_id):
-    recipe_response = client.get_recipe(recipe_id)
+    from requests import HTTPError
+    try:
+        recipe_response = client.get_recipe(recipe_id)
+    except HTTPError as e:
+        # Retired or unknown recipe ids are skipped like recipes without a
+        # crafted item, throttling and server errors still abort the fetch
+        status = e.response.status_code if e.response is not None else None
+        if status is None or status == 429 or not 400 <= status < 500:
+            raise
+        print(f'skipping recipe {recipe_id}: {status}')
+        return None
     if 'crafted_item' not in recipe_response:
         return None
     recipe = Recipe(recipe_id, profession_id, skill_tier, None, None, None)
@@ -88,36 +223,37 @@ def get_recipe(client, profession_id, skill_tier, recipe_id):
     return recipe
 
 
-def fetch_recipes(db, client_id, client_secret, profession_id, skill_tier):
+def fetch_recipes(db, client_id, client_secret, professions=professions, client=None, workers=16):
     # Fetch recipes only if not already cached
-    recipe_count = db.get_recipe_count(profession_id, skill_tier)
-    if recipe_count > 0:
+    skill_tiers = [(profession_id, skill_tier) for (profession_id, skill_tier) in professions
+                   if db.get_recipe_count(profession_id, skill_tier) <= 0]
+    if len(skill_tiers) <= 0:
         return
-    client = BNetClient(client_id, client_secret)
-    response = client.get_recipes(profession_id, skill_tier)
-    categories = response['categories']
-    recipes = [category['recipes'] for category in categories]
-    recipes = list(itertools.chain(*recipes))
-    recipes = [get_recipe(client, profession_id, skill_tier, recipe['id'])
-               for recipe in recipes]
-    recipes = [r for r in recipes if r is not None]
-    db.add_recipes(recipes)
-
-
-def cost_recipe(db, recipe_id):
-    recipe = db.get_recipe(recipe_id)
-    if recipe is None:
-        return None
-    recipe = Recipe(*recipe)
-    recipe_price = db.get_price(recipe.item_id)
-    recipe_price = recipe_price[0] if recipe_price is not None else None
-    reagents = db.get_reagents_price(recipe.id)
-    reagents = [Reagent(*r) for r in reagents]
-    reagents_basic = [(Item(r.id, r.name, price=r.price), r.quantity)
-                      for r in reagents if r.craftable == 0]
-    reagents_craft = [(cost_recipe(db, r.id), r.quantity)
-                      for r in reagents if r.craftable == 1]
-    return Item(recipe.item_id, recipe.item_name, price=recipe_price, recipe=reagents_basic + reagents_craft)
+    if client is None:
+        client = get_client(db, client_id, client_secret, pool_size=workers)
+    # Every request goes through the client's shared rate limiter, so the
+    # pool can be wide without tripping the battle.net quotas.
+    from concurrent.futures import ThreadPoolExecutor
+    with metrics.span('eternal.fetch_recipes'), ThreadPoolExecutor(max_workers=workers) as executor:
+        responses = executor.map(lambda tier: client.get_recipes(*tier), skill_tiers)
+        recipe_ids = [(profession_id, skill_tier, recipe['id'])
+                      for ((profession_id, skill_tier), response) in zip(skill_tiers, responses)
+                      for category in response['categories']
+                      for recipe in category['recipes']]
+        recipes = executor.map(lambda r: get_recipe(client, *r), recipe_ids)
+        recipes = [r for r in recipes if r is not None]
+    load = db.add_recipes(recipes)
+    print(f'stored {len(recipes)} recipes: {load}')
+
+
+def cost_recipe(db, recipe_id, realm=None, graph=None):
+    # The whole recipe graph and snapshot prices are loaded up front,
+    # pass `graph` to reuse them across several lookups.
+    if graph is None:
+        with metrics.span('eternal.load_graph'):
+            graph = RecipeGraph.load(db, realm)
+    with metrics.span('eternal.cost'):
+        return graph.cost(recipe_id)
 
 
 def walk_recipe(item, depth=0):
@@ -129,24 +265,45 @@ def walk_recipe(item, depth=0):
         walk_recipe(i, depth+1)
 
 
+def refresh(db, realm):
+    # Make sure recipes are cached and the realm's listings are current.
+    # Returns False when there are no battle.net credentials to do so.
+    creds = db.get_credentials()
+    if creds is None:
+        print('No battle.net credentials cached. Please use \'$ eternal creds add\' command to cache them')
+        return False
+    (client_id, client_secret, _) = creds
+    # Fetch recipes/reagents
+    fetch_recipes(db, client_id, client_secret)
+    # Download listings from auction house
+    download_listings(db, client_id, client_secret, realm)
+    return True
+
+
+def prepare(db, realm, offline):
+    # Refresh unless offline, then make sure the realm has a snapshot to cost
+    # against. Returns False when the command can't go on.
+    if not offline and not refresh(db, realm):
+        return False
+    if db.get_last_download(realm) is None:
+        print('download from auction house first before searching.')
+        return False
+    return True
+
+
 def cost_recipe_args(args):
     with Store(args.store) as db:
-        # Get battle.net credentials
-        creds = db.get_credentials()
-        if creds is None:
-            print('No battle.net credentials cached. Please use \'$ eternal creds add\' command to cache them')
+        try:
+            realm = resolve_realm(db, args.realm)
+        except ValueError as e:
+            print(e)
+            return
+        if not prepare(db, realm, args.offline):
             return
-        (client_id, client_secret, _) = creds
-        # Fetch recipes/reagents
-        for (profession_id, skill_tier) in professions:
-            fetch_recipes(db, client_id, client_secret,
-                          profession_id, skill_tier)
-        # Download listings from auction house
-        download_listings(db, client_id, client_secret, args.realm)
         # Cost the recipe
-        recipe = cost_recipe(db, args.recipename[0])
+        recipe = cost_recipe(db, args.recipename[0], realm)
         if recipe is None:
-            item_price = db.get_price_by_name(args.recipename[0])
+            item_price = db.get_price_by_name(args.recipename[0], realm)
             if item_price is None:
                 print(
                     f'Recipe with recipe name: {args.recipename[0]} not found.')
@@ -156,20 +313,234 @@ def cost_recipe_args(args):
                 else:
                     print(f'{item_price[0]}')
             return
+        # Walk the price ladders for the quantities actually being bought
+        selection = recipe.selection()
+        ladders = db.get_ladders([i.id for (i, q) in selection], realm)
+        items = shopping_list(selection, ladders, args.quantity)
         if not args.cost:
             if recipe.price is not None:
                 print(f'\n{recipe.name} @ {recipe.price}g:')
             else:
                 print(f'\n{recipe.name}:')
             walk_recipe(recipe)
-            items = recipe.selection()
             print('\nCost Breakdown:')
             print('gold\tamount\treagent')
-            for (item, quantity) in items:
-                print(f'{item.price * quantity}\t{quantity}\t{item.name}')
+            for (item, quantity, cost, filled) in items:
+                short = f' (only {filled} listed)' if filled < quantity else ''
+                print(f'{cost}\t{quantity}\t{item.name}{short}')
             print('================' + '=' *
-                  max([len(i.name) for (i, q) in items]))
-        print(f'{recipe.cost()}')
+                  max([len(i.name) for (i, q, c, f) in items]))
+        print(f'{sum(c for (i, q, c, f) in items)}')
+
+
+def report_args(args):
+    with Store(args.store) as db:
+        try:
+            realm = resolve_realm(db, args.realm)
+        except ValueError as e:
+            print(e)
+            return
+        if not prepare(db, realm, args.offline):
+            return
+        with metrics.span('eternal.load_graph'):
+            graph = RecipeGraph.load(db, realm)
+        with metrics.span('eternal.profitability'):
+            report = graph.profitability()
+    sort_keys = {
+        'margin': lambda r: (r[3] is None, -(r[3] or 0)),
+        'cost': lambda r: r[1],
+        'price': lambda r: (r[2] is None, -(r[2] or 0)),
+        'name': lambda r: r[0].name
+    }
+    report = sorted(report, key=sort_keys[args.sort])
+    if args.limit is not None:
+        report = report[:args.limit]
+    header = ['margin', 'cost', 'price', 'profession', 'recipe']
+    rows = [[margin if margin is not None else '', cost, price if price is not None else '',
+             profession_names.get(recipe.profession, recipe.profession),
+             recipe.name if complete else f'{recipe.name} *']
+            for (recipe, cost, price, margin, complete) in report]
+    if args.csv:
+        writer = csv.writer(sys.stdout)
+        writer.writerow(header)
+        writer.writerows(rows)
+        return
+    print('\t'.join(header))
+    for row in rows:
+        print('\t'.join(str(c) for c in row))
+    if not all(complete for (_, _, _, _, complete) in report):
+        print('\n* reagents without auction house listings are left out of the cost')
+
+
+def sources_args(args):
+    with Store(args.store) as db:
+        try:
+            realm = resolve_realm(db, args.realm)
+            connected_realms = resolve_realms(db, args.realms) if args.realms is not None else None
+        except ValueError as e:
+            print(e)
+            return
+        if not prepare(db, realm, args.offline):
+            return
+        # The craft-or-buy choices come from the home realm, the resulting
+        # shopping list is then priced on every realm at once.
+        recipe = cost_recipe(db, args.recipename[0], realm)
+        if recipe is None:
+            print(f'Recipe with recipe name: {args.recipename[0]} not found.')
+            return
+        selection = recipe.selection()
+        listings = db.get_realm_listings([i.id for (i, q) in selection], connected_realms)
+        names = {}
+        for (name, id) in db.get_realms():
+            names.setdefault(id, name)
+    (sources, totals) = cheapest_sources(selection, listings, args.quantity)
+    print(f'\n{recipe.name} x{args.quantity}, cheapest source per reagent:')
+    print('gold\tamount\trealm\treagent')
+    for (item, amount, offers) in sources:
+        if len(offers) == 0:
+            print(f'-\t{amount}\t-\t{item.name} (not listed on any realm)')
+            continue
+        (best, cost, filled) = offers[0]
+        short = f' (only {filled} listed)' if filled < amount else ''
+        print(f'{cost}\t{amount}\t{names.get(best, best)}\t{item.name}{short}')
+    print(f'{sum(o[0][1] for (_, _, o) in sources if len(o) > 0)}\t\t\tsplit across realms')
+    print('\nWhole list per realm:')
+    print('gold\trealm')
+    for (connected_realm, total, missing) in totals[:args.limit]:
+        short = f' ({missing} not listed)' if missing > 0 else ''
+        print(f'{total}\t{names.get(connected_realm, connected_realm)}{short}')
+
+
+def uses_args(args):
+    with Store(args.store) as db:
+        try:
+            realm = resolve_realm(db, args.realm)
+        except ValueError as e:
+            print(e)
+            return
+        if not prepare(db, realm, args.offline):
+            return
+        depths = db.get_item_uses(args.itemname[0], 1 if args.direct else None)
+        if depths is None:
+            print(f'Item with name: {args.itemname[0]} not found.')
+            return
+        with metrics.span('eternal.load_graph'):
+            graph = RecipeGraph.load(db, realm)
+        with metrics.span('eternal.profitability'):
+            uses = graph.uses(depths)
+    uses = sorted(uses, key=lambda r: (r[5], r[3] is None, -(r[3] or 0)))
+    if args.limit is not None:
+        uses = uses[:args.limit]
+    print('\t'.join(['margin', 'cost', 'price', 'depth', 'profession', 'recipe']))
+    for (recipe, cost, price, margin, complete, depth) in uses:
+        print('\t'.join(str(c) for c in [margin if margin is not None else '', cost,
+                                         price if price is not None else '', depth,
+                                         profession_names.get(recipe.profession, recipe.profession),
+                                         recipe.name if complete else f'{recipe.name} *']))
+    if not all(complete for (_, _, _, _, complete, _) in uses):
+        print('\n* reagents without auction house listings are left out of the cost')
+
+
+def sync_realms_args(args):
+    with Store(args.store) as db:
+        try:
+            # Checked up front so a misspelled realm fails before serving
+            resolve_realms(db, args.realms)
+        except ValueError as e:
+            print(e)
+            return
+        # Get battle.net credentials
+        creds = db.get_credentials()
+        if creds is None:
+            print('No battle.net credentials cached. Please use \'$ eternal creds add\' command to cache them')
+            return
+        (client_id, client_secret, _) = creds
+        client = get_client(db, client_id, client_secret, pool_size=args.workers)
+        # Fetch recipes/reagents
+        fetch_recipes(db, client_id, client_secret, client=client, workers=args.workers)
+        archive = SnapshotArchive(args.archive) if args.archive is not None else None
+        synced = sync_realms(db, client, connected_realms, args.workers, archive)
+        print(f'synced {len(synced)} of {len(connected_realms)} connected realms with new snapshots')
+        if args.retention_days is not None:
+            db.prune(raw_days=args.retention_days)
+            if archive is not None:
+                # Archived snapshots are kept, just compressed once they fall out of retention
+                before = calendar.timegm(datetime.utcnow().timetuple()) - args.retention_days * 86400
+                for realm in connected_realms:
+                    archive.compact(realm, before)
+
+
+def serve_args(args):
+    from server import PriceService, SyncScheduler, make_server
+    with Store(args.store, check_same_thread=False) as db:
+        try:
+            # Checked up front so a misspelled realm fails before serving
+            resolve_realms(db, args.realms)
+        except ValueError as e:
+            print(e)
+            return
+        creds = db.get_credentials()
+        if creds is None:
+            print('No battle.net credentials cached. Please use \'$ eternal creds add\' command to cache them')
+            return
+        (client_id, client_secret, _) = creds
+        service = PriceService(db)
+        archive = SnapshotArchive(args.archive) if args.archive is not None else None
+
+        def sync():
+            # A new client per cycle picks up a fresh token once the cached one expires
+            with service.lock:
+                client = get_client(db, client_id, client_secret, pool_size=args.workers)
+                fetch_recipes(db, client_id, client_secret, client=client, workers=args.workers)
+            # Incremental, usually a single request for the connected-realm index
+            refresh_realm_directory(db, client, workers=args.workers, lock=service.lock)
+            # Resolved per cycle so `--realms all` picks up newly listed realms
+            with service.lock:
+                connected_realms = resolve_realms(db, args.realms)
+            synced = sync_realms(db, client, connected_realms, args.workers, archive, service.lock)
+            if len(synced) > 0:
+                service.invalidate()
+            print(f'synced {len(synced)} of {len(connected_realms)} connected realms with new snapshots')
+            if args.metrics_file is not None:
+                metrics.write(args.metrics_file, args.metrics_format)
+
+        scheduler = SyncScheduler(sync, args.interval)
+        scheduler.start()
+        server = make_server(service, args.host, args.port)
+        print(f'serving on http://{args.host}:{args.port}')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            scheduler.stop()
+            server.server_close()
+            # Let an in-flight sync finish recording before the store closes
+            scheduler.join()
+
+
+def realms_args(args):
+    with Store(args.store) as db:
+        if args.refresh:
+            creds = db.get_credentials()
+            if creds is None:
+                print('No battle.net credentials cached. Please use \'$ eternal creds add\' command to cache them')
+                return
+            (client_id, client_secret, _) = creds
+            client = get_client(db, client_id, client_secret, pool_size=args.workers)
+            fetched = refresh_realm_directory(db, client, args.max_age_days, args.workers)
+            print(f'refreshed {fetched} connected realms')
+        search = args.search.lower() if args.search is not None else None
+        for (name, connected_realm) in db.get_realms():
+            if search is None or search in name.lower():
+                print(f'{connected_realm}\t{name}')
+
+
+def prune_args(args):
+    with Store(args.store) as db:
+        load = db.prune(raw_days=args.raw_days, daily_days=args.daily_days)
+        if load is not None:
+            print(f'pruned {load}')
 
 
 def add_credentials(args):
@@ -185,6 +556,19 @@ def clear_credentials(args):
 def add_client_arguments(subparser):
     subparser.add_argument('--store', default='eternal.db',
                            type=str, help='sqlite database location')
+    subparser.add_argument('--profile', action='store_true',
+                           help='print where the time went when the command finishes')
+    subparser.add_argument('--metrics-file', type=str,
+                           help='write timings and counters to this file when the command finishes')
+    subparser.add_argument('--metrics-format', default='prometheus', choices=['prometheus', 'jsonl'],
+                           help='prometheus text format (replaced each run) or json lines (appended)')
+
+
+def export_metrics(args):
+    if getattr(args, 'profile', False):
+        print(f'\n{metrics.report()}')
+    if getattr(args, 'metrics_file', None) is not None:
+        metrics.write(args.metrics_file, args.metrics_format)
 
 
 def main():
@@ -214,14 +598,115 @@ def main():
 
     add_client_arguments(parser_cost)
     parser_cost.add_argument('--realm', default='154',
-                             type=int, help='wow connected-realm id')
+                             type=str, help='realm name or connected-realm id')
     parser_cost.add_argument(
         '--cost', action='store_true', help='display cost only')
+    parser_cost.add_argument('--quantity', default=1,
+                             type=int, help='number of times to craft the recipe')
+    parser_cost.add_argument('--offline', action='store_true',
+                             help='answer from the cached recipes and listings without going online')
     parser_cost.add_argument('recipename', type=str, nargs=1)
     parser_cost.set_defaults(func=cost_recipe_args)
 
+    parser_report = subparsers.add_parser(
+        'report', help='material cost, price and margin of every recipe')
+    add_client_arguments(parser_report)
+    parser_report.add_argument('--realm', default='154',
+                               type=str, help='realm name or connected-realm id')
+    parser_report.add_argument('--sort', default='margin', choices=['margin', 'cost', 'price', 'name'],
+                               help='column to sort recipes by')
+    parser_report.add_argument('--limit', type=int, help='only show the first LIMIT recipes')
+    parser_report.add_argument('--csv', action='store_true', help='write the report as csv')
+    parser_report.add_argument('--offline', action='store_true',
+                               help='answer from the cached recipes and listings without going online')
+    parser_report.set_defaults(func=report_args)
+
+    parser_sources = subparsers.add_parser(
+        'sources', help='find which realm sells each reagent of a recipe cheapest')
+    add_client_arguments(parser_sources)
+    parser_sources.add_argument('--realm', default='154',
+                                type=str, help='realm name or connected-realm id the recipe is costed on')
+    parser_sources.add_argument('--realms', nargs='+', type=str,
+                                help='realms to compare, every synced realm by default')
+    parser_sources.add_argument('--quantity', default=1,
+                                type=int, help='number of times to craft the recipe')
+    parser_sources.add_argument('--limit', default=10,
+                                type=int, help='number of realms to list totals for')
+    parser_sources.add_argument('--offline', action='store_true',
+                                help='answer from the cached recipes and listings without going online')
+    parser_sources.add_argument('recipename', type=str, nargs=1)
+    parser_sources.set_defaults(func=sources_args)
+
+    parser_uses = subparsers.add_parser(
+        'uses', help='list the recipes an item feeds into, directly or through crafted reagents')
+    add_client_arguments(parser_uses)
+    parser_uses.add_argument('--realm', default='154',
+                             type=str, help='realm name or connected-realm id')
+    parser_uses.add_argument('--direct', action='store_true',
+                             help='only recipes using the item as a reagent themselves')
+    parser_uses.add_argument('--limit', type=int, help='only show the first LIMIT recipes')
+    parser_uses.add_argument('--offline', action='store_true',
+                             help='answer from the cached recipes and listings without going online')
+    parser_uses.add_argument('itemname', type=str, nargs=1)
+    parser_uses.set_defaults(func=uses_args)
+
+    parser_sync = subparsers.add_parser(
+        'sync', help='download auction house listings for many realms')
+    add_client_arguments(parser_sync)
+    parser_sync.add_argument('--realms', nargs='+', required=True,
+                             type=str, help='realm names, connected-realm ids or \'all\'')
+    parser_sync.add_argument('--workers', default=8,
+                             type=int, help='number of realms to download concurrently')
+    parser_sync.add_argument('--retention-days', type=int,
+                             help='keep raw snapshots for this many days, older ones remain as rollups')
+    parser_sync.add_argument('--archive', type=str,
+                             help='also write every raw snapshot to a columnar archive in this directory')
+    parser_sync.set_defaults(func=sync_realms_args)
+
+    parser_serve = subparsers.add_parser(
+        'serve', help='keep prices in memory, sync hourly and answer queries over a local JSON API')
+    add_client_arguments(parser_serve)
+    parser_serve.add_argument('--realms', nargs='+', required=True,
+                              type=str, help='realm names, connected-realm ids or \'all\' to keep synced')
+    parser_serve.add_argument('--host', default='127.0.0.1',
+                              type=str, help='address to listen on')
+    parser_serve.add_argument('--port', default=8080,
+                              type=int, help='port to listen on')
+    parser_serve.add_argument('--interval', default=3600,
+                              type=int, help='seconds between syncs')
+    parser_serve.add_argument('--workers', default=8,
+                              type=int, help='number of realms to download concurrently')
+    parser_serve.add_argument('--archive', type=str,
+                              help='also write every raw snapshot to a columnar archive in this directory')
+    parser_serve.set_defaults(func=serve_args)
+
+    parser_realms = subparsers.add_parser(
+        'realms', help='list realms and their connected-realm ids')
+    add_client_arguments(parser_realms)
+    parser_realms.add_argument('--refresh', action='store_true',
+                               help='update the realm directory from battle.net first')
+    parser_realms.add_argument('--max-age-days', default=7, type=int,
+                               help='refetch connected realms last updated longer ago than this')
+    parser_realms.add_argument('--workers', default=8,
+                               type=int, help='number of connected realms to fetch concurrently')
+    parser_realms.add_argument('search', type=str, nargs='?', help='only list realms whose name contains this')
+    parser_realms.set_defaults(func=realms_args)
+
+    parser_prune = subparsers.add_parser(
+        'prune', help='drop old snapshots that are covered by price rollups')
+    add_client_arguments(parser_prune)
+    parser_prune.add_argument('--raw-days', type=int,
+                              help='days of raw hourly snapshots to keep')
+    parser_prune.add_argument('--daily-days', type=int,
+                              help='days of daily rollups to keep, weekly rollups are always kept')
+    parser_prune.set_defaults(func=prune_args)
+
     args = parser.parse_args()
-    args.func(args)
+    try:
+        with metrics.span('eternal.total'):
+            args.func(args)
+    finally:
+        export_metrics(args)
 
 
 if __name__ == "__main__":
@@ -1,48 +1,72 @@
 import itertools
+from fractions import Fraction
+
+
+def unit_cost(craft_cost, crafted_quantity, price):
+    # Cost of one unit of a craftable item, a craft's share of its material
+    # cost when that beats the listed price. Shared by Item and
+    # RecipeGraph.profitability so both cost intermediates the same way.
+    unit = craft_cost / crafted_quantity if crafted_quantity != 1 else craft_cost
+    return unit if price is None or unit < price else price
 
 
 class Item:
-    def __init__(self, id, name, price=None, recipe=[]):
+    def __init__(self, id, name, price=None, recipe=[], crafted_quantity=1):
         self.id = id
         self.name = name
         self.price = price
+        self.crafted_quantity = crafted_quantity
         self.base_items = [(item, quantity)
                            for (item, quantity) in recipe if not item.craftable]
         self.craft_items = [(item, quantity)
                             for (item, quantity) in recipe if item.craftable]
         self.craftable = len(recipe) > 0
+        # Items are shared between every recipe using them, so each one
+        # only works out its costs once.
+        self.__component_cost_cache = None
+        self.__selection_cache = None
 
     def __component_cost(self):
-        base_items_cost = [quantity * item.cost()
-                           for (item, quantity) in self.base_items]
-        craft_items_cost = [quantity * item.cost()
-                            for (item, quantity) in self.craft_items]
-        return sum(base_items_cost) + sum(craft_items_cost)
+        if self.__component_cost_cache is None:
+            base_items_cost = [quantity * item.cost()
+                               for (item, quantity) in self.base_items]
+            craft_items_cost = [quantity * item.cost()
+                                for (item, quantity) in self.craft_items]
+            self.__component_cost_cache = sum(base_items_cost) + sum(craft_items_cost)
+        return self.__component_cost_cache
+
+    def craft_cost(self):
+        # Material cost of one craft, making `crafted_quantity` units
+        return self.__component_cost()
 
     def cost(self):
+        # Cost of one unit, crafted or bought
         if not self.craftable:
             return self.price
+        return unit_cost(self.__component_cost(), self.crafted_quantity, self.price)
 
-        total_component_cost = self.__component_cost()
-        return total_component_cost if self.price is None or total_component_cost < self.price else self.price
+    def crafted(self):
+        # Less than is used to favor the time savings when equal for
+        # the cost of components since recipes take time to create.
+        return self.craftable and self.cost() != self.price
 
     def expand_quantity(self, items, quantity):
         return [(item, quantity * q) for (item, q) in items]
 
     def selection(self):
-        if not self.craftable:
-            return [(self, 1)]
-
-        # Less than is used to favor the time savings when equal for
-        # the cost of components since recipes take time to create.
-        if self.price is None or self.__component_cost() < self.price:
-            craft_items_selection = [self.expand_quantity(
-                item.selection(), quantity) for (item, quantity) in self.craft_items]
-            craft_items_selection = list(
-                itertools.chain(*craft_items_selection))
-            return self.base_items + craft_items_selection
-        else:
+        # What to buy for one craft of this item, or the item itself when
+        # buying it is cheaper
+        if not self.crafted():
             return [(self, 1)]
+        if self.__selection_cache is None:
+            craft_items_selection = []
+            for (item, quantity) in self.craft_items:
+                if item.crafted() and item.crafted_quantity != 1:
+                    # Crafts needed for `quantity` units, kept exact
+                    quantity = Fraction(quantity, item.crafted_quantity)
+                craft_items_selection.append(self.expand_quantity(item.selection(), quantity))
+            self.__selection_cache = self.base_items + list(itertools.chain(*craft_items_selection))
+        return list(self.__selection_cache)
 
 
 # herb1 = Item(2, "herb1", price=2)
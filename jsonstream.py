@@ -0,0 +1,193 @@
+import codecs
+import json
+from collections import deque
+
+_decoder = json.JSONDecoder()
+_whitespace = ' \t\n\r'
+
+
+# Returned by ArrayReader.read once the top-level object is closed
+END = object()
+
+
+class Starved(Exception):
+    '''
+    A fed JSONStream needs more input than it was given. Nothing is consumed
+    by the read that raised it, so it can be retried after feed().
+    '''
+
+
+class JSONStream:
+    '''
+    Incremental reader over an iterable of utf-8 encoded chunks. Only the
+    value currently being decoded is held in memory, so arbitrarily large
+    documents can be walked with a flat memory profile.
+
+    Without `chunks` the input is given with feed() and finish() instead,
+    for chunks that arrive asynchronously.
+    '''
+
+    def __init__(self, chunks=None):
+        self.__chunks = iter(chunks) if chunks is not None else None
+        self.__fed = deque()
+        self.__finished = False
+        self.__decoder = codecs.getincrementaldecoder('utf-8')()
+        self.__buffer = ''
+        self.__pos = 0
+        self.__eof = False
+
+    def feed(self, chunk):
+        self.__fed.append(chunk)
+
+    def finish(self):
+        self.__finished = True
+
+    def __next_chunk(self):
+        if self.__chunks is not None:
+            return next(self.__chunks, None)
+        if len(self.__fed) > 0:
+            return self.__fed.popleft()
+        if self.__finished:
+            return None
+        raise Starved()
+
+    def __fill(self):
+        # Drop everything already consumed before reading the next chunk
+        self.__buffer = self.__buffer[self.__pos:]
+        self.__pos = 0
+        while not self.__eof:
+            chunk = self.__next_chunk()
+            if chunk is None:
+                self.__eof = True
+                self.__buffer += self.__decoder.decode(b'', final=True)
+                return False
+            text = self.__decoder.decode(chunk) if isinstance(chunk, bytes) else chunk
+            if len(text) > 0:
+                self.__buffer += text
+                return True
+        return False
+
+    def peek(self):
+        while True:
+            while self.__pos < len(self.__buffer) and self.__buffer[self.__pos] in _whitespace:
+                self.__pos += 1
+            if self.__pos < len(self.__buffer):
+                return self.__buffer[self.__pos]
+            if not self.__fill() and self.__pos >= len(self.__buffer):
+                return None
+
+    def expect(self, chars):
+        c = self.peek()
+        if c is None or c not in chars:
+            raise ValueError(f'expected one of {chars!r} but found {c!r}')
+        self.__pos += 1
+        return c
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                obj, end = _decoder.raw_decode(self.__buffer, self.__pos)
+                # A value ending exactly at the buffer edge may be a truncated
+                # number or literal, so only accept it once more input follows.
+                if end < len(self.__buffer) or self.__eof:
+                    self.__pos = end
+                    return obj
+            except json.JSONDecodeError:
+                if self.__eof:
+                    raise
+            self.__fill()
+
+
+class ArrayReader:
+    '''
+    Walks the elements of the array stored under `key` in a top-level JSON
+    object. Every step consumes input only once it succeeds, so a read that
+    runs out of fed input (Starved) picks up where it stopped next time.
+    '''
+
+    def __init__(self, stream, key):
+        self.stream = stream
+        self.key = key
+        self.state = 'open'
+        self.name = None
+
+    def read(self):
+        # The next element, or END once the object is closed
+        stream = self.stream
+        while True:
+            # Array elements first, they are most of the document
+            if self.state == 'element':
+                element = stream.value()
+                self.state = 'separator'
+                return element
+            elif self.state == 'separator':
+                self.state = 'next' if stream.expect(',]') == ']' else 'element'
+            elif self.state == 'open':
+                stream.expect('{')
+                self.state = 'first'
+            elif self.state == 'first':
+                self.state = 'end' if stream.peek() == '}' else 'name'
+            elif self.state == 'name':
+                self.name = stream.value()
+                self.state = 'colon'
+            elif self.state == 'colon':
+                stream.expect(':')
+                self.state = 'value'
+            elif self.state == 'value':
+                if self.name == self.key and stream.peek() == '[':
+                    stream.expect('[')
+                    self.state = 'array'
+                else:
+                    stream.value()
+                    self.state = 'next'
+            elif self.state == 'array':
+                if stream.peek() == ']':
+                    stream.expect(']')
+                    self.state = 'next'
+                else:
+                    self.state = 'element'
+            elif self.state == 'next':
+                self.state = 'end' if stream.expect(',}') == '}' else 'name'
+            else:
+                return END
+
+    def available(self):
+        # Elements that can be read from the input fed so far
+        while True:
+            try:
+                element = self.read()
+            except Starved:
+                return
+            if element is END:
+                return
+            yield element
+
+
+def iter_array(chunks, key):
+    '''
+    Yield each element of the array stored under `key` in the top-level
+    JSON object streamed in by `chunks`.
+    '''
+    reader = ArrayReader(JSONStream(chunks), key)
+    while True:
+        element = reader.read()
+        if element is END:
+            return
+        yield element
+
+
+async def aiter_array(chunks, key):
+    '''
+    iter_array over an async iterable of chunks, every element is yielded as
+    soon as the chunks received so far hold all of it.
+    '''
+    stream = JSONStream()
+    reader = ArrayReader(stream, key)
+    async for chunk in chunks:
+        stream.feed(chunk)
+        for element in reader.available():
+            yield element
+    stream.finish()
+    for element in reader.available():
+        yield element
@@ -0,0 +1,62 @@
+import sys
+from array import array
+
+
+def _pack(values):
+    # Blobs are always stored little endian so databases move between machines
+    if sys.byteorder == 'big':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _unpack(blob):
+    values = array('i')
+    values.frombytes(blob)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+
+class PriceLadder:
+    '''
+    Depth of market for one item in one snapshot: ascending price levels
+    and the quantity listed at each one, kept as two parallel int arrays.
+    '''
+
+    def __init__(self, prices, quantities):
+        self.prices = prices
+        self.quantities = quantities
+
+    @classmethod
+    def from_levels(cls, levels):
+        # levels: {price: quantity}
+        prices = array('i', sorted(levels))
+        return cls(prices, array('i', [levels[p] for p in prices]))
+
+    @classmethod
+    def from_blobs(cls, prices, quantities):
+        return cls(_unpack(prices), _unpack(quantities))
+
+    def to_blobs(self):
+        return (_pack(self.prices), _pack(self.quantities))
+
+    @property
+    def available(self):
+        return sum(self.quantities)
+
+    def cost(self, quantity):
+        # Buy cheapest listings first. Returns the total cost and how much of
+        # the quantity the ladder could actually fill.
+        total = 0
+        filled = 0
+        for (price, available) in zip(self.prices, self.quantities):
+            if filled >= quantity:
+                break
+            take = min(available, quantity - filled)
+            total += take * price
+            filled += take
+        return (total, filled)
+
+    def __len__(self):
+        return len(self.prices)
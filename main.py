@@ -1,15 +1,25 @@
-from datetime import datetime, timedelta
+from datetime import datetime
 
 from dearpygui import simple
 from dearpygui.core import *
 from dearpygui.demo import *
 
-from eternal import cost_recipe, download_listings
-from realms import realms
+from dataservice import DataService
+from eternal import download_listings
+from series import SeriesWindow
 from store import Store
 
 db_path = 'eternal.db'
+search_page_size = 50
 add_value('selected_realm_id', 0)
+add_data('reagent_search_results', [])
+# Every query from the UI goes through one connection on a background worker
+data_service = DataService(db_path, on_error=lambda e: log_error(str(e)))
+# Price history of the selected item as loaded into the plot
+price_window = None
+plot_points = 800
+plot_check_interval = 0.25
+add_data('plot_checked', 0.0)
 
 
 def post_setup():
@@ -18,44 +28,86 @@ def post_setup():
     add_value('selected_reagent_name', '')
     add_value('selected_reagent_gold', '')
     add_value('show_login_window', False)
-    realm_id = None
-    with Store(db_path) as db:
-        realm_name = db.get_cache()
-    if realm_name is None:
+    realm = data_service.call(cached_realm)
+    if realm is None:
         return
-    realm_name = realm_name[0]
-    realms_dict = {name: id for (name, id) in realms}
-    realm_select_callback(realm_name, (realm_name, realms_dict[realm_name]))
+    realm_select_callback(realm[0], realm)
 
 
-def get_all_items():
-    with Store(db_path) as db:
-        return sorted([r[1] for r in db.get_all_reagents()])
+def cached_realm():
+    # Runs on the data service worker
+    realm_name = data_service.db.get_cache()
+    if realm_name is None:
+        return None
+    realm_id = data_service.db.find_realm(realm_name[0])
+    if realm_id is None:
+        return None
+    return (realm_name[0], realm_id)
+
+
+def update_search_results(page=0):
+    # Names are looked up as the user types and shown a page at a time,
+    # one extra row tells whether there is another page to load.
+    query = get_value('Search##reagentsearch')
+
+    def show(names):
+        results = get_data('reagent_search_results') if page > 0 else []
+        results = results + names[:search_page_size]
+        add_data('reagent_search_results', results)
+        add_data('reagent_search_page', page)
+        configure_item('Items##reagentcombo', items=results)
+        configure_item('More##reagentsearchmore', show=len(names) > search_page_size)
+    data_service.submit('search', [
+        (lambda: data_service.db.search_names(query, search_page_size + 1, page * search_page_size), show)
+    ])
+
+
+def reagent_search_callback(sender, data):
+    update_search_results()
+
+
+def reagent_search_more_callback(sender, data):
+    update_search_results(get_data('reagent_search_page') + 1)
+
+
+def get_all_realms():
+    return data_service.call(data_service.db.get_realms)
 
 
 def realm_select_callback(sender, data):
     realm_name, connected_realm_id = data
     add_data('selected_realm_id', connected_realm_id)
     log_debug(f'Selected Realm: {connected_realm_id}')
+    auction_sync_update(sender, data)
     set_item_label('Realm Select##mainmenu', f'Realm: {realm_name}')
-    with Store(db_path) as db:
-        db.update_cache(realm_name)
+    data_service.submit('realm', [(lambda: data_service.db.update_cache(realm_name), lambda _: None)])
     configure_item(sender, check=True)
 
 
+def selected_realm():
+    realm_id = get_data('selected_realm_id')
+    return realm_id if realm_id else None
+
+
 def auction_sync_update(sender, data):
     log_debug(f'Realm sync check')
-    with Store(db_path) as db:
-        last_synced = db.get_last_download()
-        label = 'Last Sync: > 1 hour ago'
+    realm = selected_realm()
+
+    def show(last_synced):
+        # Syncing is a conditional request, so it stays cheap to retry even
+        # when the current snapshot is still the newest one.
+        label = 'Last Sync: never'
         configure_item('Run Sync##auctionmenusync', enabled=True)
-        if last_synced is not None and datetime.fromisoformat(last_synced) + timedelta(hours=1) > datetime.utcnow():
-            label = 'Last Sync: < 1 hour ago'
-            configure_item('Run Sync##auctionmenusync', enabled=False)
+        if last_synced is not None:
+            minutes = int((datetime.utcnow() - datetime.fromisoformat(last_synced)).total_seconds() // 60)
+            label = f'Last Sync: {minutes} minutes ago'
         set_item_label('##auctionmenusynctime', label)
+    data_service.submit('sync_status', [(lambda: data_service.db.get_last_download(realm), show)])
 
 
 def auction_sync(sender, data):
+    # Downloads take a while, so they get their own connection instead of
+    # holding up the data service worker
     with Store(db_path) as db:
         # Get battle.net credentials
         creds = db.get_credentials()
@@ -74,61 +126,135 @@ def auction_sync_run_callback(sender, data):
         set_item_label('##auctionmenusynctime', 'Syncing...')
         configure_item('Run Sync##auctionmenusync', enabled=False)
         run_async_function(auction_sync, realm_id,
-                           return_handler=auction_sync_update)
+                           return_handler=auction_sync_done)
+
+
+def auction_sync_done(sender, data):
+    auction_sync_update(sender, data)
+    # Only the new points go onto the plot, the loaded ones stay as they are
+    window = price_window
+    if window is not None and window.last() is not None:
+        data_service.submit('history_append', [
+            (lambda: data_service.history_since(window.name, window.realm, window.last()),
+             lambda points: window.append(points) and draw_price_window(window))
+        ])
 
 
 def reagent_select_callback(sender, data):
-    with Store(db_path) as db:
-        set_value('selected_reagent_name', get_value(sender))
-        reagent = db.get_price_by_name(get_value(sender))
-        if reagent is None:
-            set_value('reagent_gold_auction', f'No auctions')
-        else:
-            set_value('reagent_gold_auction', f'{reagent[0]} gold')
-        recipe = cost_recipe(db, get_value(sender))
-        if recipe is None:
-            hide_item('group##cheapestprice')
-            hide_item('header##recipebreakdown')
-            hide_item('header##costbreakdown')
-        else:
-            # Set cheapest price
-            set_value('reagent_gold_cheapest', f'{recipe.cost()} gold')
-            show_item('group##cheapestprice')
-            # Set Recipe
-            delete_item('header##recipebreakdown', children_only=True)
-            walk_recipe(recipe, 'header##recipebreakdown')
-            add_separator(parent='header##recipebreakdown')
-            show_item('header##recipebreakdown')
-            # Set Cost Breakdown
-            cost_breakdown = [[item.price * quantity, item.price, quantity, item.name]
-                              for (item, quantity) in recipe.selection()]
-            set_table_data('table##costbreakdown', cost_breakdown)
-            show_item('header##costbreakdown')
-        # Set Historical Price
-        history = db.get_price_history(get_value(sender))
-        if history is not None and len(history) > 0:
-            historyx = [datetime.fromisoformat(dt).timestamp() for (
-                id, price, quantity, dt) in history]
-            historyy = [price for (id, price, quantity, dt) in history]
-            add_line_series(
-                'plot##price', f'{get_value(sender)}', historyx, historyy)
-        show_item('group##displayreagent')
+    # Price, recipe and history load one after another on the data service.
+    # Picking another item meanwhile drops whatever is left of this one.
+    name = get_value(sender)
+    realm = selected_realm()
+    window = SeriesWindow(name, realm, plot_points)
+    set_value('selected_reagent_name', name)
+    set_value('reagent_gold_auction', '...')
+    data_service.cancel('history')
+    data_service.submit('selection', [
+        (lambda: data_service.price(name, realm), show_reagent_price),
+        (lambda: data_service.recipe(name, realm), show_reagent_recipe),
+        (lambda: data_service.uses(name, realm), show_reagent_uses),
+        (lambda: data_service.history(name, realm, max_points=plot_points),
+         lambda history: show_reagent_history(window, history))
+    ])
+    show_item('group##displayreagent')
+
+
+def show_reagent_price(reagent):
+    if reagent is None:
+        set_value('reagent_gold_auction', f'No auctions')
+    else:
+        set_value('reagent_gold_auction', f'{reagent[0]} gold')
+
+
+def show_reagent_recipe(costed):
+    if costed is None:
+        hide_item('group##cheapestprice')
+        hide_item('header##recipebreakdown')
+        hide_item('header##costbreakdown')
+        return
+    (recipe, shopping) = costed
+    # Set cheapest price
+    set_value('reagent_gold_cheapest', f'{round(recipe.cost())} gold')
+    show_item('group##cheapestprice')
+    # Set Recipe
+    delete_item('header##recipebreakdown', children_only=True)
+    walk_recipe(recipe, 'header##recipebreakdown')
+    add_separator(parent='header##recipebreakdown')
+    show_item('header##recipebreakdown')
+    # Set Cost Breakdown
+    cost_breakdown = [[cost, item.price, quantity, item.name]
+                      for (item, quantity, cost, filled) in shopping]
+    set_table_data('table##costbreakdown', cost_breakdown)
+    show_item('header##costbreakdown')
+
+
+def show_reagent_uses(uses):
+    if len(uses) == 0:
+        hide_item('header##uses')
+        return
+    rows = [[margin if margin is not None else '', cost, price if price is not None else '', depth,
+             recipe.name if complete else f'{recipe.name} *']
+            for (recipe, cost, price, margin, complete, depth) in uses]
+    set_table_data('table##uses', rows)
+    show_item('header##uses')
+
+
+def show_reagent_history(window, history):
+    # The whole history comes back already thinned to the plot width, finer
+    # points are loaded by check_price_zoom once the user zooms in
+    global price_window
+    if history is None or len(history) == 0:
+        return
+    clear_plot('plot##price')
+    window.load(None, None, history)
+    price_window = window
+    draw_price_window(window, fit=True)
+
+
+def draw_price_window(window, fit=False):
+    historyx = [timestamp for (timestamp, close) in window.points]
+    historyy = [close for (timestamp, close) in window.points]
+    add_line_series('plot##price', f'{window.name}', historyx, historyy, update_bounds=fit)
+
+
+def check_price_zoom():
+    window = price_window
+    if window is None or get_total_time() - get_data('plot_checked') < plot_check_interval:
+        return
+    add_data('plot_checked', get_total_time())
+    (start, end) = get_plot_xlimits('plot##price')
+    request = window.request(start, end)
+    if request is None:
+        return
+
+    def show(history):
+        if history is not None and price_window is window:
+            window.load(request[0], request[1], history)
+            draw_price_window(window)
+    # Mark the window as covered straight away so the same range is not
+    # asked for again while the points are loading
+    window.start, window.end = request
+    data_service.submit('history', [
+        (lambda: data_service.history(window.name, window.realm, request[0], request[1], plot_points), show)
+    ])
 
 
 def login_submit_callback(sender, data):
-    with Store(db_path) as db:
-        client_id = get_value('clientid')
-        client_secret = get_value('clientsecret')
-        if client_id is not None and len(client_id) > 0 and client_secret is not None and len(client_secret) > 0:
-            db.add_or_replace_credentials(
-                client_id.strip(' '), client_secret.strip(' '), datetime.utcnow())
-            set_value('clientid', '')
-            set_value('clientsecret', '')
+    client_id = get_value('clientid')
+    client_secret = get_value('clientsecret')
+    if client_id is not None and len(client_id) > 0 and client_secret is not None and len(client_secret) > 0:
+        data_service.submit('credentials', [(lambda: data_service.db.add_or_replace_credentials(
+            client_id.strip(' '), client_secret.strip(' '), datetime.utcnow()), lambda _: None)])
+        set_value('clientid', '')
+        set_value('clientsecret', '')
 
 
 def on_render(sender, data):
     delta_time = str(round(get_delta_time(), 4))
     total_time = str(round(get_total_time(), 4))
+    # Hand finished background work to the widgets, on the UI thread
+    data_service.poll()
+    check_price_zoom()
 
 
 def walk_recipe(reagent, parent, default_open=False):
@@ -153,7 +279,7 @@ with simple.window('##main', label='Eternal Auction'):
         add_menu_item('Login##mainmenu', callback=lambda sender,
                       data: show_item('##login'))
         with menu('Realm Select##mainmenu'):
-            for (name, id) in sorted(realms):
+            for (name, id) in get_all_realms():
                 add_menu_item(
                     name, check=False, callback=realm_select_callback, callback_data=(name, id))
         with menu('Auction##mainmenu'):
@@ -162,9 +288,13 @@ with simple.window('##main', label='Eternal Auction'):
                           enabled=False, callback=auction_sync_run_callback)
 
     with group('group##selectionreagent'):
-        add_input_text('Search##reagentsearch', hint='Eternal Cauldron')
-        add_combo('Items##reagentcombo', items=get_all_items(),
-                  callback=reagent_select_callback)
+        add_input_text('Search##reagentsearch', hint='Eternal Cauldron',
+                       callback=reagent_search_callback)
+        with group('group##reagentresults', horizontal=True):
+            add_combo('Items##reagentcombo', items=[],
+                      callback=reagent_select_callback)
+            add_button('More##reagentsearchmore', show=False,
+                       callback=reagent_search_more_callback)
         add_separator()
     with group('group##displayreagent', show=False):
         with group('group##auctionprice', horizontal=True):
@@ -179,6 +309,9 @@ with simple.window('##main', label='Eternal Auction'):
     with collapsing_header('header##costbreakdown', label='Shopping List', default_open=True):
         add_table('table##costbreakdown', [
                   'Total (g)', 'AH Price (g)', 'Amount', 'Reagent'])
+    with collapsing_header('header##uses', label='Used In', show=False):
+        add_table('table##uses', [
+                  'Margin (g)', 'Cost (g)', 'Price (g)', 'Depth', 'Recipe'])
     with collapsing_header('header##history', label='Historical Price'):
         add_plot('plot##price', label='Historical Price', y_axis_name='AH Price (g)',
                  yaxis_lock_min=True, height=400, xaxis_time=True)
@@ -197,4 +330,8 @@ post_setup()
 set_render_callback(callback=on_render)
 set_main_window_title('Eternal Auction')
 set_main_window_size(800, 800)
-start_dearpygui(primary_window='##main')
+try:
+    start_dearpygui(primary_window='##main')
+finally:
+    # Stop the worker and close its connection once the window is closed
+    data_service.close()
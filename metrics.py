@@ -0,0 +1,110 @@
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+
+class Metrics:
+    '''
+    Process wide timing spans and counters. Spans accumulate their call count
+    and total wall time, so a phase entered once per realm or per request
+    shows up as one line. Safe to use from worker threads.
+    '''
+
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.spans = {}
+        self.counters = {}
+
+    def reset(self):
+        with self.lock:
+            self.spans = {}
+            self.counters = {}
+
+    def record(self, name, seconds):
+        with self.lock:
+            span = self.spans.setdefault(name, [0, 0.0])
+            span[0] += 1
+            span[1] += seconds
+
+    @contextmanager
+    def span(self, name):
+        started = self.clock()
+        try:
+            yield
+        finally:
+            self.record(name, self.clock() - started)
+
+    def timed_iter(self, name, iterable):
+        # Times only the work done producing each element, not the consumer's
+        # work between elements. Counted as one span per iteration.
+        iterator = iter(iterable)
+        elapsed = 0.0
+        try:
+            while True:
+                started = self.clock()
+                try:
+                    value = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    elapsed += self.clock() - started
+                yield value
+        finally:
+            self.record(name, elapsed)
+
+    def incr(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def report(self):
+        with self.lock:
+            spans = sorted(self.spans.items(), key=lambda s: -s[1][1])
+            counters = sorted(self.counters.items())
+        lines = [f'{"seconds":>10}{"calls":>8}  span']
+        lines += [f'{seconds:>10.3f}{count:>8}  {name}' for (name, (count, seconds)) in spans]
+        if len(counters) > 0:
+            lines.append('')
+            lines += [f'{value:>18}  {name}' for (name, value) in counters]
+        return '\n'.join(lines)
+
+    def prometheus(self, prefix='eternal'):
+        with self.lock:
+            spans = sorted(self.spans.items())
+            counters = sorted(self.counters.items())
+        lines = [f'# TYPE {prefix}_span_seconds_total counter']
+        lines += [f'{prefix}_span_seconds_total{{span="{name}"}} {seconds}' for (name, (_, seconds)) in spans]
+        lines.append(f'# TYPE {prefix}_span_calls_total counter')
+        lines += [f'{prefix}_span_calls_total{{span="{name}"}} {count}' for (name, (count, _)) in spans]
+        for (name, value) in counters:
+            metric = f'{prefix}_{re.sub("[^a-zA-Z0-9_]", "_", name)}_total'
+            lines.append(f'# TYPE {metric} counter')
+            lines.append(f'{metric} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def jsonl(self):
+        now = time.time()
+        with self.lock:
+            lines = [json.dumps({'time': now, 'type': 'span', 'name': name, 'calls': count, 'seconds': seconds})
+                     for (name, (count, seconds)) in sorted(self.spans.items())]
+            lines += [json.dumps({'time': now, 'type': 'counter', 'name': name, 'value': value})
+                      for (name, value) in sorted(self.counters.items())]
+        return ''.join(line + '\n' for line in lines)
+
+    def write(self, path, format='prometheus'):
+        if format == 'jsonl':
+            # Appended so every run adds a batch of records to the same log
+            with open(path, 'a') as f:
+                f.write(self.jsonl())
+            return
+        # Prometheus textfile collectors may read at any moment, swap the whole file
+        partial = path + '.partial'
+        with open(partial, 'w') as f:
+            f.write(self.prometheus())
+        os.replace(partial, path)
+
+
+metrics = Metrics()
@@ -0,0 +1,177 @@
+'''
+In-place schema migrations for existing eternal.db files.
+
+The schema version is kept in sqlite's `user_version` pragma. New databases
+are created directly at SCHEMA_VERSION by the store's tables, older ones are
+stepped forward one version at a time by the migrations below, each inside
+its own transaction.
+'''
+from realms import realms
+
+SCHEMA_VERSION = 4
+# Connected realm the command line synced before realms were recorded
+DEFAULT_REALM = 154
+
+
+def table_exists(conn, table):
+    cur = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,))
+    return cur.fetchone() is not None
+
+
+def add_column_if_missing(conn, table, column, definition):
+    cur = conn.execute(f'PRAGMA table_info({table})')
+    if column not in [c[1] for c in cur.fetchall()]:
+        conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+
+
+def legacy_realm(conn):
+    # Connected realm id of the realm name the GUI cached, from the bundled
+    # realm list since the directory is not in the database yet
+    if table_exists(conn, 'cache'):
+        cached = conn.execute('SELECT realm_name FROM cache').fetchone()
+        if cached is not None:
+            name = str(cached[0]).lower()
+            for (realm_name, connected_realm) in realms:
+                if realm_name.lower() == name:
+                    return connected_realm
+    return DEFAULT_REALM
+
+
+def migrate_v1_to_v2(conn):
+    # Version 1 is every database created before schema versioning. Item ids
+    # move to integer keys, auctions reference their download by id and the
+    # lookup paths get indexes.
+    for table in ['auctions', 'downloads', 'reagents', 'quantities']:
+        conn.execute(f'ALTER TABLE {table} RENAME TO {table}_v1')
+    # Realm and Last-Modified columns were only added in place later on
+    add_column_if_missing(conn, 'auctions_v1', 'realm', 'INTEGER')
+    add_column_if_missing(conn, 'downloads_v1', 'realm', 'INTEGER')
+    add_column_if_missing(conn, 'downloads_v1', 'last_modified', 'TEXT')
+    # Snapshots from before realms were recorded belong to the realm last
+    # selected in the GUI, or else the command line's default
+    realm = legacy_realm(conn)
+    conn.execute('UPDATE auctions_v1 SET realm = ? WHERE realm IS NULL', (realm,))
+    conn.execute('UPDATE downloads_v1 SET realm = ? WHERE realm IS NULL', (realm,))
+    conn.execute('''
+    CREATE TABLE reagents
+    (
+        item_key INTEGER NOT NULL PRIMARY KEY,
+        item_id TEXT NOT NULL UNIQUE,
+        name TEXT NOT NULL,
+        craftable INTEGER NOT NULL
+    )
+    ''')
+    conn.execute('''
+    CREATE TABLE quantities
+    (
+        recipe_id INTEGER NOT NULL,
+        item_key INTEGER NOT NULL,
+        quantity INTEGER NOT NULL,
+        PRIMARY KEY (recipe_id, item_key)
+    ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+    CREATE TABLE downloads
+    (
+        download_id INTEGER NOT NULL PRIMARY KEY,
+        realm INTEGER,
+        datetime TEXT NOT NULL,
+        last_modified TEXT
+    )
+    ''')
+    conn.execute('''
+    CREATE TABLE auctions
+    (
+        download_id INTEGER NOT NULL,
+        item_key INTEGER NOT NULL,
+        price INTEGER NOT NULL,
+        quantity INTEGER NOT NULL,
+        PRIMARY KEY (download_id, item_key)
+    ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+    INSERT INTO reagents (item_id, name, craftable)
+    SELECT item_id, name, craftable FROM reagents_v1 ORDER BY rowid
+    ''')
+    conn.execute('''
+    INSERT OR IGNORE INTO quantities (recipe_id, item_key, quantity)
+    SELECT q.recipe_id, r.item_key, q.quantity
+    FROM quantities_v1 q
+    INNER JOIN reagents r ON q.item_id = r.item_id
+    ''')
+    conn.execute('''
+    INSERT INTO downloads (realm, datetime, last_modified)
+    SELECT realm, datetime, last_modified FROM downloads_v1 ORDER BY datetime
+    ''')
+    conn.execute('''
+    INSERT OR IGNORE INTO auctions (download_id, item_key, price, quantity)
+    SELECT d.download_id, r.item_key, a.price, a.quantity
+    FROM auctions_v1 a
+    INNER JOIN downloads d ON a.datetime = d.datetime AND a.realm IS d.realm
+    INNER JOIN reagents r ON a.item_id = r.item_id
+    ''')
+    for table in ['auctions', 'downloads', 'reagents', 'quantities']:
+        conn.execute(f'DROP TABLE {table}_v1')
+
+
+def migrate_v2_to_v3(conn):
+    # Robust price statistics next to the cheapest price, left empty for
+    # snapshots recorded before them
+    for column in ['p10', 'p25', 'vwap']:
+        add_column_if_missing(conn, 'auctions', column, 'INTEGER')
+
+
+def migrate_v3_to_v4(conn):
+    # Snapshots become deltas against the one before in a keyframe chain.
+    # Every existing snapshot is complete, so each one is its own keyframe.
+    # Tombstones for items dropped from a snapshot have no price.
+    add_column_if_missing(conn, 'downloads', 'keyframe', 'INTEGER')
+    conn.execute('UPDATE downloads SET keyframe = download_id')
+    conn.execute('ALTER TABLE auctions RENAME TO auctions_v3')
+    conn.execute('DROP INDEX IF EXISTS auctions_item')
+    conn.execute('''
+    CREATE TABLE auctions
+    (
+        download_id INTEGER NOT NULL,
+        item_key INTEGER NOT NULL,
+        price INTEGER,
+        quantity INTEGER NOT NULL,
+        p10 INTEGER,
+        p25 INTEGER,
+        vwap INTEGER,
+        PRIMARY KEY (download_id, item_key)
+    ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+    INSERT INTO auctions (download_id, item_key, price, quantity, p10, p25, vwap)
+    SELECT download_id, item_key, price, quantity, p10, p25, vwap FROM auctions_v3
+    ''')
+    conn.execute('DROP TABLE auctions_v3')
+
+
+# Keyed by the version each migration upgrades from
+migrations = {
+    1: migrate_v1_to_v2,
+    2: migrate_v2_to_v3,
+    3: migrate_v3_to_v4
+}
+
+
+def upgrade(conn):
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    if version == 0:
+        if not table_exists(conn, 'auctions'):
+            # Fresh database, the tables get created at the latest version
+            return
+        version = 1
+    while version < SCHEMA_VERSION:
+        conn.execute('BEGIN')
+        try:
+            migrations[version](conn)
+            conn.execute(f'PRAGMA user_version = {version + 1}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        version += 1
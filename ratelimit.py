@@ -0,0 +1,56 @@
+import asyncio
+import threading
+import time
+
+
+class RateLimiter:
+    '''
+    Thread-safe token buckets sharing one lock. A request is only let through
+    once every bucket has a token available, so a burst can never exceed the
+    tightest quota.
+    '''
+
+    def __init__(self, limits, clock=time.monotonic, sleep=time.sleep):
+        # limits: list of (requests, per_seconds)
+        self.clock = clock
+        self.sleep = sleep
+        self.lock = threading.Lock()
+        now = self.clock()
+        self.buckets = [[float(requests), requests / per_seconds, float(requests), now]
+                        for (requests, per_seconds) in limits]
+
+    def __refill(self, now):
+        for bucket in self.buckets:
+            tokens, rate, capacity, updated = bucket
+            bucket[0] = min(capacity, tokens + (now - updated) * rate)
+            bucket[3] = now
+
+    def try_acquire(self):
+        # Takes a token from every bucket and returns 0, or returns how many
+        # seconds to wait before trying again
+        with self.lock:
+            self.__refill(self.clock())
+            if all(tokens >= 1 for (tokens, _, _, _) in self.buckets):
+                for bucket in self.buckets:
+                    bucket[0] -= 1
+                return 0
+            return max((1 - tokens) / rate for (tokens, rate, _, _) in self.buckets if tokens < 1)
+
+    def acquire(self):
+        wait = self.try_acquire()
+        while wait > 0:
+            self.sleep(wait)
+            wait = self.try_acquire()
+
+    async def acquire_async(self):
+        # Same buckets as acquire(), so sync and async clients share the quota
+        wait = self.try_acquire()
+        while wait > 0:
+            await asyncio.sleep(wait)
+            wait = self.try_acquire()
+
+
+# Battle.net API quotas are shared by every client using the same credentials,
+# sync or async
+# https://develop.battle.net/documentation/guides/getting-started
+rate_limiter = RateLimiter([(100, 1), (36000, 3600)])
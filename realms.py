@@ -1,5 +1,6 @@
 '''
-WoW Realms with their name and connected-realm ids
+WoW Realms with their name and connected-realm ids, seeding the store's
+realm directory until it is first refreshed from battle.net
 '''
 realms = [
     ('Kilrogg', 4),
@@ -0,0 +1,97 @@
+HOUR = 3600
+
+
+def lttb(points, threshold):
+    # Largest-Triangle-Three-Buckets: keeps the first and last point and, from
+    # every bucket in between, the point spanning the largest triangle with
+    # the point kept before it and the average of the next bucket. Spikes and
+    # dips survive, which plain striding or averaging would flatten.
+    if threshold >= len(points) or threshold < 3:
+        return list(points)
+    sampled = [points[0]]
+    every = (len(points) - 2) / (threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, len(points))
+        next_bucket = points[end:next_end] or points[-1:]
+        avg_x = sum(p[0] for p in next_bucket) / len(next_bucket)
+        avg_y = sum(p[1] for p in next_bucket) / len(next_bucket)
+        (ax, ay) = points[a]
+        best = start
+        best_area = -1
+        for j in range(start, end):
+            (x, y) = points[j]
+            area = abs((ax - avg_x) * (y - ay) - (ax - x) * (avg_y - ay))
+            if area > best_area:
+                best = j
+                best_area = area
+        sampled.append(points[best])
+        a = best
+    sampled.append(points[-1])
+    return sampled
+
+
+class SeriesWindow:
+    '''
+    The stretch of one item's price history loaded into a plot. A start or end
+    of None means the window runs to the oldest or newest data, so new syncs
+    can be appended to it. request() tells which window to load for what is
+    on screen, with a visible span of slack either side so panning does not
+    need a reload straight away.
+    '''
+
+    def __init__(self, name, realm, max_points=1000):
+        self.name = name
+        self.realm = realm
+        self.max_points = max_points
+        self.start = None
+        self.end = None
+        self.points = []
+
+    def load(self, start, end, points):
+        self.start = start
+        self.end = end
+        self.points = list(points)
+
+    def append(self, points):
+        # Only an open ended window follows new syncs
+        if self.end is not None:
+            return False
+        last = self.points[-1][0] if len(self.points) > 0 else None
+        points = [p for p in points if last is None or p[0] > last]
+        self.points.extend(points)
+        return len(points) > 0
+
+    def last(self):
+        return self.points[-1][0] if len(self.points) > 0 else None
+
+    def detailed(self):
+        # Roughly one point per snapshot, there is nothing finer to load
+        if len(self.points) < 2:
+            return True
+        return (self.points[-1][0] - self.points[0][0]) / (len(self.points) - 1) <= 2 * HOUR
+
+    def covers(self, start, end):
+        return (self.start is None or self.start <= start) and (self.end is None or end <= self.end)
+
+    def request(self, start, end):
+        # (start, end) to load for the visible range, or None if the loaded
+        # points already cover it at the detail the plot can show. Loads span
+        # three times the visible range, so only zooming in well past that
+        # asks for finer points again.
+        span = end - start
+        if span <= 0:
+            return None
+        if self.covers(start, end):
+            if self.detailed():
+                return None
+            loaded_start = self.start if self.start is not None else self.points[0][0]
+            loaded_end = self.end if self.end is not None else self.last()
+            if span * 4 > loaded_end - loaded_start:
+                return None
+        last = self.last()
+        # Keep following new syncs when the newest point is in view
+        open_end = last is None or end + span >= last
+        return (int(start - span), None if open_end else int(end + span))
@@ -0,0 +1,176 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from costing import RecipeGraph, shopping_list
+from metrics import metrics
+
+
+class PriceService:
+    '''
+    Resident state behind the JSON API: one store connection plus the recipe
+    graph and prices of each realm's latest snapshot, rebuilt only when a
+    newer snapshot has been recorded.
+    '''
+
+    def __init__(self, db, lock=None):
+        self.db = db
+        # The sqlite connection is shared by the request threads and the sync scheduler
+        self.lock = lock if lock is not None else threading.RLock()
+        self.__graphs = {}
+        self.__names = None
+
+    def invalidate(self):
+        with self.lock:
+            self.__graphs = {}
+            self.__names = None
+
+    def graph(self, realm):
+        # Checking the latest download is one indexed query, so snapshots
+        # recorded by other processes are picked up as well.
+        with self.lock:
+            last_download = self.db.get_last_download(realm)
+            cached = self.__graphs.get(realm)
+            if cached is None or cached[0] != last_download:
+                cached = (last_download, RecipeGraph.load(self.db, realm))
+                self.__graphs[realm] = cached
+            return cached[1]
+
+    def names(self):
+        with self.lock:
+            if self.__names is None:
+                self.__names = {name: item_id for (item_id, name, _) in self.db.get_all_reagents()}
+            return self.__names
+
+    def cost(self, recipe_name, realm=None, quantity=1):
+        with self.lock:
+            graph = self.graph(realm)
+            recipe = graph.cost(recipe_name)
+            if recipe is None:
+                return None
+            selection = recipe.selection()
+            ladders = self.db.get_ladders([i.id for (i, q) in selection], realm)
+        items = shopping_list(selection, ladders, quantity)
+        return {
+            'recipe': recipe.name,
+            'realm': realm,
+            'price': recipe.price,
+            'cost': sum(c for (i, q, c, f) in items),
+            'reagents': [{'id': item.id, 'name': item.name, 'quantity': amount, 'cost': cost, 'listed': filled}
+                         for (item, amount, cost, filled) in items]
+        }
+
+    def price(self, item_name, realm=None):
+        item_id = self.names().get(item_name)
+        if item_id is None:
+            return None
+        price = self.graph(realm).prices.get(item_id)
+        with self.lock:
+            stats = self.db.get_price_stats(item_id, realm)
+        # Percentiles and the average of the cheapest units shrug off single
+        # listings posted far under the market
+        (p10, p25, vwap) = stats[1:4] if stats is not None else (None, None, None)
+        return {'item': item_name, 'id': item_id, 'realm': realm, 'price': price, 'p10': p10, 'p25': p25,
+                'vwap': vwap}
+
+    def search(self, query, limit=20, offset=0):
+        with self.lock:
+            return {'query': query, 'offset': offset, 'names': self.db.search_names(query, limit, offset)}
+
+    def history(self, item_name, realm=None, start=None, end=None, max_points=1000):
+        with self.lock:
+            series = self.db.get_price_series(item_name, realm, start, end, max_points)
+        if series is None:
+            return None
+        return {
+            'item': item_name,
+            'realm': realm,
+            'series': [dict(zip(['time', 'open', 'high', 'low', 'close', 'volume'], point)) for point in series]
+        }
+
+
+class SyncScheduler(threading.Thread):
+    '''
+    Runs `sync` straight away and then every `interval` seconds until stopped.
+    '''
+
+    def __init__(self, sync, interval=3600):
+        super().__init__(daemon=True)
+        self.sync = sync
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            started = time.monotonic()
+            try:
+                self.sync()
+            except Exception as e:
+                print(f'scheduled sync failed: {e}')
+            self.stopped.wait(max(self.interval - (time.monotonic() - started), 0))
+
+    def stop(self):
+        self.stopped.set()
+
+
+class ApiHandler(BaseHTTPRequestHandler):
+    # GET /cost?recipe=NAME&realm=ID&quantity=N
+    # GET /price?item=NAME&realm=ID
+    # GET /history?item=NAME&realm=ID&start=TS&end=TS&points=N
+    # GET /search?q=TEXT&limit=N&offset=N
+    # GET /metrics (Prometheus text format)
+    service = None
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {k: v[-1] for (k, v) in parse_qs(url.query).items()}
+        if url.path == '/metrics':
+            return self.respond_text(200, metrics.prometheus())
+        metrics.incr('api_requests')
+        started = time.perf_counter()
+        try:
+            realm = int(query['realm']) if 'realm' in query else None
+            if url.path == '/cost':
+                body = self.service.cost(query['recipe'], realm, int(query.get('quantity', 1)))
+            elif url.path == '/price':
+                body = self.service.price(query['item'], realm)
+            elif url.path == '/search':
+                body = self.service.search(query['q'], min(int(query.get('limit', 20)), 100),
+                                           int(query.get('offset', 0)))
+            elif url.path == '/history':
+                body = self.service.history(query['item'], realm,
+                                            int(query['start']) if 'start' in query else None,
+                                            int(query['end']) if 'end' in query else None,
+                                            int(query.get('points', 1000)))
+            else:
+                return self.respond(404, {'error': f'unknown endpoint {url.path}'})
+        except KeyError as e:
+            return self.respond(400, {'error': f'missing parameter {e}'})
+        except ValueError as e:
+            return self.respond(400, {'error': str(e)})
+        metrics.record(f'api.{url.path[1:]}', time.perf_counter() - started)
+        if body is None:
+            return self.respond(404, {'error': 'not found'})
+        self.respond(200, body)
+
+    def respond(self, status, body):
+        self.respond_text(status, json.dumps(body), 'application/json')
+
+    def respond_text(self, status, text, content_type='text/plain; version=0.0.4'):
+        data = text.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        # Dashboards poll many times a minute, keep the console for sync output
+        pass
+
+
+def make_server(service, host='127.0.0.1', port=8080):
+    handler = type('Handler', (ApiHandler,), {'service': service})
+    return ThreadingHTTPServer((host, port), handler)
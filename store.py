@@ -1,18 +1,85 @@
 import sqlite3
+import time
+from contextlib import contextmanager
+
+from ladder import PriceLadder
+from metrics import metrics
+from migrations import SCHEMA_VERSION, upgrade
 from reagent import Reagent
+from realms import realms
+
+HOUR = 60 * 60
+DAY = 24 * HOUR
+WEEK = 7 * DAY
+# Longest chain of crafted intermediates followed when indexing which
+# recipes an item feeds into, which also stops recipe cycles
+MAX_USES_DEPTH = 16
+# Snapshots of a realm are stored as changes against the one before, with a
+# full keyframe every this many snapshots
+KEYFRAME_INTERVAL = 24
+# Downloads up to and including the one bound to the parameter, back to its
+# keyframe
+CHAIN = '''
+    SELECT c.download_id
+    FROM downloads d
+    INNER JOIN downloads c
+        ON c.keyframe = d.keyframe
+        AND c.download_id <= d.download_id
+    WHERE d.download_id = ?'''
+# Auction rows in effect at a download: the newest row of every item in its
+# chain, unless that is a tombstone (no price) for an item no longer listed.
+# SQLite takes the bare columns from the row holding MAX(download_id). This
+# builds the whole snapshot, it is meant for bulk reads.
+SNAPSHOT = f'''
+    SELECT item_key, price, quantity, p10, p25, vwap, MAX(download_id) AS download_id
+    FROM auctions
+    WHERE download_id IN ({CHAIN})
+    GROUP BY item_key
+    HAVING price IS NOT NULL'''
+# The same for a single item (bound before the download): its newest row in
+# the chain, found through auctions_item without building the whole snapshot.
+# The caller drops a tombstone.
+ITEM_ROW = f'''
+    SELECT price, quantity, p10, p25, vwap
+    FROM auctions
+    WHERE item_key = (SELECT item_key FROM reagents WHERE item_id = ?) AND download_id IN ({CHAIN})
+    ORDER BY download_id DESC
+    LIMIT 1'''
+
+
+def slugify(name):
+    # Same shape as battle.net realm slugs, e.g. "Aman'Thul" -> "amanthul"
+    return '-'.join(''.join(c for c in name.lower() if c.isalnum() or c == ' ').split())
+
+
+def format_timestamp(timestamp):
+    # Same layout as the datetimes stored in downloads, so they compare as text
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(timestamp))
 
 
 class Store:
-    def __init__(self, database):
+    def __init__(self, database, check_same_thread=True):
         self.database = database
-        self.conn = sqlite3.connect(self.database)
+        # Pass check_same_thread=False to share the store between threads that
+        # serialize access themselves (see server.PriceService)
+        self.conn = sqlite3.connect(self.database, check_same_thread=check_same_thread)
+        # WAL is persistent, it is set once here so readers on other
+        # connections (see dataservice.DataService) never block on a load
+        self.conn.execute('PRAGMA journal_mode = WAL')
         self.__auctions = AuctionsTable(self)
         self.__downloads = DownloadsTable(self)
         self.__recipes = RecipesTable(self)
         self.__reagents = ReagentsTable(self)
         self.__quantities = QuantitiesTable(self)
+        self.__ladders = LaddersTable(self)
+        self.__rollups = RollupsTable(self, self.__auctions)
         self.__credentials = CredentialsTable(self)
+        self.__tokens = TokensTable(self)
         self.__cache = CacheTable(self)
+        self.__realms = RealmsTable(self)
+        self.__names = NamesTable(self)
+        self.__uses = UsesTable(self)
+        self.__bulk = None
         self.__initialize()
 
     def __enter__(self):
@@ -22,55 +89,295 @@ class Store:
         self.conn.close()
 
     def __initialize(self):
+        upgrade(self.conn)
         self.__auctions.create_if_exists()
         self.__downloads.create_if_exists()
         self.__recipes.create_if_exists()
         self.__reagents.create_if_exists()
         self.__quantities.create_if_exists()
+        self.__ladders.create_if_exists()
+        self.__rollups.create_if_exists()
         self.__credentials.create_if_exists()
+        self.__tokens.create_if_exists()
         self.__cache.create_if_exists()
+        self.__realms.create_if_exists()
+        self.__names.create_if_exists()
+        self.__uses.create_if_exists()
+        self.conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+        if self.__rollups.is_empty():
+            self.rebuild_rollups()
+        if self.__names.is_empty():
+            self.__names.update()
+        if self.__uses.is_empty():
+            self.__uses.update()
+        if self.__realms.is_empty():
+            # The bundled list stands in until the directory is first refreshed
+            self.__realms.seed(realms)
 
-    def add_auctions(self, listings, datetime):
-        self.__auctions.insert(listings)
-        self.__downloads.insert(datetime)
+    @contextmanager
+    def bulk(self):
+        # Run a whole ingest as a single transaction instead of committing
+        # (and syncing to disk) after every table write. Under WAL, NORMAL
+        # skips the fsync on commit but never corrupts the database, a crash
+        # can only lose the last load. Nested calls join the outermost load.
+        if self.__bulk is not None:
+            yield self.__bulk
+            return
+        self.conn.commit()
+        synchronous = self.conn.execute('PRAGMA synchronous').fetchone()[0]
+        self.conn.execute('PRAGMA synchronous = NORMAL')
+        self.__bulk = BulkLoad()
+        try:
+            yield self.__bulk
+            with metrics.span('store.commit'):
+                self.conn.commit()
+            metrics.incr('store_rows_written', self.__bulk.rows)
+        except BaseException:
+            self.conn.rollback()
+            raise
+        finally:
+            self.conn.execute(f'PRAGMA synchronous = {synchronous}')
+            self.__bulk.finish()
+            self.__bulk = None
 
-    def get_last_download(self):
-        cur = self.conn.execute(
-            'SELECT datetime FROM downloads ORDER BY datetime DESC LIMIT 1')
-        datetime = cur.fetchone()
-        return datetime[0] if datetime is not None else None
+    def commit(self, rows=0):
+        if self.__bulk is not None:
+            self.__bulk.rows += max(rows, 0)
+        else:
+            self.conn.commit()
 
-    def get_reagents_price(self, recipe_id):
-        datetime = self.get_last_download()
-        if datetime is None:
-            print('download from auction house first before searching.')
+    def add_auctions(self, listings, datetime, realm=None, last_modified=None):
+        # Only what changed since the realm's previous snapshot is written,
+        # unless this one starts a new keyframe
+        with metrics.span('store.add_auctions'), self.bulk() as load:
+            (download_id, previous) = self.__downloads.insert(datetime, realm, last_modified)
+            state = self.__auctions.insert(listings, download_id, previous)
+            self.__ladders.insert([a for a in listings if a.ladder is not None], download_id, previous)
+            with metrics.span('store.rollups'):
+                self.__rollups.add(download_id, state)
+        return load
+
+    def rebuild_rollups(self):
+        # Backfill rollups for snapshots recorded before they existed
+        with self.bulk():
+            cur = self.conn.execute('''
+                SELECT MAX(download_id)
+                FROM downloads
+                GROUP BY realm, substr(datetime, 1, 10)
+                ORDER BY MIN(datetime)
+                ''')
+            for (download_id,) in cur.fetchall():
+                self.__rollups.update(download_id)
+
+    def prune(self, raw_days=None, daily_days=None):
+        # Drop raw snapshots, then daily rollups, older than their retention.
+        # Weekly rollups are always kept.
+        download = self.__get_download()
+        if download is None:
             return None
+        now = int(self.conn.execute("SELECT strftime('%s', ?)", (download[1],)).fetchone()[0])
+        with metrics.span('store.prune'), self.bulk() as load:
+            if raw_days is not None:
+                cutoff = format_timestamp(now - raw_days * DAY)
+                # The first kept snapshot of a chain whose keyframe is pruned
+                # becomes the keyframe for the rest of the chain
+                cur = self.conn.execute('''
+                    SELECT MIN(d.download_id)
+                    FROM downloads d
+                    INNER JOIN downloads k
+                        ON k.download_id = d.keyframe
+                    WHERE d.datetime >= ? AND k.datetime < ?
+                    GROUP BY d.keyframe
+                    ''', (cutoff, cutoff))
+                for (download_id,) in cur.fetchall():
+                    self.__auctions.make_keyframe(download_id)
+                    self.__ladders.make_keyframe(download_id)
+                    self.__downloads.make_keyframe(download_id)
+                for table in ['auctions', 'ladders']:
+                    cur = self.conn.execute(f'''
+                        DELETE FROM {table}
+                        WHERE download_id IN (SELECT download_id FROM downloads WHERE datetime < ?)
+                        ''', (cutoff,))
+                    self.commit(cur.rowcount)
+                cur = self.conn.execute('DELETE FROM downloads WHERE datetime < ?', (cutoff,))
+                self.commit(cur.rowcount)
+            if daily_days is not None:
+                self.__rollups.prune(DAY, now - daily_days * DAY)
+        return load
+
+    def __get_download(self, realm=None):
+        # Latest (download_id, datetime) for the realm, or for any realm when not given
+        if realm is None:
+            cur = self.conn.execute(
+                'SELECT download_id, datetime FROM downloads ORDER BY datetime DESC LIMIT 1')
+        else:
+            cur = self.conn.execute(
+                'SELECT download_id, datetime FROM downloads WHERE realm = ? ORDER BY datetime DESC LIMIT 1', (realm,))
+        return cur.fetchone()
+
+    def get_last_download(self, realm=None):
+        download = self.__get_download(realm)
+        return download[1] if download is not None else None
+
+    def get_last_modified(self, realm):
         cur = self.conn.execute('''
-        SELECT q.item_id, r.name, r.craftable, q.quantity, a.price
+            SELECT last_modified
+            FROM downloads
+            WHERE realm = ? AND last_modified IS NOT NULL
+            ORDER BY datetime DESC LIMIT 1
+            ''', (realm,))
+        last_modified = cur.fetchone()
+        return last_modified[0] if last_modified is not None else None
+
+    def get_reagents_price(self, recipe_id, realm=None):
+        download = self.__get_download(realm)
+        if download is None:
+            print('download from auction house first before searching.')
+            return None
+        # Each reagent's newest row in the chain through auctions_item
+        cur = self.conn.execute(f'''
+        SELECT r.item_id, r.name, r.craftable, q.quantity, a.price
         FROM quantities q
         INNER JOIN reagents r
-            ON q.item_id = r.item_id
-            AND recipe_id = ?
-        INNER JOIN (
-            SELECT * FROM auctions
-            WHERE datetime = ?
-        ) a ON q.item_id = a.item_id
-        ''', (recipe_id, datetime))
+            ON q.item_key = r.item_key
+        INNER JOIN auctions a
+            ON a.item_key = q.item_key
+            AND a.download_id = (
+                SELECT MAX(download_id)
+                FROM auctions
+                WHERE item_key = q.item_key AND download_id IN ({CHAIN}))
+        WHERE q.recipe_id = ? AND a.price IS NOT NULL
+        ''', (download[0], recipe_id))
         return cur.fetchall()
 
-    def get_price(self, item_id):
-        datetime = self.get_last_download()
-        if datetime is None:
+    def get_price(self, item_id, realm=None):
+        download = self.__get_download(realm)
+        if download is None:
             print('download from auction house first before searching.')
             return None
+        cur = self.conn.execute(f'''
+            SELECT price
+            FROM ({ITEM_ROW})
+            WHERE price IS NOT NULL
+            ''', (item_id, download[0]))
+        return cur.fetchone()
+
+    def get_price_at(self, item_id, realm, timestamp):
+        # Price of an item in the realm's last snapshot at or before a unix
+        # timestamp, read from that download's chain like get_price
         cur = self.conn.execute('''
+            SELECT download_id
+            FROM downloads
+            WHERE realm = ? AND datetime < ?
+            ORDER BY datetime DESC LIMIT 1
+            ''', (realm, format_timestamp(timestamp + 1)))
+        download = cur.fetchone()
+        if download is None:
+            return None
+        cur = self.conn.execute(f'''
             SELECT price
-            FROM auctions
-            WHERE item_id = ? and datetime = ?
-            ''', (item_id, datetime))
+            FROM ({ITEM_ROW})
+            WHERE price IS NOT NULL
+            ''', (item_id, download[0]))
+        price = cur.fetchone()
+        return price[0] if price is not None else None
+
+    def get_price_stats(self, item_id, realm=None):
+        # (price, p10, p25, vwap, quantity) of an item in the latest snapshot
+        download = self.__get_download(realm)
+        if download is None:
+            return None
+        cur = self.conn.execute(f'''
+            SELECT price, p10, p25, vwap, quantity
+            FROM ({ITEM_ROW})
+            WHERE price IS NOT NULL
+            ''', (item_id, download[0]))
         return cur.fetchone()
 
-    def get_price_by_name(self, item_name):
+    def get_snapshot_prices(self, realm=None):
+        # Every item price of the latest snapshot in a single query
+        download = self.__get_download(realm)
+        if download is None:
+            return {}
+        cur = self.conn.execute(f'''
+            SELECT r.item_id, a.price
+            FROM ({SNAPSHOT}) a
+            INNER JOIN reagents r
+                ON a.item_key = r.item_key
+            ''', (download[0],))
+        return dict(cur.fetchall())
+
+    def get_ladders(self, item_ids, realm=None):
+        # Price ladders of the latest snapshot keyed by item id
+        download = self.__get_download(realm)
+        if download is None:
+            return {}
+        return self.__ladders.get(download[0], item_ids)
+
+    def get_realm_listings(self, item_ids, realms=None):
+        # Price, quantity and ladder of each item in the latest snapshot of
+        # every synced realm (or just `realms`), in one query:
+        # {realm: {item_id: (price, quantity, ladder)}}
+        item_ids = list(item_ids)
+        realms = list(realms) if realms is not None else None
+        if len(item_ids) == 0 or (realms is not None and len(realms) == 0):
+            return {}
+        realm_filter = f'AND realm IN ({", ".join("?" * len(realms))})' if realms is not None else ''
+        cur = self.conn.execute(f'''
+            WITH latest AS (
+                -- SQLite takes the bare download_id from the row holding MAX(datetime)
+                SELECT realm, download_id, MAX(datetime)
+                FROM downloads
+                WHERE realm IS NOT NULL {realm_filter}
+                GROUP BY realm
+            ),
+            chain AS (
+                SELECT l.realm, c.download_id
+                FROM latest l
+                INNER JOIN downloads d
+                    ON d.download_id = l.download_id
+                INNER JOIN downloads c
+                    ON c.keyframe = d.keyframe
+                    AND c.download_id <= d.download_id
+            ),
+            wanted AS (
+                SELECT item_key, item_id
+                FROM reagents
+                WHERE item_id IN ({", ".join("?" * len(item_ids))})
+            ),
+            listed AS (
+                SELECT c.realm, a.item_key, a.price, a.quantity, MAX(a.download_id)
+                FROM chain c
+                INNER JOIN auctions a
+                    ON a.download_id = c.download_id
+                WHERE a.item_key IN (SELECT item_key FROM wanted)
+                GROUP BY c.realm, a.item_key
+                HAVING a.price IS NOT NULL
+            ),
+            depth AS (
+                SELECT c.realm, l.item_key, l.prices, l.quantities, MAX(l.download_id)
+                FROM chain c
+                INNER JOIN ladders l
+                    ON l.download_id = c.download_id
+                WHERE l.item_key IN (SELECT item_key FROM wanted)
+                GROUP BY c.realm, l.item_key
+            )
+            SELECT s.realm, w.item_id, s.price, s.quantity, d.prices, d.quantities
+            FROM listed s
+            INNER JOIN wanted w
+                ON w.item_key = s.item_key
+            LEFT JOIN depth d
+                ON d.realm = s.realm
+                AND d.item_key = s.item_key
+            ''', (realms or []) + [str(i) for i in item_ids])
+        listings = {}
+        for (realm, item_id, price, quantity, prices, quantities) in cur.fetchall():
+            # An empty ladder marks one that was dropped from the snapshot
+            ladder = PriceLadder.from_blobs(prices, quantities) if prices else None
+            listings.setdefault(realm, {})[item_id] = (price, quantity, ladder)
+        return listings
+
+    def get_price_by_name(self, item_name, realm=None):
         cur = self.conn.execute('''
             SELECT item_id
             FROM reagents
@@ -79,30 +386,77 @@ class Store:
         item_id = cur.fetchone()
         if item_id is None:
             return None
-        return self.get_price(item_id[0])
+        return self.get_price(item_id[0], realm)
 
-    def get_price_history(self, item_name):
+    def get_price_history(self, item_name, realm=None):
         cur = self.conn.execute('''
-            SELECT item_id
+            SELECT item_key, item_id
             FROM reagents
             WHERE name = ?
             ''', (item_name,))
-        item_id = cur.fetchone()
-        if item_id is None:
+        reagent = cur.fetchone()
+        if reagent is None:
             return None
-        cur = self.conn.execute('''
-            SELECT *
-            FROM auctions
-            WHERE item_id = ?
-            ''', (item_id[0],))
-        return cur.fetchall()
+        (item_key, item_id) = reagent
+        if realm is not None:
+            realms = [realm]
+        else:
+            realms = [r for (r,) in self.conn.execute('SELECT DISTINCT realm FROM downloads').fetchall()]
+        history = []
+        for r in realms:
+            for (download_id, datetime, timestamp, state) in self.__auctions.replay(r, item_key=item_key):
+                listed = state.get(item_key)
+                if listed is not None:
+                    history.append((download_id, item_id, listed[0], listed[1], datetime))
+        return [row[1:] for row in sorted(history)]
+
+    def get_price_series(self, item_name, realm=None, start=None, end=None, max_points=1000):
+        # (timestamp, open, high, low, close, volume) points for an item between
+        # two unix timestamps, read from raw snapshots or from daily or weekly
+        # rollups, whichever is the finest resolution fitting in max_points.
+        cur = self.conn.execute('SELECT item_key FROM reagents WHERE name = ?', (item_name,))
+        item_key = cur.fetchone()
+        if item_key is None:
+            return None
+        if realm is None:
+            download = self.conn.execute(
+                'SELECT realm FROM downloads ORDER BY datetime DESC LIMIT 1').fetchone()
+            realm = download[0] if download is not None else None
+        oldest = self.conn.execute('''
+            SELECT CAST(strftime('%s', MIN(datetime)) AS INTEGER), CAST(strftime('%s', MAX(datetime)) AS INTEGER)
+            FROM downloads
+            WHERE realm IS ?
+            ''', (realm,)).fetchone()
+        end = end if end is not None else (oldest[1] if oldest[1] is not None else int(time.time()))
+        if start is None:
+            start = self.conn.execute('''
+                SELECT MIN(period) FROM rollups WHERE item_key = ? AND resolution = ? AND realm = ?
+                ''', (item_key[0], WEEK, realm or 0)).fetchone()[0]
+            start = start if start is not None else end
+        span = max(end - start, 0)
+        if oldest[0] is not None and oldest[0] <= start and span / HOUR <= max_points:
+            points = []
+            for (download_id, datetime, timestamp, state) in self.__auctions.replay(
+                    realm, format_timestamp(start), format_timestamp(end + 1), item_key[0]):
+                listed = state.get(item_key[0])
+                if listed is not None:
+                    points.append((timestamp, listed[0], listed[0], listed[0], listed[0], listed[1]))
+            return points
+        resolution = DAY if span / DAY <= max_points else WEEK
+        return self.__rollups.get(item_key[0], resolution, realm, start - resolution, end)
 
     def add_recipes(self, recipes):
-        self.__recipes.insert(recipes)
-        for recipe in recipes:
-            self.__reagents.upsert(recipe.item_id, recipe.item_name, 1)
-            self.__reagents.insert_list(recipe.reagents)
-            self.__quantities.insert(recipe.id, recipe.reagents)
+        with metrics.span('store.add_recipes'), self.bulk() as load:
+            self.__recipes.insert(recipes)
+            added = 0
+            for recipe in recipes:
+                self.__reagents.upsert(recipe.item_id, recipe.item_name, 1)
+                self.__reagents.insert_list(recipe.reagents)
+                added += self.__quantities.insert(recipe.id, recipe.reagents)
+            self.__names.update()
+            if added > 0:
+                self.__uses.update()
+        return load
 
     def get_recipe(self, id):
         recipe = None
@@ -125,17 +479,52 @@ class Store:
             recipe = cur.fetchone()
         return recipe
 
+    def get_all_recipes(self):
+        cur = self.conn.execute('''
+            SELECT r.*, i.name
+            FROM recipes r
+            INNER JOIN reagents i
+                ON r.item_id = i.item_id
+            ORDER BY r.recipe_id
+            ''')
+        return cur.fetchall()
+
+    def get_all_quantities(self):
+        cur = self.conn.execute('''
+            SELECT q.recipe_id, r.item_id, r.name, r.craftable, q.quantity
+            FROM quantities q
+            INNER JOIN reagents r
+                ON q.item_key = r.item_key
+            ORDER BY q.recipe_id, r.item_key
+            ''')
+        return cur.fetchall()
+
     def get_recipe_count(self, profession, skill_tier):
         cur = self.conn.execute(
             'SELECT COUNT(*) FROM recipes WHERE profession = ? AND skilltier = ?', (profession, skill_tier))
         return cur.fetchone()[0]
 
+    def get_item_uses(self, item_name, max_depth=None):
+        # {recipe_id: depth} of every recipe the item feeds into, depth 1
+        # being a direct reagent and every crafted intermediate in between
+        # adding one. None for unknown items.
+        cur = self.conn.execute('SELECT item_key FROM reagents WHERE name = ?', (item_name,))
+        item_key = cur.fetchone()
+        if item_key is None:
+            return None
+        return self.__uses.get(item_key[0], max_depth)
+
+    def search_names(self, query, limit=20, offset=0):
+        # Item and recipe names containing `query`, prefix matches first, or
+        # the closest names by shared trigrams when nothing contains it
+        return self.__names.search(query, limit, offset)
+
     def get_all_reagent_ids(self):
-        cur = self.conn.execute('SELECT item_id FROM reagents')
+        cur = self.conn.execute('SELECT item_id FROM reagents ORDER BY item_key')
         return [i[0] for i in cur.fetchall()]
 
     def get_all_reagents(self):
-        cur = self.conn.execute('SELECT * FROM reagents')
+        cur = self.conn.execute('SELECT item_id, name, craftable FROM reagents ORDER BY item_key')
         return cur.fetchall()
 
     def get_credentials(self):
@@ -149,6 +538,15 @@ class Store:
 
     def clear_credentials(self):
         self.__credentials.clear()
+        self.__tokens.clear()
+
+    def get_token(self, client_id, expiry_margin=300):
+        # Tokens are handed out until shortly before they expire so that a
+        # request started with one never races its expiry.
+        return self.__tokens.get(client_id, time.time() + expiry_margin)
+
+    def add_or_replace_token(self, client_id, token):
+        self.__tokens.upsert(client_id, token)
 
     def get_cache(self):
         return self.__cache.get()
@@ -156,6 +554,55 @@ class Store:
     def update_cache(self, realm_name):
         self.__cache.update(realm_name)
 
+    def get_realms(self):
+        # (name, connected_realm) for every realm, ordered by name
+        return self.__realms.get_all()
+
+    def find_realm(self, name):
+        # Connected-realm id of a realm given by name, slug, realm id or connected-realm id
+        return self.__realms.find(name)
+
+    def get_connected_realm_ids(self):
+        cur = self.conn.execute('SELECT DISTINCT connected_realm FROM realms ORDER BY connected_realm')
+        return [r[0] for r in cur.fetchall()]
+
+    def get_stale_connected_realms(self, updated_before):
+        cur = self.conn.execute('''
+            SELECT connected_realm
+            FROM realms
+            GROUP BY connected_realm
+            HAVING MIN(updated) < ?
+            ''', (updated_before,))
+        return [r[0] for r in cur.fetchall()]
+
+    def update_realms(self, connected_realms, removed=[], updated=None):
+        # connected_realms: {connected_realm: [(realm_id, name, slug)]}
+        updated = updated if updated is not None else int(time.time())
+        with self.bulk() as load:
+            for connected_realm in removed:
+                self.__realms.delete(connected_realm)
+            for (connected_realm, members) in connected_realms.items():
+                self.__realms.replace(connected_realm, members, updated)
+        return load
+
+
+class BulkLoad:
+    def __init__(self):
+        self.rows = 0
+        self.started = time.perf_counter()
+        self.elapsed = None
+
+    def finish(self):
+        self.elapsed = time.perf_counter() - self.started
+
+    @property
+    def rows_per_second(self):
+        elapsed = self.elapsed if self.elapsed is not None else time.perf_counter() - self.started
+        return self.rows / elapsed if elapsed > 0 else 0
+
+    def __str__(self):
+        return f'{self.rows} rows in {self.elapsed:.2f}s ({self.rows_per_second:.0f} rows/s)'
+
 
 class Table:
     def __init__(self, store):
@@ -166,24 +613,121 @@ class Table:
 
 
 class AuctionsTable(Table):
+    '''
+    Tracked item prices per snapshot, delta encoded. A keyframe snapshot has
+    a row for every listed item, the snapshots after it in its chain only
+    for items whose row changed, plus a tombstone (no price) for items no
+    longer listed. See SNAPSHOT and replay() for reading them back.
+    '''
+
     def create_if_exists(self):
         self.store.conn.execute('''
         CREATE TABLE IF NOT EXISTS auctions
         (
-            item_id TEXT NOT NULL,
-            price INTEGER NOT NULL,
+            download_id INTEGER NOT NULL,
+            item_key INTEGER NOT NULL,
+            price INTEGER,
             quantity INTEGER NOT NULL,
-            datetime TEXT NOT NULL
-        )
+            p10 INTEGER,
+            p25 INTEGER,
+            vwap INTEGER,
+            PRIMARY KEY (download_id, item_key)
+        ) WITHOUT ROWID
         ''')
+        self.store.conn.execute(
+            'CREATE INDEX IF NOT EXISTS auctions_item ON auctions (item_key, download_id)')
         self.store.conn.commit()
 
-    def insert(self, auctions):
-        auctions_insert = [(a.id, a.price, a.quantity, a.datetime)
-                           for a in auctions]
-        self.store.conn.executemany(
-            'INSERT INTO auctions VALUES (?, ?, ?, ?)', auctions_insert)
-        self.store.conn.commit()
+    def snapshot(self, download_id):
+        # {item_key: (price, quantity, p10, p25, vwap)} listed at a download
+        cur = self.store.conn.execute(f'''
+            SELECT item_key, price, quantity, p10, p25, vwap
+            FROM ({SNAPSHOT})
+            ''', (download_id,))
+        return {row[0]: row[1:] for row in cur.fetchall()}
+
+    def insert(self, auctions, download_id, previous=None):
+        # Listings for items that are not known reagents are dropped.
+        # `previous` is the download this one is a delta against, None for
+        # a keyframe. Returns the whole snapshot, as from snapshot().
+        keys = dict(self.store.conn.execute('SELECT item_id, item_key FROM reagents').fetchall())
+        state = {keys[a.id]: (a.price, a.quantity, a.p10, a.p25, a.vwap) for a in auctions if a.id in keys}
+        rows = state
+        if previous is not None:
+            before = self.snapshot(previous)
+            rows = {key: row for (key, row) in state.items() if before.get(key) != row}
+            rows.update((key, (None, 0, None, None, None)) for key in before.keys() - state.keys())
+        cur = self.store.conn.executemany('''
+            INSERT OR REPLACE INTO auctions (download_id, item_key, price, quantity, p10, p25, vwap)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', [(download_id, key, *row) for (key, row) in rows.items()])
+        self.store.commit(cur.rowcount)
+        return state
+
+    def make_keyframe(self, download_id):
+        # Write out the whole snapshot so it no longer needs its chain
+        rows = self.snapshot(download_id)
+        self.store.conn.execute('DELETE FROM auctions WHERE download_id = ?', (download_id,))
+        cur = self.store.conn.executemany('''
+            INSERT INTO auctions (download_id, item_key, price, quantity, p10, p25, vwap)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', [(download_id, key, *row) for (key, row) in rows.items()])
+        self.store.commit(cur.rowcount)
+
+    def replay(self, realm, start=None, end=None, item_key=None):
+        # Yields (download_id, datetime, timestamp, state) for every snapshot
+        # of the realm from start up to (not including) end, as datetime
+        # strings, where state is {item_key: (price, quantity, p10, p25, vwap)}.
+        # Rows are read once from the keyframe before start onwards and the
+        # state dict is updated in place between snapshots.
+        start = start if start is not None else ''
+        end = end if end is not None else '9999'
+        cur = self.store.conn.execute('''
+            SELECT keyframe
+            FROM downloads
+            WHERE realm IS ? AND datetime >= ? AND datetime < ?
+            ORDER BY datetime LIMIT 1
+            ''', (realm, start, end))
+        first = cur.fetchone()
+        if first is None:
+            return
+        cur = self.store.conn.execute('''
+            SELECT download_id, keyframe, datetime, CAST(strftime('%s', datetime) AS INTEGER)
+            FROM downloads
+            WHERE realm IS ? AND download_id >= ? AND datetime < ?
+            ORDER BY download_id
+            ''', (realm, first[0], end))
+        downloads = cur.fetchall()
+        if item_key is None:
+            cur = self.store.conn.execute('''
+                SELECT a.download_id, a.item_key, a.price, a.quantity, a.p10, a.p25, a.vwap
+                FROM downloads d
+                INNER JOIN auctions a
+                    ON a.download_id = d.download_id
+                WHERE d.realm IS ? AND d.download_id >= ? AND d.datetime < ?
+                ''', (realm, first[0], end))
+        else:
+            # A range seek on auctions_item, rows of other realms' downloads
+            # in the range are never looked up below
+            cur = self.store.conn.execute('''
+                SELECT download_id, item_key, price, quantity, p10, p25, vwap
+                FROM auctions
+                WHERE item_key = ? AND download_id BETWEEN ? AND ?
+                ''', (item_key, first[0], downloads[-1][0]))
+        changes = {}
+        for (download_id, key, *row) in cur.fetchall():
+            changes.setdefault(download_id, []).append((key, tuple(row)))
+        state = {}
+        for (download_id, keyframe, datetime, timestamp) in downloads:
+            if download_id == keyframe:
+                state.clear()
+            for (key, row) in changes.get(download_id, []):
+                if row[0] is None:
+                    state.pop(key, None)
+                else:
+                    state[key] = row
+            if datetime >= start:
+                yield (download_id, datetime, timestamp, state)
 
 
 class DownloadsTable(Table):
@@ -191,16 +735,55 @@ class DownloadsTable(Table):
         self.store.conn.execute('''
         CREATE TABLE IF NOT EXISTS downloads
         (
-            datetime TEXT NOT NULL
+            download_id INTEGER NOT NULL PRIMARY KEY,
+            realm INTEGER,
+            datetime TEXT NOT NULL,
+            last_modified TEXT,
+            keyframe INTEGER
         )
         ''')
-        self.store.conn.commit()
-
-    def insert(self, datetime):
         self.store.conn.execute(
-            'INSERT INTO downloads VALUES (?)', (datetime,))
+            'CREATE INDEX IF NOT EXISTS downloads_realm ON downloads (realm, datetime)')
+        self.store.conn.execute(
+            'CREATE INDEX IF NOT EXISTS downloads_datetime ON downloads (datetime)')
+        self.store.conn.execute(
+            'CREATE INDEX IF NOT EXISTS downloads_keyframe ON downloads (keyframe, download_id)')
         self.store.conn.commit()
 
+    def insert(self, datetime, realm=None, last_modified=None):
+        # Returns the new download id and the previous download of the realm
+        # it is a delta against, or None when it starts a new keyframe
+        cur = self.store.conn.execute('''
+            SELECT d.download_id, d.keyframe, (SELECT COUNT(*) FROM downloads WHERE keyframe = d.keyframe)
+            FROM downloads d
+            WHERE d.realm IS ?
+            ORDER BY d.download_id DESC LIMIT 1
+            ''', (realm,))
+        previous = cur.fetchone()
+        if previous is not None and previous[2] >= KEYFRAME_INTERVAL:
+            previous = None
+        cur = self.store.conn.execute(
+            'INSERT INTO downloads (realm, datetime, last_modified, keyframe) VALUES (?, ?, ?, ?)',
+            (realm, datetime, last_modified, previous[1] if previous is not None else None))
+        download_id = cur.lastrowid
+        self.store.commit(cur.rowcount)
+        if previous is None:
+            self.store.conn.execute('UPDATE downloads SET keyframe = ? WHERE download_id = ?', (download_id, download_id))
+            return (download_id, None)
+        return (download_id, previous[0])
+
+    def make_keyframe(self, download_id):
+        # Moves the download and the rest of its chain after it onto a chain
+        # of their own
+        keyframe = self.store.conn.execute(
+            'SELECT keyframe FROM downloads WHERE download_id = ?', (download_id,)).fetchone()[0]
+        cur = self.store.conn.execute('''
+            UPDATE downloads
+            SET keyframe = ?
+            WHERE download_id = ? OR (keyframe = ? AND download_id > ?)
+            ''', (download_id, download_id, keyframe, download_id))
+        self.store.commit(cur.rowcount)
+
 
 class RecipesTable(Table):
     def create_if_exists(self):
@@ -215,14 +798,20 @@ class RecipesTable(Table):
             crafted_quantity INTEGER NOT NULL
         )
         ''')
+        self.store.conn.execute(
+            'CREATE INDEX IF NOT EXISTS recipes_item ON recipes (item_id)')
+        self.store.conn.execute(
+            'CREATE INDEX IF NOT EXISTS recipes_name ON recipes (name)')
+        self.store.conn.execute(
+            'CREATE INDEX IF NOT EXISTS recipes_profession ON recipes (profession, skilltier)')
         self.store.conn.commit()
 
     def insert(self, recipes):
         recipes_insert = [(r.id, r.profession, r.skill_tier, r.name,
                            r.item_id, r.crafted_quantity) for r in recipes]
-        self.store.conn.executemany(
+        cur = self.store.conn.executemany(
             'INSERT INTO recipes VALUES (?, ?, ?, ?, ?, ?)', recipes_insert)
-        self.store.conn.commit()
+        self.store.commit(cur.rowcount)
 
 
 class ReagentsTable(Table):
@@ -230,27 +819,30 @@ class ReagentsTable(Table):
         self.store.conn.execute('''
         CREATE TABLE IF NOT EXISTS reagents
         (
-            item_id TEXT NOT NULL PRIMARY KEY,
+            item_key INTEGER NOT NULL PRIMARY KEY,
+            item_id TEXT NOT NULL UNIQUE,
             name TEXT NOT NULL,
             craftable INTEGER NOT NULL
         )
         ''')
+        self.store.conn.execute(
+            'CREATE INDEX IF NOT EXISTS reagents_name ON reagents (name)')
         self.store.conn.commit()
 
     def upsert(self, item_id, name, craftable):
-        self.store.conn.execute('''
-        INSERT INTO reagents
+        cur = self.store.conn.execute('''
+        INSERT INTO reagents (item_id, name, craftable)
         VALUES (?, ?, ?)
         ON CONFLICT (item_id)
         DO UPDATE SET craftable = ?
         ''', (item_id, name, craftable, craftable))
-        self.store.conn.commit()
+        self.store.commit(cur.rowcount)
 
     def insert_list(self, items):
         items_insert = [(i.id, i.name, 0) for i in items]
-        self.store.conn.executemany(
-            'INSERT OR IGNORE INTO reagents VALUES (?, ?, ?)', items_insert)
-        self.store.conn.commit()
+        cur = self.store.conn.executemany(
+            'INSERT OR IGNORE INTO reagents (item_id, name, craftable) VALUES (?, ?, ?)', items_insert)
+        self.store.commit(cur.rowcount)
 
 
 class QuantitiesTable(Table):
@@ -258,24 +850,221 @@ class QuantitiesTable(Table):
         self.store.conn.execute('''
         CREATE TABLE IF NOT EXISTS quantities
         (
-            item_id TEXT NOT NULL,
             recipe_id INTEGER NOT NULL,
-            quantity INTEGER NOT NULL
-        )
+            item_key INTEGER NOT NULL,
+            quantity INTEGER NOT NULL,
+            PRIMARY KEY (recipe_id, item_key)
+        ) WITHOUT ROWID
         ''')
+        # Reverse lookups, from a reagent to the recipes consuming it
+        self.store.conn.execute(
+            'CREATE INDEX IF NOT EXISTS quantities_item ON quantities (item_key, recipe_id)')
         self.store.conn.commit()
 
     def get(self, recipe_id):
-        cur = self.store.conn.execute(
-            'SELECT * FROM quantities WHERE recipe_id = ?', recipe_id)
+        cur = self.store.conn.execute('''
+            SELECT r.item_id, q.recipe_id, q.quantity
+            FROM quantities q
+            INNER JOIN reagents r
+                ON q.item_key = r.item_key
+            WHERE q.recipe_id = ?
+            ''', (recipe_id,))
         return cur.fetchall()
 
     def insert(self, recipe_id, items):
-        quantities_insert = [(i.id, recipe_id, i.quantity) for i in items]
-        self.store.conn.executemany(
-            'INSERT OR IGNORE INTO quantities VALUES (?, ?, ?)', quantities_insert)
+        quantities_insert = [(recipe_id, i.quantity, i.id) for i in items]
+        cur = self.store.conn.executemany('''
+            INSERT OR IGNORE INTO quantities (recipe_id, item_key, quantity)
+            SELECT ?, item_key, ? FROM reagents WHERE item_id = ?
+            ''', quantities_insert)
+        self.store.commit(cur.rowcount)
+        return cur.rowcount
+
+
+class LaddersTable(Table):
+    # Delta encoded like auctions, an empty ladder is the tombstone
+    def create_if_exists(self):
+        self.store.conn.execute('''
+        CREATE TABLE IF NOT EXISTS ladders
+        (
+            download_id INTEGER NOT NULL,
+            item_key INTEGER NOT NULL,
+            prices BLOB NOT NULL,
+            quantities BLOB NOT NULL,
+            PRIMARY KEY (download_id, item_key)
+        ) WITHOUT ROWID
+        ''')
+        self.store.conn.execute(
+            'CREATE INDEX IF NOT EXISTS ladders_item ON ladders (item_key, download_id)')
+        self.store.conn.commit()
+
+    def get(self, download_id, item_ids):
+        ladders = {}
+        for item_id in item_ids:
+            cur = self.store.conn.execute(f'''
+                SELECT l.prices, l.quantities
+                FROM reagents r
+                INNER JOIN ladders l
+                    ON l.item_key = r.item_key
+                WHERE r.item_id = ? AND l.download_id IN ({CHAIN})
+                ORDER BY l.download_id DESC LIMIT 1
+                ''', (item_id, download_id))
+            ladder = cur.fetchone()
+            if ladder is not None and len(ladder[0]) > 0:
+                ladders[item_id] = PriceLadder.from_blobs(*ladder)
+        return ladders
+
+    def snapshot(self, download_id):
+        # {item_key: (prices, quantities)} in effect at a download
+        cur = self.store.conn.execute(f'''
+            SELECT item_key, prices, quantities, MAX(download_id)
+            FROM ladders
+            WHERE download_id IN ({CHAIN})
+            GROUP BY item_key
+            HAVING length(prices) > 0
+            ''', (download_id,))
+        return {key: (prices, quantities) for (key, prices, quantities, _) in cur.fetchall()}
+
+    def insert(self, auctions, download_id, previous=None):
+        keys = dict(self.store.conn.execute('SELECT item_id, item_key FROM reagents').fetchall())
+        rows = {keys[a.id]: a.ladder.to_blobs() for a in auctions if a.id in keys}
+        if previous is not None:
+            before = self.snapshot(previous)
+            changed = {key: row for (key, row) in rows.items() if before.get(key) != row}
+            changed.update((key, (b'', b'')) for key in before.keys() - rows.keys())
+            rows = changed
+        cur = self.store.conn.executemany('''
+            INSERT OR REPLACE INTO ladders (download_id, item_key, prices, quantities)
+            VALUES (?, ?, ?, ?)
+            ''', [(download_id, key, *row) for (key, row) in rows.items()])
+        self.store.commit(cur.rowcount)
+
+    def make_keyframe(self, download_id):
+        rows = self.snapshot(download_id)
+        self.store.conn.execute('DELETE FROM ladders WHERE download_id = ?', (download_id,))
+        cur = self.store.conn.executemany(
+            'INSERT INTO ladders (download_id, item_key, prices, quantities) VALUES (?, ?, ?, ?)',
+            [(download_id, key, *row) for (key, row) in rows.items()])
+        self.store.commit(cur.rowcount)
+
+
+class RollupsTable(Table):
+    # Legacy snapshots without a realm are rolled up under realm 0
+    def __init__(self, store, auctions):
+        super().__init__(store)
+        self.auctions = auctions
+
+    def create_if_exists(self):
+        self.store.conn.execute('''
+        CREATE TABLE IF NOT EXISTS rollups
+        (
+            resolution INTEGER NOT NULL,
+            realm INTEGER NOT NULL,
+            period INTEGER NOT NULL,
+            item_key INTEGER NOT NULL,
+            open INTEGER NOT NULL,
+            high INTEGER NOT NULL,
+            low INTEGER NOT NULL,
+            close INTEGER NOT NULL,
+            volume REAL NOT NULL,
+            samples INTEGER NOT NULL,
+            PRIMARY KEY (resolution, realm, period, item_key)
+        ) WITHOUT ROWID
+        ''')
+        self.store.conn.execute(
+            'CREATE INDEX IF NOT EXISTS rollups_item ON rollups (item_key, resolution, realm, period)')
         self.store.conn.commit()
 
+    def is_empty(self):
+        return self.store.conn.execute('SELECT 1 FROM rollups LIMIT 1').fetchone() is None
+
+    def add(self, download_id, state):
+        # Fold a new snapshot, {item_key: (price, quantity, ...)} as from
+        # AuctionsTable.snapshot, into its day and week. A snapshot older
+        # than another one of its week rebuilds both from raw snapshots
+        # instead, so open and close stay in time order.
+        (realm, timestamp) = self.__download(download_id)
+        day = timestamp - timestamp % DAY
+        week = day - ((day // DAY + 3) % 7) * DAY  # weeks start on monday
+        cur = self.store.conn.execute('''
+            SELECT 1
+            FROM downloads
+            WHERE realm IS ? AND datetime > (SELECT datetime FROM downloads WHERE download_id = ?) AND datetime < ?
+            LIMIT 1
+            ''', (realm, download_id, format_timestamp(week + WEEK)))
+        if cur.fetchone() is not None:
+            self.update(download_id)
+            return
+        cur = self.store.conn.executemany('''
+            INSERT INTO rollups VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 1)
+            ON CONFLICT (resolution, realm, period, item_key)
+            DO UPDATE SET high = max(high, excluded.high), low = min(low, excluded.low), close = excluded.close,
+                volume = (volume * samples + excluded.volume) / (samples + 1), samples = samples + 1
+            ''', [(resolution, realm or 0, period, item_key, price, price, price, price, quantity)
+                  for (resolution, period) in [(DAY, day), (WEEK, week)]
+                  for (item_key, (price, quantity, p10, p25, vwap)) in state.items()])
+        self.store.commit(cur.rowcount)
+
+    def update(self, download_id):
+        # Re-aggregate the day and week the snapshot falls in. Days are built
+        # from raw snapshots and weeks from days, so raw data can be pruned.
+        (realm, timestamp) = self.__download(download_id)
+        day = timestamp - timestamp % DAY
+        rows = [(item_key, price, price, price, price, quantity, 1)
+                for (download_id, datetime, timestamp, state) in self.auctions.replay(
+                    realm, format_timestamp(day), format_timestamp(day + DAY))
+                for (item_key, (price, quantity, p10, p25, vwap)) in state.items()]
+        self.__upsert(DAY, realm, day, rows)
+        week = day - ((day // DAY + 3) % 7) * DAY  # weeks start on monday
+        cur = self.store.conn.execute('''
+            SELECT item_key, open, high, low, close, volume, samples
+            FROM rollups
+            WHERE resolution = ? AND realm = ? AND period >= ? AND period < ?
+            ORDER BY period
+            ''', (DAY, realm or 0, week, week + WEEK))
+        self.__upsert(WEEK, realm, week, cur.fetchall())
+
+    def __download(self, download_id):
+        cur = self.store.conn.execute('''
+            SELECT realm, CAST(strftime('%s', datetime) AS INTEGER)
+            FROM downloads
+            WHERE download_id = ?
+            ''', (download_id,))
+        return cur.fetchone()
+
+    def __upsert(self, resolution, realm, period, rows):
+        # rows: (item_key, open, high, low, close, volume, samples) in time order
+        buckets = {}
+        for (item_key, open, high, low, close, volume, samples) in rows:
+            bucket = buckets.get(item_key)
+            if bucket is None:
+                buckets[item_key] = [open, high, low, close, volume * samples, samples]
+            else:
+                bucket[1] = max(bucket[1], high)
+                bucket[2] = min(bucket[2], low)
+                bucket[3] = close
+                bucket[4] += volume * samples
+                bucket[5] += samples
+        rollups_insert = [(resolution, realm or 0, period, item_key, open, high, low, close, volume / samples, samples)
+                          for (item_key, (open, high, low, close, volume, samples)) in buckets.items()]
+        cur = self.store.conn.executemany(
+            'INSERT OR REPLACE INTO rollups VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rollups_insert)
+        self.store.commit(cur.rowcount)
+
+    def get(self, item_key, resolution, realm, start, end):
+        cur = self.store.conn.execute('''
+            SELECT period, open, high, low, close, volume
+            FROM rollups
+            WHERE item_key = ? AND resolution = ? AND realm = ? AND period >= ? AND period <= ?
+            ORDER BY period
+            ''', (item_key, resolution, realm or 0, start, end))
+        return cur.fetchall()
+
+    def prune(self, resolution, before):
+        cur = self.store.conn.execute(
+            'DELETE FROM rollups WHERE resolution = ? AND period < ?', (resolution, before))
+        self.store.commit(cur.rowcount)
+
 
 class CredentialsTable(Table):
     def create_if_exists(self):
@@ -303,6 +1092,186 @@ class CredentialsTable(Table):
         self.store.conn.commit()
 
 
+class TokensTable(Table):
+    def create_if_exists(self):
+        self.store.conn.execute('''
+        CREATE TABLE IF NOT EXISTS tokens
+        (
+            client_id TEXT NOT NULL PRIMARY KEY,
+            access_token TEXT NOT NULL,
+            token_type TEXT NOT NULL,
+            expires_at INTEGER NOT NULL
+        )
+        ''')
+        self.store.conn.commit()
+
+    def get(self, client_id, valid_after):
+        cur = self.store.conn.execute('''
+            SELECT access_token, token_type, expires_at
+            FROM tokens
+            WHERE client_id = ? AND expires_at > ?
+            ''', (client_id, valid_after))
+        token = cur.fetchone()
+        if token is None:
+            return None
+        (access_token, token_type, expires_at) = token
+        return {'access_token': access_token, 'token_type': token_type, 'expires_at': expires_at}
+
+    def upsert(self, client_id, token):
+        self.store.conn.execute('''
+        INSERT INTO tokens
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT (client_id)
+        DO UPDATE SET access_token = excluded.access_token, token_type = excluded.token_type,
+            expires_at = excluded.expires_at
+        ''', (client_id, token['access_token'], token['token_type'], int(token['expires_at'])))
+        self.store.conn.commit()
+
+    def clear(self):
+        self.store.conn.execute('DELETE FROM tokens')
+        self.store.conn.commit()
+
+
+class RealmsTable(Table):
+    def create_if_exists(self):
+        self.store.conn.execute('''
+        CREATE TABLE IF NOT EXISTS realms
+        (
+            slug TEXT NOT NULL PRIMARY KEY,
+            name TEXT NOT NULL,
+            realm_id INTEGER,
+            connected_realm INTEGER NOT NULL,
+            updated INTEGER NOT NULL
+        ) WITHOUT ROWID
+        ''')
+        self.store.conn.execute(
+            'CREATE INDEX IF NOT EXISTS realms_name ON realms (name COLLATE NOCASE)')
+        self.store.conn.execute(
+            'CREATE INDEX IF NOT EXISTS realms_id ON realms (realm_id)')
+        self.store.conn.execute(
+            'CREATE INDEX IF NOT EXISTS realms_connected ON realms (connected_realm)')
+        self.store.conn.commit()
+
+    def is_empty(self):
+        return self.store.conn.execute('SELECT 1 FROM realms LIMIT 1').fetchone() is None
+
+    def seed(self, realms):
+        # Seeded rows have no realm id and count as stale for the first refresh
+        cur = self.store.conn.executemany(
+            'INSERT OR IGNORE INTO realms VALUES (?, ?, NULL, ?, 0)',
+            [(slugify(name), name, connected_realm) for (name, connected_realm) in realms])
+        self.store.commit(cur.rowcount)
+
+    def get_all(self):
+        cur = self.store.conn.execute(
+            'SELECT name, connected_realm FROM realms ORDER BY name COLLATE NOCASE')
+        return cur.fetchall()
+
+    def find(self, name):
+        name = str(name).strip()
+        if name.isdigit():
+            cur = self.store.conn.execute('''
+                SELECT connected_realm FROM realms WHERE connected_realm = ?
+                UNION ALL
+                SELECT connected_realm FROM realms WHERE realm_id = ?
+                LIMIT 1
+                ''', (int(name), int(name)))
+        else:
+            cur = self.store.conn.execute('''
+                SELECT connected_realm FROM realms WHERE slug = ?
+                UNION ALL
+                SELECT connected_realm FROM realms WHERE name = ? COLLATE NOCASE
+                LIMIT 1
+                ''', (slugify(name), name))
+        realm = cur.fetchone()
+        return realm[0] if realm is not None else None
+
+    def delete(self, connected_realm):
+        cur = self.store.conn.execute('DELETE FROM realms WHERE connected_realm = ?', (connected_realm,))
+        self.store.commit(cur.rowcount)
+
+    def replace(self, connected_realm, members, updated):
+        # Realms can move between connected realms, so the members replace
+        # both the old membership and any row with the same slug.
+        self.delete(connected_realm)
+        cur = self.store.conn.executemany(
+            'INSERT OR REPLACE INTO realms VALUES (?, ?, ?, ?, ?)',
+            [(slug, name, realm_id, connected_realm, updated) for (realm_id, name, slug) in members])
+        self.store.commit(cur.rowcount)
+
+
+class NamesTable(Table):
+    '''
+    Trigram full text index over every item and recipe name. SQLite builds
+    without FTS5 or the trigram tokenizer (before 3.34) fall back to LIKE
+    scans of a plain table.
+    '''
+
+    def create_if_exists(self):
+        try:
+            self.store.conn.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS names USING fts5(name, tokenize = 'trigram')")
+            self.fts = True
+        except sqlite3.OperationalError:
+            self.store.conn.execute('CREATE TABLE IF NOT EXISTS names (name TEXT NOT NULL PRIMARY KEY)')
+            self.fts = False
+        self.store.conn.commit()
+
+    def is_empty(self):
+        return self.store.conn.execute('SELECT 1 FROM names LIMIT 1').fetchone() is None
+
+    def update(self):
+        # Only names not indexed yet are added
+        cur = self.store.conn.execute('''
+            INSERT INTO names (name)
+            SELECT name FROM reagents
+            UNION
+            SELECT name FROM recipes
+            EXCEPT
+            SELECT name FROM names
+            ''')
+        self.store.commit(cur.rowcount)
+
+    def search(self, query, limit, offset):
+        query = query.strip()
+        if len(query) == 0:
+            return []
+        like = query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        if not self.fts or len(query) < 3:
+            # Trigrams need at least three characters
+            cur = self.store.conn.execute('''
+                SELECT name FROM names
+                WHERE name LIKE ? ESCAPE '\\'
+                ORDER BY name NOT LIKE ? ESCAPE '\\', length(name), name
+                LIMIT ? OFFSET ?
+                ''', (f'%{like}%', f'{like}%', limit, offset))
+            return [r[0] for r in cur.fetchall()]
+        phrase = '"' + query.replace('"', '""') + '"'
+        cur = self.store.conn.execute('''
+            SELECT name FROM names
+            WHERE names MATCH ?
+            ORDER BY name NOT LIKE ? ESCAPE '\\', length(name), name
+            LIMIT ? OFFSET ?
+            ''', (phrase, f'{like}%', limit, offset))
+        names = [r[0] for r in cur.fetchall()]
+        if len(names) > 0 or offset > 0 and self.__count(phrase) > 0:
+            return names
+        # Fuzzy: any of the query's trigrams, ranked by how well they match
+        lowered = query.lower()
+        trigrams = {lowered[i:i + 3] for i in range(len(lowered) - 2)}
+        fuzzy = ' OR '.join('"' + t.replace('"', '""') + '"' for t in sorted(trigrams))
+        cur = self.store.conn.execute('''
+            SELECT name FROM names
+            WHERE names MATCH ?
+            ORDER BY rank, name
+            LIMIT ? OFFSET ?
+            ''', (fuzzy, limit, offset))
+        return [r[0] for r in cur.fetchall()]
+
+    def __count(self, phrase):
+        return self.store.conn.execute('SELECT COUNT(*) FROM names WHERE names MATCH ?', (phrase,)).fetchone()[0]
+
+
 class CacheTable(Table):
     def create_if_exists(self):
         self.store.conn.execute('''
@@ -321,3 +1290,61 @@ class CacheTable(Table):
         self.store.conn.execute('DELETE FROM cache')
         self.store.conn.execute('INSERT INTO cache VALUES (?)', (realm_name,))
         self.store.conn.commit()
+
+
+class UsesTable(Table):
+    '''
+    Transitive closure of the recipe graph read backwards: every recipe an
+    item feeds into, directly or through crafted intermediates, with the
+    shortest number of crafting steps in between.
+    '''
+
+    def create_if_exists(self):
+        self.store.conn.execute('''
+        CREATE TABLE IF NOT EXISTS uses
+        (
+            item_key INTEGER NOT NULL,
+            recipe_id INTEGER NOT NULL,
+            depth INTEGER NOT NULL,
+            PRIMARY KEY (item_key, recipe_id)
+        ) WITHOUT ROWID
+        ''')
+        self.store.conn.commit()
+
+    def is_empty(self):
+        return self.store.conn.execute('SELECT 1 FROM uses LIMIT 1').fetchone() is None
+
+    def update(self):
+        # Rebuilt as a whole in one recursive query, adding recipes can
+        # connect any item upstream of them to anything downstream
+        self.store.conn.execute('DELETE FROM uses')
+        cur = self.store.conn.execute('''
+            WITH RECURSIVE closure (item_key, recipe_id, depth) AS (
+                SELECT item_key, recipe_id, 1
+                FROM quantities
+                UNION
+                -- Whatever feeds a recipe also feeds the recipes using its product
+                SELECT c.item_key, q.recipe_id, c.depth + 1
+                FROM closure c
+                INNER JOIN recipes r
+                    ON r.recipe_id = c.recipe_id
+                INNER JOIN reagents p
+                    ON p.item_id = r.item_id
+                INNER JOIN quantities q
+                    ON q.item_key = p.item_key
+                WHERE c.depth < ?
+            )
+            INSERT INTO uses (item_key, recipe_id, depth)
+            SELECT item_key, recipe_id, MIN(depth)
+            FROM closure
+            GROUP BY item_key, recipe_id
+            ''', (MAX_USES_DEPTH,))
+        self.store.commit(cur.rowcount)
+
+    def get(self, item_key, max_depth=None):
+        cur = self.store.conn.execute('''
+            SELECT recipe_id, depth
+            FROM uses
+            WHERE item_key = ? AND (? IS NULL OR depth <= ?)
+            ''', (item_key, max_depth, max_depth))
+        return dict(cur.fetchall())
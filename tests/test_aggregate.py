@@ -0,0 +1,74 @@
+import unittest
+from datetime import datetime
+
+from aggregate import aggregate_columns, collect, group_listings, parse_item
+from archive import SnapshotColumns
+from eternal import aggregate_auctions, build_listings
+from store import Store
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def listing(item_id, unit_price, quantity, context=None):
+    item = {'id': item_id}
+    if context is not None:
+        item['context'] = context
+    return {'item': item, 'unit_price': unit_price, 'quantity': quantity}
+
+
+auctions = [
+    # One unit posted far under the market
+    listing(2, 10000, 1),
+    listing(2, 500000, 50),
+    listing(2, 510000, 30),
+    listing(2, 900000, 19),
+    listing(3, 20000, 5),
+    listing(3, 25000, 5, context=4),
+    {'item': {'id': 3}, 'buyout': 30000, 'quantity': 2},
+    # Unpriced and untracked listings are skipped
+    {'item': {'id': 3}, 'quantity': 2},
+    listing(99, 10000, 1)
+]
+
+
+class TestAggregate(unittest.TestCase):
+    def test_price_stats(self):
+        items = aggregate_columns(collect(auctions, SnapshotColumns()), {'2', '3', '3-4'})
+        self.assertSetEqual(set(items), {'2', '3', '3-4'})
+        stats = items['2']
+        self.assertEqual(stats['price'], 1)
+        self.assertEqual(stats['quantity'], 100)
+        self.assertDictEqual(stats['levels'], {1: 1, 50: 50, 51: 30, 90: 19})
+        # The single cheap unit moves neither percentile nor average much
+        self.assertEqual(stats['p10'], 50)
+        self.assertEqual(stats['p25'], 50)
+        self.assertEqual(stats['vwap'], (10000 + 19 * 500000) // 20 // 10000)
+        self.assertEqual(items['3']['quantity'], 7)
+        self.assertEqual(items['3']['price'], 2)
+        self.assertEqual(items['3-4']['price'], 2)
+
+    def test_collect_tracked(self):
+        # Untracked items and other contexts of a tracked one are not kept
+        columns = collect(auctions, SnapshotColumns(), {parse_item('2'), parse_item('3-4')})
+        self.assertListEqual(list(columns.item_ids), [2, 2, 2, 2, 3])
+        self.assertListEqual(list(columns.contexts), [0, 0, 0, 0, 4])
+
+    @unittest.skipIf(numpy is None, 'numpy is not installed')
+    def test_numpy_matches_python(self):
+        columns = collect(auctions * 3, SnapshotColumns())
+        ids = {parse_item(id): id for id in ['2', '3', '3-4', '7']}
+        items = aggregate_columns(columns, ids.values())
+        python = {ids[key]: dict(stats, id=ids[key]) for (key, stats) in group_listings(columns, ids)}
+        self.assertDictEqual(items, python)
+
+    def test_record_stats(self):
+        db = Store(':memory:')
+        db.conn.executemany('INSERT INTO reagents (item_id, name, craftable) VALUES (?, ?, 0)',
+                            [('2', 'reagent 1'), ('3', 'reagent 2')])
+        now = datetime.utcnow()
+        db.add_auctions(build_listings(aggregate_auctions(auctions, {'2', '3'}), now), now, 154)
+        self.assertTupleEqual(db.get_price_stats('2', 154), (1, 50, 50, 47, 100))
+        db.conn.close()
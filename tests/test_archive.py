@@ -0,0 +1,72 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from archive import COMPRESSED, SnapshotArchive, SnapshotColumns
+
+
+class TestArchive(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.archive = SnapshotArchive(self.root)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def columns(self, *rows):
+        columns = SnapshotColumns()
+        for row in rows:
+            columns.append(*row)
+        return columns
+
+    def test_write_and_read(self):
+        self.archive.write(154, 1609459200, self.columns((3, 0, 500, 2), (1, 0, 20000, 1), (3, 0, 400, 7)))
+        snapshots = list(self.archive.snapshots(154))
+        self.assertEqual(len(snapshots), 1)
+        with snapshots[0] as snapshot:
+            self.assertEqual(snapshot.timestamp, 1609459200)
+            self.assertEqual(snapshot.flags, 0)
+            # Columns come back sorted by item then price
+            self.assertListEqual(list(snapshot.item_ids), [1, 3, 3])
+            self.assertListEqual(list(snapshot.prices), [20000, 400, 500])
+            rows = snapshot.items(3)
+            self.assertListEqual([snapshot.quantities[i] for i in rows], [7, 2])
+            self.assertEqual(len(snapshot.items(2)), 0)
+
+    def test_time_range(self):
+        for hour in range(4):
+            self.archive.write(154, 1609459200 + hour * 3600 + 60, self.columns((1, 0, hour, 1)))
+        snapshots = list(self.archive.snapshots(154, start=1609459200 + 3600, end=1609459200 + 3 * 3600))
+        self.assertListEqual([s.timestamp for s in snapshots], [1609462860, 1609466460])
+        self.assertListEqual(list(self.archive.snapshots(1)), [])
+
+    def test_compact(self):
+        self.archive.write(154, 1609459200, self.columns((1, 0, 100, 1), (2, 5, 200, 3)))
+        self.archive.write(154, 1609462800, self.columns((1, 0, 110, 1)))
+        self.assertEqual(self.archive.compact(154, before=1609462800), 1)
+        first, second = self.archive.snapshots(154)
+        with first as snapshot:
+            self.assertTrue(snapshot.flags & COMPRESSED)
+            self.assertListEqual(list(snapshot.contexts), [0, 5])
+            self.assertListEqual(list(snapshot.quantities), [1, 3])
+        with second as snapshot:
+            self.assertFalse(snapshot.flags & COMPRESSED)
+        self.assertNotIn('20210101000000.snap.partial', os.listdir(os.path.join(self.root, '154')))
+
+    def test_same_hour(self):
+        # An early snapshot and the regular one of the same hour are both kept
+        self.archive.write(154, 1609459200 + 60, self.columns((1, 0, 100, 1)))
+        self.archive.write(154, 1609459200 + 1800, self.columns((1, 0, 90, 1)))
+        self.assertListEqual([s.timestamp for s in self.archive.snapshots(154)], [1609459260, 1609461000])
+        # Files named to the hour by older versions are still read
+        os.rename(self.archive.path(154, 1609459260), os.path.join(self.root, '154', '2021010100.snap'))
+        self.assertEqual(len(list(self.archive.snapshots(154))), 2)
+
+    def test_not_a_snapshot(self):
+        path = self.archive.path(154, 1609459200)
+        os.makedirs(os.path.dirname(path))
+        with open(path, 'wb') as f:
+            f.write(b'\0' * 64)
+        with self.assertRaises(ValueError):
+            list(self.archive.snapshots(154))
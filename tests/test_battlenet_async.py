@@ -0,0 +1,100 @@
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    from battlenet_async import AsyncBNetClient
+except ImportError:
+    AsyncBNetClient = None
+
+from ratelimit import RateLimiter
+
+realm_index = {'realms': [{'slug': 'proudmoore'}, {'slug': 'kilrogg'}]}
+realm_pages = {
+    'proudmoore': {'name': 'Proudmoore', 'is_tournament': False,
+                   'connected_realm': {'href': 'https://fake/data/wow/connected-realm/5?namespace=dynamic-us'}},
+    'kilrogg': {'name': 'Kilrogg', 'is_tournament': False,
+                'connected_realm': {'href': 'https://fake/data/wow/connected-realm/4?namespace=dynamic-us'}}
+}
+auctions = {'id': 1, 'auctions': [{'item': {'id': 2}, 'unit_price': 10000, 'quantity': 3}]}
+
+
+class FakeBattleNet(BaseHTTPRequestHandler):
+    def do_GET(self):
+        path = self.path.split('?')[0]
+        if path == '/data/wow/realm/index':
+            self.respond(realm_index)
+        elif path.startswith('/data/wow/realm/'):
+            self.respond(realm_pages[path.rsplit('/', 1)[1]])
+        elif path.endswith('/auctions'):
+            if self.headers.get('If-Modified-Since') == 'then':
+                self.send_response(304)
+                self.end_headers()
+            else:
+                self.respond(auctions, {'Last-Modified': 'then'})
+        else:
+            self.send_response(404)
+            self.end_headers()
+
+    def respond(self, body, headers={}):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(200)
+        for (k, v) in headers.items():
+            self.send_header(k, v)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@unittest.skipIf(AsyncBNetClient is None, 'httpx is not installed')
+class TestAsyncBNetClient(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), FakeBattleNet)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url_base = f'http://127.0.0.1:{self.server.server_address[1]}'
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def run_client(self, calls):
+        # Built outside the event loop, with a single slot so the realm
+        # lookups queue up on the semaphore
+        client = AsyncBNetClient('id', 'secret', url_base=self.url_base, limiter=RateLimiter([(100, 1)]),
+                                 token={'access_token': 'token', 'token_type': 'Bearer'}, concurrency=1)
+
+        async def run():
+            async with client:
+                return await calls(client)
+        return asyncio.run(run())
+
+    def test_connected_realms(self):
+        realms = self.run_client(lambda client: client.get_connected_realms())
+        self.assertListEqual(realms, [('Proudmoore', '5'), ('Kilrogg', '4')])
+
+    def test_auction_stream(self):
+        async def calls(client):
+            modified, stream = await client.get_auction_stream(5)
+            unchanged = await client.get_auction_stream(5, modified)
+            return modified, [auction async for auction in stream], unchanged
+        modified, listed, unchanged = self.run_client(calls)
+        self.assertEqual(modified, 'then')
+        self.assertListEqual(listed, auctions['auctions'])
+        self.assertEqual(unchanged, ('then', None))
+
+    def test_no_requests_stack(self):
+        # The shared limiter lives in ratelimit, so the async client never
+        # loads the requests based sync client
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        result = subprocess.run([sys.executable, '-c', 'import sys, battlenet_async; print(sorted(m for m in '
+                                 '["battlenet", "requests", "urllib3"] if m in sys.modules))'],
+                                cwd=root, capture_output=True, text=True, check=True)
+        self.assertEqual(result.stdout.strip(), '[]')
@@ -0,0 +1,145 @@
+import sys
+import unittest
+from datetime import datetime
+from unittest import mock
+
+from auction import Auction
+from costing import RecipeGraph, cheapest_sources, shopping_list
+from item import Item
+from ladder import PriceLadder
+from reagent import Reagent
+from recipe import Recipe
+from store import Store
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+utc_now = datetime.utcnow()
+
+# potion <- 2 stone + 2 herb2, stone <- 2 herb1, elixir <- 1 potion + 3 stone
+stone = Recipe(1, 1, 1, 'stone', '4', 1, 'stone')
+stone.reagents = [Reagent('2', 'herb1', 0, 2, 0)]
+potion = Recipe(2, 1, 1, 'potion', '1', 1, 'potion')
+potion.reagents = [Reagent('4', 'stone', 0, 2, 0), Reagent('3', 'herb2', 0, 2, 0)]
+elixir = Recipe(3, 1, 1, 'elixir', '5', 1, 'elixir')
+elixir.reagents = [Reagent('1', 'potion', 0, 1, 0), Reagent('4', 'stone', 0, 3, 0)]
+
+listings = [
+    Auction('1', 1, 12, utc_now),
+    Auction('2', 1, 1, utc_now),
+    Auction('3', 1, 2, utc_now),
+    Auction('4', 1, 3, utc_now),
+    Auction('5', 1, 50, utc_now)
+]
+
+
+class TestCosting(unittest.TestCase):
+    def setUp(self):
+        self.db = Store(':memory:')
+        self.db.add_recipes([stone, potion, elixir])
+        self.db.add_auctions(listings, utc_now)
+        self.graph = RecipeGraph.load(self.db)
+
+    def test_cost(self):
+        item = self.graph.cost('potion')
+        self.assertEqual(item.name, 'potion')
+        self.assertEqual(item.price, 12)
+        # 2 stone crafted from 2 herb1 each (2g) + 2 herb2 (4g)
+        self.assertEqual(item.cost(), 8)
+        self.assertEqual(self.graph.cost('1').cost(), 8)
+        selection = [(i.name, q) for (i, q) in item.selection()]
+        self.assertListEqual(selection, [('herb2', 2), ('herb1', 4)])
+
+    def test_shared_subtree(self):
+        item = self.graph.cost('elixir')
+        self.assertEqual(item.cost(), 8 + 3 * 2)
+        (potion_item, _), = [(i, q) for (i, q) in item.craft_items if i.name == 'potion']
+        (stone_item, _), = [(i, q) for (i, q) in item.craft_items if i.name == 'stone']
+        (potion_stone, _), = [(i, q) for (i, q) in potion_item.craft_items if i.name == 'stone']
+        self.assertIs(stone_item, potion_stone)
+
+    def test_unknown(self):
+        self.assertIsNone(self.graph.cost('herb1'))
+        self.assertIsNone(self.graph.cost('missing'))
+
+    def test_profitability(self):
+        report = {recipe.name: (cost, sell, margin, complete)
+                  for (recipe, cost, sell, margin, complete) in self.graph.profitability()}
+        self.assertTupleEqual(report['stone'], (2, 3, 1, True))
+        self.assertTupleEqual(report['potion'], (8, 12, 4, True))
+        self.assertTupleEqual(report['elixir'], (14, 50, 36, True))
+
+    def test_crafted_quantity(self):
+        # Two stone per craft halve its unit cost in potion, elixir makes three
+        graph = RecipeGraph([(1, 1, 1, 'stone', '4', 2), (2, 1, 1, 'potion', '1', 1), (3, 1, 1, 'elixir', '5', 3)],
+                            [(1, '2', 'herb1', 0, 2), (2, '4', 'stone', 1, 2), (2, '3', 'herb2', 0, 2),
+                             (3, '1', 'potion', 1, 1), (3, '4', 'stone', 1, 3)],
+                            {'1': 12, '2': 1, '3': 2, '4': 3, '5': 50})
+        report = {recipe.name: (cost, sell, margin) for (recipe, cost, sell, margin, _) in graph.profitability()}
+        self.assertTupleEqual(report['stone'], (2, 6, 4))
+        self.assertTupleEqual(report['potion'], (6, 12, 6))
+        self.assertTupleEqual(report['elixir'], (9, 150, 141))
+        # Costing single items agrees with the report
+        for name in ['stone', 'potion', 'elixir']:
+            self.assertEqual(round(graph.cost(name).craft_cost()), report[name][0])
+        self.assertEqual(graph.cost('stone').cost(), 1)
+        # Five stone (two in the potion, three in the elixir) are two and a
+        # half crafts, priced as their share like the cost
+        shopping = {item.name: (amount, cost) for (item, amount, cost, filled) in
+                    shopping_list(graph.cost('elixir').selection(), {})}
+        self.assertDictEqual(shopping, {'herb1': (5, 5), 'herb2': (2, 4)})
+
+    @unittest.skipIf(numpy is None, 'numpy is not installed')
+    def test_profitability_without_numpy(self):
+        report = self.graph.profitability()
+        with mock.patch.dict(sys.modules, {'numpy': None}):
+            self.assertListEqual(self.graph.profitability(), report)
+
+    def test_uses(self):
+        # herb1 goes into stone, which potion and elixir both use
+        uses = {recipe.name: (margin, depth)
+                for (recipe, cost, sell, margin, complete, depth) in self.graph.uses(self.db.get_item_uses('herb1'))}
+        self.assertDictEqual(uses, {'stone': (1, 1), 'potion': (4, 2), 'elixir': (36, 2)})
+        self.assertListEqual([r[0].name for r in self.graph.uses(self.db.get_item_uses('potion'))], ['elixir'])
+
+    def test_shopping_list(self):
+        ladders = {
+            '2': PriceLadder.from_levels({1: 3, 2: 10}),
+            '3': PriceLadder.from_levels({2: 1})
+        }
+        selection = self.graph.cost('potion').selection()
+        shopping = {item.name: (quantity, cost, filled)
+                    for (item, quantity, cost, filled) in shopping_list(selection, ladders, 2)}
+        # 8 herb1: 3 @ 1g then 5 @ 2g, 4 herb2: only 1 listed, rest at the last level
+        self.assertTupleEqual(shopping['herb1'], (8, 13, 8))
+        self.assertTupleEqual(shopping['herb2'], (4, 8, 1))
+        # Unpriced and without listings, the line is left unfilled
+        [(_, quantity, cost, filled)] = shopping_list([(Item('9', 'unpriced'), 2)], {})
+        self.assertTupleEqual((quantity, cost, filled), (2, 0, 0))
+
+    def test_cheapest_sources(self):
+        # herb1 is cheaper on realm 4 but herb2 is only listed on realm 5
+        self.db.add_auctions([Auction('2', 10, 1, utc_now, PriceLadder.from_levels({1: 10})),
+                              Auction('3', 10, 3, utc_now, PriceLadder.from_levels({3: 10}))], utc_now, 5)
+        self.db.add_auctions([Auction('2', 2, 1, utc_now, PriceLadder.from_levels({1: 2}))], utc_now, 4)
+        selection = self.graph.cost('potion').selection()
+        listings = self.db.get_realm_listings([i.id for (i, q) in selection])
+        self.assertSetEqual(set(listings), {4, 5})
+        (sources, totals) = cheapest_sources(selection, listings)
+        offers = {item.name: offers for (item, amount, offers) in sources}
+        # 4 herb1: realm 4 only lists 2, so the full fill on realm 5 comes first
+        self.assertListEqual(offers['herb1'], [(5, 4, 4), (4, 4, 2)])
+        self.assertListEqual(offers['herb2'], [(5, 6, 2)])
+        self.assertListEqual(totals, [(5, 10, 0), (4, 4, 1)])
+        self.assertDictEqual(self.db.get_realm_listings(['2'], [6]), {})
+
+    def test_ladder_blobs(self):
+        ladder = PriceLadder.from_levels({30: 2, 10: 5, 20: 1})
+        self.assertListEqual(list(ladder.prices), [10, 20, 30])
+        ladder = PriceLadder.from_blobs(*ladder.to_blobs())
+        self.assertListEqual(list(ladder.prices), [10, 20, 30])
+        self.assertListEqual(list(ladder.quantities), [5, 1, 2])
+        self.assertEqual(ladder.available, 8)
+        self.assertTupleEqual(ladder.cost(6), (70, 6))
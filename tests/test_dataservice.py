@@ -0,0 +1,68 @@
+import os
+import tempfile
+import threading
+import unittest
+from calendar import timegm
+from datetime import datetime, timedelta
+
+from auction import Auction
+from dataservice import DataService
+from reagent import Reagent
+from recipe import Recipe
+
+utc_now = datetime.utcnow()
+
+recipe = Recipe(1, 1, 1, 'test recipe', '1', 1, 'item name')
+recipe.reagents = [
+    Reagent('2', 'reagent 1', 0, 2, 2),
+    Reagent('3', 'reagent 2', 0, 3, 3)
+]
+
+
+class TestDataService(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        self.errors = []
+        self.service = DataService(self.path, on_error=self.errors.append)
+        db = self.service.db
+        self.service.call(lambda: db.add_recipes([recipe]))
+        self.service.call(lambda: db.add_auctions([Auction('1', 1, 20, utc_now), Auction('2', 2, 2, utc_now),
+                                                   Auction('3', 3, 3, utc_now)], utc_now, 154))
+
+    def tearDown(self):
+        self.service.close()
+        os.remove(self.path)
+
+    def test_superseded_job(self):
+        release = threading.Event()
+        shown = []
+        self.service.submit('selection', [(release.wait, shown.append), (lambda: 'old', shown.append)])
+        # The second selection arrives while the first is still on its first step
+        self.service.submit('selection', [(lambda: 'new', shown.append)])
+        self.service.submit('other', [(lambda: 1 / 0, shown.append)])
+        release.set()
+        self.service.call(lambda: None)
+        self.service.poll()
+        self.assertListEqual(shown, ['new'])
+        self.assertEqual(len(self.errors), 1)
+        self.assertIsInstance(self.errors[0], ZeroDivisionError)
+
+    def test_snapshot_cache(self):
+        (costed, price) = self.service.call(lambda: (self.service.recipe('test recipe', 154),
+                                                     self.service.price('reagent 1', 154)))
+        self.assertEqual(costed[0].cost(), 2 * 2 + 3 * 3)
+        self.assertEqual(price[0], 2)
+        # Same snapshot, same objects
+        self.assertIs(self.service.call(lambda: self.service.recipe('test recipe', 154)), costed)
+        later = utc_now + timedelta(hours=1)
+        db = self.service.db
+        self.service.call(lambda: db.add_auctions([Auction('1', 1, 20, later), Auction('2', 2, 1, later),
+                                                   Auction('3', 3, 3, later)], later, 154))
+        # A newer snapshot is costed again
+        costed = self.service.call(lambda: self.service.recipe('test recipe', 154))
+        self.assertEqual(costed[0].cost(), 2 * 1 + 3 * 3)
+        self.assertIsNone(self.service.call(lambda: self.service.recipe('reagent 1', 154)))
+        # Only the snapshot after the first one is appended to a plot
+        since = self.service.call(lambda: self.service.history_since('reagent 1', 154, timegm(utc_now.utctimetuple())))
+        self.assertListEqual([close for (timestamp, close) in since], [1])
@@ -0,0 +1,132 @@
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from argparse import Namespace
+from contextlib import redirect_stdout
+from datetime import datetime
+
+from auction import Auction
+from eternal import cost_recipe_args, fetch_recipes, refresh_realm_directory, resolve_realms
+from reagent import Reagent
+from recipe import Recipe
+from store import Store
+
+utc_now = datetime.utcnow()
+
+recipe = Recipe(1, 1, 1, 'test recipe', '1', 1, 'item name')
+recipe.reagents = [
+    Reagent('2', 'reagent 1', 0, 2, 2),
+    Reagent('3', 'reagent 2', 0, 3, 3)
+]
+
+
+class FakeRealmClient:
+    def __init__(self, connected_realms):
+        self.connected_realms = connected_realms
+        self.fetched = []
+
+    def get_connected_realm_index(self):
+        url = 'https://us.api.blizzard.com/data/wow/connected-realm/{}?namespace=dynamic-us'
+        return {'connected_realms': [{'href': url.format(id)} for id in self.connected_realms]}
+
+    def get_connected_realm(self, id):
+        self.fetched.append(id)
+        return {'id': id, 'realms': [{'id': realm_id, 'name': name, 'slug': name.lower(),
+                                      'is_tournament': name.startswith('Tournament')}
+                                     for (realm_id, name) in self.connected_realms[id]]}
+
+
+class FakeRecipeClient:
+    def __init__(self, missing):
+        self.missing = missing
+
+    def get_recipes(self, profession_id, skill_tier):
+        return {'categories': [{'recipes': [{'id': 1}, {'id': 2}]}]}
+
+    def get_recipe(self, recipe_id):
+        from requests import HTTPError, Response
+        if recipe_id in self.missing:
+            response = Response()
+            response.status_code = 404
+            raise HTTPError(response=response)
+        return {'name': f'recipe {recipe_id}', 'crafted_item': {'id': 10 + recipe_id},
+                'crafted_quantity': {'value': 1},
+                'reagents': [{'reagent': {'id': 20, 'name': 'reagent'}, 'quantity': 2}]}
+
+
+class TestEternal(unittest.TestCase):
+    def test_lazy_network_imports(self):
+        # The offline commands must not pay for the battle.net client stack
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        result = subprocess.run([sys.executable, '-c', 'import sys, eternal; print(sorted(m for m in '
+                                 '["battlenet", "authlib", "requests", "server"] if m in sys.modules))'],
+                                cwd=root, capture_output=True, text=True, check=True)
+        self.assertEqual(result.stdout.strip(), '[]')
+
+    def test_cost_offline(self):
+        fd, path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        try:
+            with Store(path) as db:
+                db.add_recipes([recipe])
+                db.add_auctions([Auction('1', 1, 20, utc_now), Auction('2', 2, 2, utc_now),
+                                 Auction('3', 3, 3, utc_now)], utc_now, 154)
+            # No credentials are stored, so this only works without a refresh
+            args = Namespace(store=path, realm=154, offline=True, cost=True, quantity=1,
+                             recipename=['test recipe'])
+            out = io.StringIO()
+            with redirect_stdout(out):
+                cost_recipe_args(args)
+            self.assertEqual(out.getvalue().strip(), str(2 * 2 + 3 * 3))
+        finally:
+            os.remove(path)
+
+    def test_cost_offline_without_snapshot(self):
+        fd, path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        try:
+            with Store(path) as db:
+                db.add_recipes([recipe])
+            args = Namespace(store=path, realm=154, offline=True, cost=True, quantity=1,
+                             recipename=['test recipe'])
+            out = io.StringIO()
+            with redirect_stdout(out):
+                cost_recipe_args(args)
+            self.assertEqual(out.getvalue().strip(), 'download from auction house first before searching.')
+        finally:
+            os.remove(path)
+
+    def test_fetch_recipes_skips_missing(self):
+        db = Store(':memory:')
+        with redirect_stdout(io.StringIO()):
+            fetch_recipes(db, None, None, professions=[(1, 1)], client=FakeRecipeClient({2}), workers=2)
+        self.assertEqual(db.get_recipe_count(1, 1), 1)
+        self.assertEqual(db.get_recipe('recipe 1')[0], 1)
+        db.conn.close()
+
+    def test_refresh_realm_directory(self):
+        db = Store(':memory:')
+        client = FakeRealmClient({4: [(3, 'Kilrogg'), (4, 'Winterhoof')], 9000: [(9001, 'Newrealm')]})
+        # Everything seeded is stale, so the first refresh fetches every connected realm
+        self.assertEqual(refresh_realm_directory(db, client), 2)
+        self.assertListEqual(db.get_connected_realm_ids(), [4, 9000])
+        self.assertListEqual(resolve_realms(db, ['newrealm', 'Kilrogg', '9001']), [9000, 4])
+        # Later refreshes only fetch new connected realms
+        client.connected_realms[9100] = [(9101, 'Fresh')]
+        client.fetched = []
+        self.assertEqual(refresh_realm_directory(db, client), 1)
+        self.assertListEqual(client.fetched, [9100])
+        with self.assertRaises(ValueError):
+            resolve_realms(db, ['Proudmoore'])
+        # Tournament realms are left out of the directory
+        client.connected_realms[9200] = [(9201, 'Tournament 1')]
+        client.connected_realms[9300] = [(9301, 'Open'), (9302, 'Tournament 2')]
+        refresh_realm_directory(db, client)
+        self.assertNotIn(9200, db.get_connected_realm_ids())
+        self.assertListEqual(resolve_realms(db, ['open']), [9300])
+        with self.assertRaises(ValueError):
+            resolve_realms(db, ['Tournament 2'])
+        db.conn.close()
@@ -0,0 +1,55 @@
+import asyncio
+import json
+import unittest
+
+from jsonstream import aiter_array, iter_array
+
+payload = {
+    '_links': {'self': {'href': 'https://us.api.blizzard.com/data/wow/connected-realm/154/auctions'}},
+    'connected_realm': {'href': 'https://us.api.blizzard.com/data/wow/connected-realm/154'},
+    'auctions': [
+        {'id': 1, 'item': {'id': 171315}, 'quantity': 20, 'unit_price': 1250000, 'time_left': 'LONG'},
+        {'id': 2, 'item': {'id': 172230, 'context': 63}, 'quantity': 1, 'buyout': 9990000},
+        {'id': 3, 'item': {'id': 168586}, 'quantity': 200, 'unit_price': 80000, 'note': 'Blüt'}
+    ],
+    'id': 154
+}
+
+
+def chunked(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+async def collect(chunks, key):
+    async def receive():
+        for chunk in chunks:
+            await asyncio.sleep(0)
+            yield chunk
+    return [element async for element in aiter_array(receive(), key)]
+
+
+class TestJSONStream(unittest.TestCase):
+    def test_iter_array(self):
+        data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        for size in [1, 2, 7, 64, len(data)]:
+            auctions = list(iter_array(chunked(data, size), 'auctions'))
+            self.assertListEqual(auctions, payload['auctions'])
+
+    def test_iter_array_empty(self):
+        self.assertListEqual(list(iter_array([b'{"auctions": []}'], 'auctions')), [])
+        self.assertListEqual(list(iter_array([b'{}'], 'auctions')), [])
+        self.assertListEqual(list(iter_array([b'{"id": 12345}'], 'auctions')), [])
+
+    def test_iter_array_truncated(self):
+        data = json.dumps(payload).encode('utf-8')
+        with self.assertRaises(ValueError):
+            list(iter_array(chunked(data[:-20], 16), 'auctions'))
+
+    def test_aiter_array(self):
+        data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        for size in [1, 2, 7, 64, len(data)]:
+            auctions = asyncio.run(collect(chunked(data, size), 'auctions'))
+            self.assertListEqual(auctions, payload['auctions'])
+        self.assertListEqual(asyncio.run(collect([b'{"id": 1', b'2345}'], 'auctions')), [])
+        with self.assertRaises(ValueError):
+            asyncio.run(collect(chunked(data[:-20], 16), 'auctions'))
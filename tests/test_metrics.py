@@ -0,0 +1,55 @@
+import json
+import os
+import tempfile
+import unittest
+
+from metrics import Metrics
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def time(self):
+        return self.now
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.metrics = Metrics(clock=self.clock.time)
+
+    def test_span(self):
+        for _ in range(2):
+            with self.metrics.span('store.commit'):
+                self.clock.now += 1.5
+        self.assertListEqual(self.metrics.spans['store.commit'], [2, 3.0])
+
+    def test_timed_iter(self):
+        def produce():
+            for i in range(3):
+                self.clock.now += 1
+                yield i
+        for _ in self.metrics.timed_iter('decode', produce()):
+            # Time spent by the consumer is not counted
+            self.clock.now += 10
+        self.assertListEqual(self.metrics.spans['decode'], [1, 3.0])
+
+    def test_export(self):
+        with self.metrics.span('battlenet.request'):
+            self.clock.now += 0.25
+        self.metrics.incr('http_bytes_downloaded', 2048)
+        text = self.metrics.prometheus()
+        self.assertIn('eternal_span_seconds_total{span="battlenet.request"} 0.25', text)
+        self.assertIn('eternal_http_bytes_downloaded_total 2048', text)
+        fd, path = tempfile.mkstemp(suffix='.jsonl')
+        os.close(fd)
+        try:
+            self.metrics.write(path, 'jsonl')
+            self.metrics.write(path, 'jsonl')
+            with open(path) as f:
+                records = [json.loads(line) for line in f]
+        finally:
+            os.remove(path)
+        self.assertEqual(len(records), 4)
+        self.assertEqual(records[1]['value'], 2048)
@@ -0,0 +1,72 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from migrations import SCHEMA_VERSION
+from store import Store
+
+legacy_schema = '''
+CREATE TABLE auctions (item_id TEXT NOT NULL, price INTEGER NOT NULL, quantity INTEGER NOT NULL, datetime TEXT NOT NULL);
+CREATE TABLE downloads (datetime TEXT NOT NULL);
+CREATE TABLE recipes (recipe_id INTEGER NOT NULL PRIMARY KEY, profession INTEGER NOT NULL, skilltier INTEGER NOT NULL,
+    name TEXT NOT NULL, item_id TEXT NOT NULL, crafted_quantity INTEGER NOT NULL);
+CREATE TABLE reagents (item_id TEXT NOT NULL PRIMARY KEY, name TEXT NOT NULL, craftable INTEGER NOT NULL);
+CREATE TABLE quantities (item_id TEXT NOT NULL, recipe_id INTEGER NOT NULL, quantity INTEGER NOT NULL);
+CREATE TABLE credentials (client_id TEXT NOT NULL, client_secret TEXT NOT NULL, datetime TEXT NOT NULL);
+CREATE TABLE cache (realm_name INTEGER NOT NULL);
+INSERT INTO recipes VALUES (1, 1, 1, 'test recipe', '1', 1);
+INSERT INTO reagents VALUES ('1', 'item name', 1), ('2', 'reagent 1', 0), ('3', 'reagent 2', 0);
+INSERT INTO quantities VALUES ('2', 1, 2), ('3', 1, 3);
+INSERT INTO downloads VALUES ('2021-01-01 00:00:00'), ('2021-01-01 01:00:00');
+INSERT INTO auctions VALUES ('1', 10, 1, '2021-01-01 00:00:00'), ('2', 2, 5, '2021-01-01 00:00:00'),
+    ('1', 12, 1, '2021-01-01 01:00:00'), ('2', 3, 5, '2021-01-01 01:00:00'), ('3', 4, 8, '2021-01-01 01:00:00');
+INSERT INTO credentials VALUES ('client-id', 'client-secret', '2021-01-01 00:00:00');
+'''
+
+
+class TestMigrations(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        conn = sqlite3.connect(self.path)
+        conn.executescript(legacy_schema)
+        conn.close()
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_migrate_legacy(self):
+        with Store(self.path) as db:
+            version = db.conn.execute('PRAGMA user_version').fetchone()[0]
+            self.assertEqual(version, SCHEMA_VERSION)
+            self.assertEqual(db.get_last_download(), '2021-01-01 01:00:00')
+            self.assertEqual(db.get_price('1')[0], 12)
+            self.assertEqual(len(db.get_reagents_price(1)), 2)
+            self.assertEqual(len(db.get_price_history('reagent 1')), 2)
+            self.assertListEqual(db.get_all_reagent_ids(), ['1', '2', '3'])
+            self.assertEqual(db.get_credentials()[0], 'client-id')
+            # Snapshots from before robust prices were kept have none
+            self.assertTupleEqual(db.get_price_stats('3'), (4, None, None, None, 8))
+            # Existing snapshots get rolled up on first open
+            self.assertEqual(len(db.get_price_series('reagent 1', max_points=1)), 1)
+        # Reopening an up to date database leaves it untouched
+        with Store(self.path) as db:
+            self.assertEqual(db.get_price('3')[0], 4)
+
+    def test_migrate_legacy_realm(self):
+        # Legacy snapshots are priced under the realm they were synced for,
+        # the command line's default without a realm cached by the GUI
+        with Store(self.path) as db:
+            self.assertEqual(db.get_price('1', 154)[0], 12)
+            self.assertDictEqual(db.get_snapshot_prices(154), {'1': 12, '2': 3, '3': 4})
+            self.assertEqual(len(db.get_price_history('reagent 1', 154)), 2)
+
+    def test_migrate_cached_realm(self):
+        conn = sqlite3.connect(self.path)
+        conn.execute("INSERT INTO cache VALUES ('Proudmoore')")
+        conn.commit()
+        conn.close()
+        with Store(self.path) as db:
+            self.assertEqual(db.get_price('1', 5)[0], 12)
+            self.assertIsNone(db.get_last_download(154))
@@ -0,0 +1,46 @@
+import asyncio
+import unittest
+
+from ratelimit import RateLimiter
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class TestRateLimiter(unittest.TestCase):
+    def test_burst_then_rate(self):
+        clock = FakeClock()
+        limiter = RateLimiter([(10, 1)], clock=clock.time, sleep=clock.sleep)
+        for _ in range(10):
+            limiter.acquire()
+        self.assertEqual(clock.now, 0)
+        limiter.acquire()
+        self.assertAlmostEqual(clock.now, 0.1)
+
+    def test_tightest_limit_wins(self):
+        clock = FakeClock()
+        limiter = RateLimiter([(10, 1), (15, 60)], clock=clock.time, sleep=clock.sleep)
+        for _ in range(15):
+            limiter.acquire()
+        # The per-second bucket refilled long ago but the per-minute one has not
+        self.assertAlmostEqual(clock.now, 0.5)
+        limiter.acquire()
+        self.assertAlmostEqual(clock.now, 4)
+
+    def test_acquire_async(self):
+        clock = FakeClock()
+        limiter = RateLimiter([(2, 1)], clock=clock.time, sleep=clock.sleep)
+        asyncio.run(limiter.acquire_async())
+        limiter.acquire()
+        self.assertAlmostEqual(limiter.try_acquire(), 0.5)
+        clock.now += 0.5
+        asyncio.run(limiter.acquire_async())
+        self.assertAlmostEqual(clock.now, 0.5)
@@ -0,0 +1,41 @@
+import unittest
+
+from series import HOUR, SeriesWindow, lttb
+
+
+class TestSeries(unittest.TestCase):
+    def test_lttb(self):
+        points = [(i * HOUR, 10) for i in range(1000)]
+        points[500] = (500 * HOUR, 90)
+        sampled = lttb(points, 50)
+        self.assertEqual(len(sampled), 50)
+        self.assertEqual(sampled[0], points[0])
+        self.assertEqual(sampled[-1], points[-1])
+        # The spike survives thinning by twenty
+        self.assertIn((500 * HOUR, 90), sampled)
+        self.assertListEqual(lttb(points[:10], 50), points[:10])
+
+    def test_window_zoom(self):
+        window = SeriesWindow('item', 154, max_points=100)
+        # Two years of weekly points
+        window.load(None, None, [(i * 7 * 24 * HOUR, 10) for i in range(104)])
+        last = window.last()
+        self.assertIsNone(window.request(0, last))
+        # Panning inside the loaded range needs nothing
+        self.assertIsNone(window.request(last // 2, last))
+        # Zooming in on a month asks for that month and a month either side
+        month = 30 * 24 * HOUR
+        self.assertEqual(window.request(month * 5, month * 6), (month * 4, month * 7))
+        # Near the end the window stays open to follow syncs
+        self.assertEqual(window.request(last - month, last), (last - 2 * month, None))
+
+    def test_window_append(self):
+        window = SeriesWindow('item', 154)
+        window.load(None, None, [(HOUR, 10), (2 * HOUR, 11)])
+        self.assertTrue(window.append([(2 * HOUR, 11), (3 * HOUR, 12)]))
+        self.assertListEqual(window.points, [(HOUR, 10), (2 * HOUR, 11), (3 * HOUR, 12)])
+        self.assertFalse(window.append([(3 * HOUR, 12)]))
+        # A window on an older range leaves new points alone
+        window.load(0, 2 * HOUR, [(HOUR, 10)])
+        self.assertFalse(window.append([(3 * HOUR, 12)]))
+        self.assertIsNone(window.request(HOUR, 2 * HOUR))
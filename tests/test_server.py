@@ -0,0 +1,69 @@
+import json
+import threading
+import unittest
+from datetime import datetime, timedelta
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+from auction import Auction
+from reagent import Reagent
+from recipe import Recipe
+from server import PriceService, make_server
+from store import Store
+
+utc_now = datetime.utcnow()
+
+recipe = Recipe(1, 1, 1, 'test recipe', '1', 1, 'item name')
+recipe.reagents = [
+    Reagent('2', 'reagent 1', 0, 2, 2),
+    Reagent('3', 'reagent 2', 0, 3, 3)
+]
+
+listings = [
+    Auction('1', 1, 20, utc_now),
+    Auction('2', 2, 2, utc_now),
+    Auction('3', 3, 3, utc_now)
+]
+
+
+class TestServer(unittest.TestCase):
+    def setUp(self):
+        self.db = Store(':memory:', check_same_thread=False)
+        self.db.add_recipes([recipe])
+        self.db.add_auctions(listings, utc_now, 154)
+        self.service = PriceService(self.db)
+
+    def tearDown(self):
+        self.db.conn.close()
+
+    def test_cost(self):
+        cost = self.service.cost('test recipe', 154, quantity=2)
+        self.assertEqual(cost['price'], 20)
+        self.assertEqual(cost['cost'], 2 * (2 * 2 + 3 * 3))
+        self.assertIsNone(self.service.cost('unknown', 154))
+
+    def test_graph_follows_snapshots(self):
+        graph = self.service.graph(154)
+        self.assertIs(self.service.graph(154), graph)
+        later = utc_now + timedelta(hours=1)
+        self.db.add_auctions([Auction('2', 1, 1, later)], later, 154)
+        self.assertIsNot(self.service.graph(154), graph)
+        self.assertEqual(self.service.price('reagent 1', 154)['price'], 1)
+
+    def test_http(self):
+        server = make_server(self.service, port=0)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        base = f'http://127.0.0.1:{server.server_address[1]}'
+        try:
+            with urlopen(f'{base}/price?item=reagent%202&realm=154') as response:
+                self.assertEqual(json.load(response)['price'], 3)
+            with urlopen(f'{base}/history?item=reagent%202&realm=154') as response:
+                self.assertEqual(len(json.load(response)['series']), 1)
+            with self.assertRaises(HTTPError) as e:
+                urlopen(f'{base}/price?realm=154')
+            self.assertEqual(e.exception.code, 400)
+            e.exception.close()
+        finally:
+            server.shutdown()
+            server.server_close()
@@ -1,7 +1,9 @@
+import time
 import unittest
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 
 from auction import Auction
+from ladder import PriceLadder
 from reagent import Reagent
 from recipe import Recipe
 from store import Store
@@ -47,6 +49,158 @@ class TestStore(unittest.TestCase):
         self.assertEqual(self.db.get_price('1')[0], 1)
         self.assertEqual(self.db.get_price_by_name('reagent 1')[0], 2)
 
+    def test_get_price_realm(self):
+        realm_now = datetime.utcnow()
+        self.db.add_auctions([Auction('1', 5, 7, realm_now)], realm_now, 4)
+        self.assertEqual(self.db.get_last_download(4), str(realm_now))
+        self.assertIsNone(self.db.get_last_download(5))
+        self.assertEqual(self.db.get_price('1', 4)[0], 7)
+        self.assertIsNone(self.db.get_price_by_name('reagent 1', 4))
+
+    def test_get_last_modified(self):
+        self.assertIsNone(self.db.get_last_modified(4))
+        self.db.add_auctions(listings, utc_now, 4, 'Tue, 20 Apr 2021 18:25:31 GMT')
+        self.assertEqual(self.db.get_last_modified(4), 'Tue, 20 Apr 2021 18:25:31 GMT')
+
+    def test_bulk(self):
+        bulk_now = datetime.utcnow()
+        with self.db.bulk() as load:
+            self.db.add_auctions([Auction('2', 1, 1, bulk_now)], bulk_now, 4)
+            self.db.add_auctions([Auction('3', 1, 1, bulk_now)], bulk_now, 5)
+            self.assertTrue(self.db.conn.in_transaction)
+        self.assertFalse(self.db.conn.in_transaction)
+        # 2 downloads, 2 auctions and their daily and weekly rollups
+        self.assertEqual(load.rows, 8)
+        self.assertGreater(load.rows_per_second, 0)
+        with self.assertRaises(RuntimeError):
+            with self.db.bulk():
+                self.db.add_auctions([Auction('2', 1, 1, bulk_now)], bulk_now, 6)
+                raise RuntimeError()
+        self.assertIsNone(self.db.get_last_download(6))
+
+    def test_get_ladders(self):
+        ladder_now = datetime.utcnow()
+        ladder = PriceLadder.from_levels({2: 5, 3: 10})
+        self.db.add_auctions([Auction('2', 15, 2, ladder_now, ladder)], ladder_now, 4)
+        ladders = self.db.get_ladders(['2', '3'], 4)
+        self.assertListEqual(list(ladders.keys()), ['2'])
+        self.assertListEqual(list(ladders['2'].quantities), [5, 10])
+        self.assertDictEqual(self.db.get_ladders(['2'], 5), {})
+
+    def test_get_price_series(self):
+        db = Store(':memory:')
+        db.add_recipes([recipe])
+        start = datetime(2021, 3, 1)  # a monday
+        for hour in range(24 * 14):
+            snapshot = start + timedelta(hours=hour)
+            db.add_auctions([Auction('2', hour, 100 + hour % 24, snapshot)], snapshot, 4)
+        timestamp = int(start.replace(tzinfo=timezone.utc).timestamp())
+        day = 24 * 60 * 60
+        # Short ranges come straight from the raw snapshots
+        series = db.get_price_series('reagent 1', 4, timestamp, timestamp + day - 1)
+        self.assertEqual(len(series), 24)
+        self.assertTupleEqual(series[1], (timestamp + 3600, 101, 101, 101, 101, 1))
+        # Longer ones from daily open/high/low/close rollups
+        series = db.get_price_series('reagent 1', 4, timestamp, timestamp + 14 * day, max_points=100)
+        self.assertEqual(len(series), 14)
+        self.assertTupleEqual(series[0][:5], (timestamp, 100, 123, 100, 123))
+        series = db.get_price_series('reagent 1', 4, timestamp, timestamp + 14 * day, max_points=10)
+        self.assertEqual(len(series), 2)
+        self.assertAlmostEqual(series[0][5], sum(range(24 * 7)) / (24 * 7))
+        # Pruned raw snapshots are still covered by the rollups
+        db.prune(raw_days=3)
+        self.assertEqual(len(db.get_price_history('reagent 1', 4)), 24 * 3 + 1)
+        series = db.get_price_series('reagent 1', 4, timestamp, timestamp + 14 * day, max_points=100)
+        self.assertEqual(len(series), 14)
+
+    def test_rollups_incremental(self):
+        db = Store(':memory:')
+        db.add_recipes([recipe])
+        start = datetime(2021, 3, 1)
+        hours = list(range(24 * 9))
+        # One snapshot arrives after a later one of its week
+        hours.remove(30)
+        hours.insert(40, 30)
+        for hour in hours:
+            snapshot = start + timedelta(hours=hour)
+            db.add_auctions([Auction('2', hour % 17, 100 + hour % 24, snapshot),
+                             Auction('3', 7, hour + 1, snapshot)], snapshot, 4)
+
+        def rollups():
+            cur = db.conn.execute('SELECT * FROM rollups ORDER BY resolution, realm, period, item_key')
+            return [row[:8] + (round(row[8], 6), row[9]) for row in cur.fetchall()]
+        folded = rollups()
+        db.conn.execute('DELETE FROM rollups')
+        db.rebuild_rollups()
+        self.assertListEqual(folded, rollups())
+        self.assertEqual(len(folded), 2 * (9 + 2))
+
+    def test_delta_snapshots(self):
+        db = Store(':memory:')
+        db.add_recipes([recipe])
+        start = datetime(2021, 3, 1)
+        ladder = PriceLadder.from_levels({5: 1, 6: 2})
+        for snapshot in range(30):
+            at = start + timedelta(minutes=15 * snapshot)
+            # Reagent 1 only changes every tenth snapshot, reagent 2 is
+            # delisted for a while
+            listed = [Auction('2', 3, 5 + snapshot // 10, at, ladder)]
+            if not 12 <= snapshot < 15:
+                listed.append(Auction('3', 1, 9, at))
+            db.add_auctions(listed, at, 4)
+        rows = db.conn.execute('SELECT COUNT(*) FROM auctions').fetchone()[0]
+        # Two keyframes, two price changes and the delisting and relisting
+        self.assertEqual(rows, 2 * 2 + 2 + 2)
+        self.assertEqual(db.conn.execute('SELECT COUNT(*) FROM ladders').fetchone()[0], 2)
+        history = db.get_price_history('reagent 1', 4)
+        self.assertListEqual([price for (item_id, price, quantity, at) in history],
+                             [5 + snapshot // 10 for snapshot in range(30)])
+        self.assertEqual(len(db.get_price_history('reagent 2', 4)), 27)
+        self.assertEqual(db.get_price('2', 4)[0], 7)
+        self.assertListEqual(list(db.get_ladders(['2'], 4)['2'].quantities), [1, 2])
+        self.assertDictEqual(db.get_snapshot_prices(4), {'2': 7, '3': 9})
+        self.assertEqual(db.get_realm_listings(['2', '3'])[4]['2'][:2], (7, 3))
+        # A delisted item's tombstone reads as not listed
+        db.add_auctions([Auction('2', 3, 7, at, ladder)], at + timedelta(minutes=15), 4)
+        self.assertIsNone(db.get_price('3', 4))
+        self.assertIsNone(db.get_price_stats('3', 4))
+        self.assertTupleEqual(db.get_price_stats('2', 4), (7, None, None, None, 3))
+        self.assertListEqual([r[0] for r in db.get_reagents_price(recipe.id, 4)], ['2'])
+
+    def test_get_price_at(self):
+        db = Store(':memory:')
+        db.add_recipes([recipe])
+        start = datetime(2021, 3, 1)
+        for snapshot in range(30):
+            at = start + timedelta(minutes=15 * snapshot)
+            # Realm 5 snapshots land in between realm 4's in the same chain ranges
+            db.add_auctions([Auction('2', 3, 5 + snapshot // 10, at)], at, 4)
+            db.add_auctions([Auction('2', 1, 50 + snapshot, at)] if snapshot < 20 else [], at, 5)
+        timestamp = int(start.replace(tzinfo=timezone.utc).timestamp())
+        self.assertEqual(db.get_price_at('2', 4, timestamp + 15 * 60 * 10), 6)
+        self.assertEqual(db.get_price_at('2', 4, timestamp + 15 * 60 * 10 - 1), 5)
+        self.assertEqual(db.get_price_at('2', 5, timestamp + 15 * 60 * 3 + 60), 53)
+        # Delisted by then, and nothing downloaded yet
+        self.assertIsNone(db.get_price_at('2', 5, timestamp + 15 * 60 * 25))
+        self.assertIsNone(db.get_price_at('2', 4, timestamp - 1))
+        self.assertListEqual([price for (item_id, price, quantity, at) in db.get_price_history('reagent 1', 5)],
+                             [50 + snapshot for snapshot in range(20)])
+
+    def test_item_uses(self):
+        db = Store(':memory:')
+        potion = Recipe(2, 1, 1, 'potion recipe', '4', 1, 'potion')
+        potion.reagents = [Reagent('1', 'item name', 1, 2, 0), Reagent('2', 'reagent 1', 0, 1, 0)]
+        # Crafts reagent 1 back out of the potion, closing a cycle
+        refine = Recipe(3, 1, 1, 'refine recipe', '2', 1, 'reagent 1')
+        refine.reagents = [Reagent('4', 'potion', 1, 1, 0)]
+        db.add_recipes([recipe, potion, refine])
+        self.assertDictEqual(db.get_item_uses('reagent 2'), {1: 1, 2: 2, 3: 3})
+        self.assertDictEqual(db.get_item_uses('reagent 1'), {1: 1, 2: 1, 3: 2})
+        self.assertDictEqual(db.get_item_uses('reagent 2', max_depth=1), {1: 1})
+        self.assertDictEqual(db.get_item_uses('potion'), {1: 2, 2: 2, 3: 1})
+        self.assertIsNone(db.get_item_uses('unknown'))
+        db.conn.close()
+
     def test_get_recipe(self):
         recipe = Recipe(*self.db.get_recipe(1))
         self.assertEqual(recipe.id, 1)
@@ -79,6 +233,46 @@ class TestStore(unittest.TestCase):
         self.db.clear_credentials()
         self.assertIsNone(self.db.get_credentials())
 
+    def test_get_token(self):
+        token = {'access_token': 'token', 'token_type': 'bearer', 'expires_at': time.time() + 3600}
+        self.assertIsNone(self.db.get_token('client-id'))
+        self.db.add_or_replace_token('client-id', token)
+        self.assertEqual(self.db.get_token('client-id')['access_token'], 'token')
+        self.assertIsNone(self.db.get_token('client-id-1'))
+        # Tokens about to expire are not handed out
+        token = {'access_token': 'token-1', 'token_type': 'bearer', 'expires_at': time.time() + 60}
+        self.db.add_or_replace_token('client-id', token)
+        self.assertIsNone(self.db.get_token('client-id'))
+        self.db.add_or_replace_token('client-id', {**token, 'expires_at': time.time() + 3600})
+        self.db.clear_credentials()
+        self.assertIsNone(self.db.get_token('client-id'))
+
+    def test_realms(self):
+        # Seeded from realms.py on first open
+        self.assertEqual(self.db.find_realm('kilrogg'), 4)
+        self.assertEqual(self.db.find_realm('Winterhoof'), 4)
+        self.assertIsNone(self.db.find_realm('Nowhere'))
+        self.assertIn(4, self.db.get_stale_connected_realms(1))
+        # Winterhoof moves to a new connected realm and Kilrogg's closes
+        self.db.update_realms({3678: [(1, 'Winterhoof', 'winterhoof'), (2, 'Aman\'Thul', 'amanthul')]}, [4], 100)
+        self.assertIsNone(self.db.find_realm('Kilrogg'))
+        self.assertEqual(self.db.find_realm('winterhoof'), 3678)
+        self.assertEqual(self.db.find_realm("aman'thul"), 3678)
+        self.assertEqual(self.db.find_realm('2'), 3678)
+        self.assertNotIn(3678, self.db.get_stale_connected_realms(100))
+        self.assertIn(('Winterhoof', 3678), self.db.get_realms())
+
+    def test_search_names(self):
+        self.db.add_recipes([Recipe(2, 1, 1, 'Potion of Reagent Power', '4', 1, 'Potion of Reagent Power')])
+        # Prefix matches first, then shorter names
+        self.assertListEqual(self.db.search_names('reag'),
+                             ['reagent 1', 'reagent 2', 'Potion of Reagent Power'])
+        self.assertListEqual(self.db.search_names('REAGENT', limit=1, offset=1), ['reagent 2'])
+        self.assertListEqual(self.db.search_names('it'), ['item name'])
+        # Misspelt names still find the closest ones
+        self.assertEqual(self.db.search_names('potoin of reagnet')[0], 'Potion of Reagent Power')
+        self.assertListEqual(self.db.search_names('%'), [])
+
     def util_test_creds(self, expected_client_id, expected_client_secret, expected_datetime):
         (client_id, client_secret, datetime) = self.db.get_credentials()
         self.assertEqual(client_id, expected_client_id)